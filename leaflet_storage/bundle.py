@@ -0,0 +1,35 @@
+"""
+Bundle of the datalayers of a map, to load them all in one request.
+
+The bundle is a JSON text sequence (RFC 7464): one frame per datalayer,
+made of a record separator, `{"id": <pk>, "data": <FeatureCollection>}` and
+a line feed. The record separator can not appear in JSON texts, so frames
+can be split as they arrive, and the datalayer files are copied as is,
+without being parsed.
+"""
+import json
+
+BUNDLE_EXT = '.jsonseq'
+CONTENT_TYPE = 'application/json-seq'
+RS = b'\x1e'
+
+
+def write_frame(f_out, pk, f_in, chunk_size=64 * 1024):
+    """
+    Write to `f_out` the frame of datalayer `pk`, whose file is `f_in`.
+    """
+    f_out.write(RS + '{{"id": {}, "data": '.format(int(pk)).encode())
+    for chunk in iter(lambda: f_in.read(chunk_size), b''):
+        f_out.write(chunk)
+    f_out.write(b'}\n')
+
+
+def read_bundle(content):
+    """
+    Return the list of (pk, data) of bundle bytes `content`.
+    """
+    layers = []
+    for frame in content.split(RS)[1:]:
+        layer = json.loads(frame.decode('utf-8'))
+        layers.append((layer['id'], layer['data']))
+    return layers
@@ -0,0 +1,109 @@
+"""
+Cache of the serialized settings of the map pages (see MapDetailMixin).
+
+Entries are keyed by a version of the map and a global version (tile layers
+and licences are listed in every page). Saving or deleting a map or one of
+its datalayers bumps the version of the map, saving or deleting a tile layer
+or a licence the global one (see the receivers in `models`), so stale
+entries are never read again and just expire.
+
+Versions are bumped in the cache of the process handling the change only,
+so the cache must be shared by all the processes (eg. memcached or redis,
+not the default local-memory one): it is disabled unless
+LEAFLET_STORAGE_MAP_SETTINGS_CACHE_TIMEOUT is set.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+PREFIX = 'leaflet_storage:map_settings'
+GLOBAL = 'all'
+
+
+def get_cache():
+    return caches[getattr(settings, 'LEAFLET_STORAGE_MAP_SETTINGS_CACHE',
+                          'default')]
+
+
+def get_timeout():
+    """
+    Seconds to keep an entry, 0 (the default) to disable the cache.
+    """
+    return getattr(settings, 'LEAFLET_STORAGE_MAP_SETTINGS_CACHE_TIMEOUT', 0)
+
+
+def _version_key(scope):
+    return '{}:version:{}'.format(PREFIX, scope)
+
+
+def get_version(scope):
+    cache = get_cache()
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Start from the time rather than 1, so that entries made before the
+        # version was evicted can not be read again.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(scope):
+    try:
+        get_cache().incr(_version_key(scope))
+    except ValueError:
+        pass  # Not set: next get_version will start from a newer value.
+
+
+def _count(name):
+    cache = get_cache()
+    key = '{}:{}'.format(PREFIX, name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_counters():
+    """
+    Return the number of cache hits and misses, for all processes sharing
+    the cache.
+    """
+    cache = get_cache()
+    return dict((name, cache.get('{}:{}'.format(PREFIX, name)) or 0)
+                for name in ('hits', 'misses'))
+
+
+def get_map_settings(map_id, variant, build):
+    """
+    Return the cached settings of map `map_id` for `variant` (eg. locale and
+    permissions), calling `build` to compute them on cache miss.
+    """
+    timeout = get_timeout()
+    if not timeout:
+        return build()
+    cache = get_cache()
+    key = '{}:{}:{}:{}:{}'.format(PREFIX, map_id, get_version(map_id),
+                                  get_version(GLOBAL), variant)
+    value = cache.get(key)
+    if value is None:
+        _count('misses')
+        value = build()
+        cache.set(key, value, timeout)
+    else:
+        _count('hits')
+    return value
+
+
+def map_changed(sender, instance, **kwargs):
+    bump(instance.pk)
+
+
+def datalayer_changed(sender, instance, **kwargs):
+    bump(instance.map_id)
+
+
+def global_changed(sender, instance, **kwargs):
+    bump(GLOBAL)
@@ -0,0 +1,72 @@
+"""
+Delta encoding of datalayer versions.
+
+Only the current version is stored in full; each older version is stored
+as a delta against the next newer one (`<name>.delta`), and rebuilt on
+demand by walking the chain from the current version.
+
+Contents are cut in chunks before each `{"type":` (so roughly one chunk per
+feature and per geometry), and a delta lists, for each run of chunks,
+either a range of chunks of the base or the literal text. Rebuilt contents
+are byte for byte identical to the original ones.
+
+File format: a JSON header line (`base` version name and rebuilt `size`),
+then the zlib compressed JSON list of operations.
+"""
+import json
+import re
+import zlib
+
+DELTA_EXT = '.delta'
+SPLIT = re.compile(br'(?=\{\s*"type"\s*:)')
+
+
+def split_chunks(content):
+    return [chunk for chunk in SPLIT.split(content) if chunk]
+
+
+def make_delta(content, base_content, base_name):
+    """
+    Return the delta bytes to rebuild `content` from `base_content`.
+    """
+    base_index = {}
+    for index, chunk in enumerate(split_chunks(base_content)):
+        base_index.setdefault(chunk, index)
+    operations = []
+    for chunk in split_chunks(content):
+        index = base_index.get(chunk)
+        last = operations[-1] if operations else None
+        if index is None:
+            text = chunk.decode('utf-8')
+            if isinstance(last, list) or last is None:
+                operations.append(text)
+            else:
+                operations[-1] = last + text
+        elif isinstance(last, list) and last[0] + last[1] == index:
+            last[1] += 1
+        else:
+            operations.append([index, 1])
+    header = json.dumps({'base': base_name, 'size': len(content)})
+    body = zlib.compress(json.dumps(operations).encode('utf-8'))
+    return header.encode('utf-8') + b'\n' + body
+
+
+def read_header(f):
+    return json.loads(f.readline().decode('utf-8'))
+
+
+def apply_delta(body, base_content):
+    """
+    Rebuild content from the delta `body` (after the header) and
+    `base_content`.
+    """
+    operations = json.loads(zlib.decompress(body).decode('utf-8'))
+    chunks = split_chunks(base_content)
+    parts = []
+    for operation in operations:
+        if isinstance(operation, list):
+            start, count = operation
+            parts.extend(chunks[start:start + count])
+        else:
+            parts.append(operation.encode('utf-8'))
+    return b''.join(parts)
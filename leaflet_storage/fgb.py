@@ -0,0 +1,315 @@
+"""
+FlatGeobuf export of datalayer features (https://flatgeobuf.org).
+
+The file is made of the magic bytes, a header, a packed Hilbert R-tree and
+the features in tree order, so a client can read the header and the index
+with HTTP range requests, then fetch only the features of its viewport.
+
+Header and features are FlatBuffers tables, written by the small builder
+below, which only knows the few constructs the FlatGeobuf schema uses.
+Only 2D geometries are written; features without geometry are left out.
+"""
+import json
+import struct
+
+from .spatial import HILBERT_MAX, _hilbert, geometry_bbox, merge_bboxes
+
+FGB_EXT = '.fgb'
+CONTENT_TYPE = 'application/octet-stream'
+MAGIC = b'fgb\x03fgb\x00'
+NODE_SIZE = 16
+NODE_ITEM = struct.Struct('<4dQ')
+
+GEOMETRY_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+# Column types, see `ColumnType` in the FlatGeobuf schema.
+BOOL = 2
+LONG = 7
+DOUBLE = 10
+STRING = 11
+JSON = 12
+INT64 = 1 << 63
+
+
+class _Builder(object):
+    """
+    Write FlatBuffers front to back: a table is written after its vtable
+    and before its children, so that all offsets point forward.
+
+    A table is given as a list of (field index, kind, value), where kind is
+    a `struct` format for scalars, 'string', 'vector' (with value
+    (format, items)), 'table' (with value a table) or 'tables'.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def align(self, size):
+        self.buf.extend(b'\x00' * (-len(self.buf) % size))
+
+    def root(self, table):
+        self.buf.extend(b'\x00' * 4)
+        self._patch(0, self.table(table))
+        return bytes(self.buf)
+
+    def _patch(self, pos, target):
+        struct.pack_into('<I', self.buf, pos, target - pos)
+
+    def table(self, fields):
+        inline = []
+        for index, kind, value in fields:
+            size = struct.calcsize('<' + kind) if len(kind) == 1 else 4
+            inline.append((size, index, kind, value))
+        # Largest first, so that fields are aligned without padding.
+        inline.sort(key=lambda field: -field[0])
+        slots, size = {}, 4
+        for field_size, index, kind, value in inline:
+            size += -size % field_size
+            slots[index] = size
+            size += field_size
+        count = max(slots) + 1 if slots else 0
+        self.align(2)
+        vtable = len(self.buf)
+        self.buf.extend(struct.pack('<HH', 4 + 2 * count, size))
+        self.buf.extend(struct.pack('<{}H'.format(count),
+                                    *(slots.get(i, 0) for i in range(count))))
+        self.align(8)
+        start = len(self.buf)
+        self.buf.extend(struct.pack('<i', start - vtable))
+        self.buf.extend(b'\x00' * (size - 4))
+        children = []
+        for field_size, index, kind, value in inline:
+            if len(kind) == 1:
+                struct.pack_into('<' + kind, self.buf, start + slots[index],
+                                 value)
+            else:
+                children.append((start + slots[index], kind, value))
+        for pos, kind, value in children:
+            self._patch(pos, getattr(self, kind)(value))
+        return start
+
+    def string(self, value):
+        data = value.encode('utf-8')
+        self.align(4)
+        start = len(self.buf)
+        self.buf.extend(struct.pack('<I', len(data)) + data + b'\x00')
+        return start
+
+    def vector(self, value):
+        kind, items = value
+        size = struct.calcsize('<' + kind)
+        self.buf.extend(b'\x00' * (-(len(self.buf) + 4) % max(size, 4)))
+        start = len(self.buf)
+        self.buf.extend(struct.pack('<I', len(items)))
+        self.buf.extend(struct.pack('<{}{}'.format(len(items), kind), *items))
+        return start
+
+    def tables(self, items):
+        self.align(4)
+        start = len(self.buf)
+        self.buf.extend(struct.pack('<I', len(items)))
+        self.buf.extend(b'\x00' * 4 * len(items))
+        for i, table in enumerate(items):
+            self._patch(start + 4 + 4 * i, self.table(table))
+        return start
+
+
+def _size_prefixed(table):
+    data = _Builder().root(table)
+    return struct.pack('<I', len(data)) + data
+
+
+def _flatten(coordinates, xy, ends=None):
+    """
+    Append the 2D positions of `coordinates` (a list of rings or lines when
+    `ends` is given) to `xy`, and the cumulated count of positions at the
+    end of each ring to `ends`.
+    """
+    if ends is None:
+        for position in coordinates:
+            xy.extend(position[:2])
+        return
+    for ring in coordinates:
+        _flatten(ring, xy)
+        ends.append(len(xy) // 2)
+
+
+def _geometry(geometry):
+    kind = geometry['type']
+    fields = [(6, 'B', GEOMETRY_TYPES[kind])]
+    xy, ends = [], []
+    if kind == 'GeometryCollection':
+        parts = [_geometry(g) for g in geometry.get('geometries') or []]
+    elif kind == 'MultiPolygon':
+        parts = [_geometry({'type': 'Polygon', 'coordinates': polygon})
+                 for polygon in geometry['coordinates']]
+    else:
+        parts = None
+        coordinates = geometry['coordinates']
+        if kind == 'Point':
+            coordinates = [coordinates]
+        if kind in ('Polygon', 'MultiLineString'):
+            _flatten(coordinates, xy, ends)
+        else:
+            _flatten(coordinates, xy)
+    if ends and len(ends) > 1:
+        fields.append((0, 'vector', ('I', ends)))
+    if xy:
+        fields.append((1, 'vector', ('d', xy)))
+    if parts:
+        fields.append((7, 'tables', parts))
+    return fields
+
+
+def _column_type(values):
+    types = set(type(value) for value in values)
+    if types == {bool}:
+        return BOOL
+    if types <= {int, float} and bool not in types:
+        if float in types:
+            return DOUBLE
+        if all(-INT64 <= value < INT64 for value in values):
+            return LONG
+    if types == {str}:
+        return STRING
+    return JSON
+
+
+def _columns(features):
+    """
+    Return the list of (name, type) of the properties of `features`.
+    """
+    values = {}
+    for feature in features:
+        for key, value in (feature.get('properties') or {}).items():
+            if value is not None:
+                values.setdefault(key, []).append(value)
+            else:
+                values.setdefault(key, [])
+    return [(key, _column_type(items)) for key, items in values.items()]
+
+
+def _properties(properties, columns):
+    data = bytearray()
+    for index, (name, kind) in enumerate(columns):
+        value = properties.get(name)
+        if value is None:
+            continue
+        data.extend(struct.pack('<H', index))
+        if kind == BOOL:
+            data.extend(struct.pack('<?', value))
+        elif kind == LONG:
+            data.extend(struct.pack('<q', value))
+        elif kind == DOUBLE:
+            data.extend(struct.pack('<d', value))
+        else:
+            if kind == JSON:
+                value = json.dumps(value)
+            text = value.encode('utf-8')
+            data.extend(struct.pack('<I', len(text)) + text)
+    return data
+
+
+def _level_bounds(num_items, node_size):
+    """
+    Return the (start, end) node positions of each level of the tree, from
+    leaves to root, the root being the first node.
+
+    As in the reference implementation, there is always a root above the
+    leaves, even for a single item.
+    """
+    counts = [num_items]
+    n = num_items
+    while True:
+        n = -(-n // node_size)
+        counts.append(n)
+        if n == 1:
+            break
+    bounds, end = [], sum(counts)
+    for count in counts:
+        bounds.append((end - count, end))
+        end -= count
+    return bounds
+
+
+def _index(boxes, offsets, node_size=NODE_SIZE):
+    """
+    Return the packed R-tree bytes of the leaves (`boxes`, `offsets`),
+    already in Hilbert order.
+    """
+    bounds = _level_bounds(len(boxes), node_size)
+    nodes = [None] * bounds[0][1]
+    start = bounds[0][0]
+    for i, box in enumerate(boxes):
+        nodes[start + i] = (box, offsets[i])
+    for (start, end), (parent, _) in zip(bounds, bounds[1:]):
+        for child in range(start, end, node_size):
+            box = merge_bboxes(node[0]
+                               for node in nodes[child:child + node_size])
+            nodes[parent] = (box, child)
+            parent += 1
+    return b''.join(NODE_ITEM.pack(*(tuple(box) + (offset, )))
+                    for box, offset in nodes)
+
+
+def dump_flatgeobuf(data, name=''):
+    """
+    Return FlatGeobuf bytes of FeatureCollection `data`.
+    """
+    features = []
+    for feature in data.get('features') or []:
+        geometry = feature.get('geometry')
+        if not geometry or geometry.get('type') not in GEOMETRY_TYPES:
+            continue
+        box = geometry_bbox(geometry)
+        if box:
+            features.append((box, feature))
+    envelope = merge_bboxes(box for box, feature in features)
+    if envelope:
+        minx, miny, maxx, maxy = envelope
+        width = (maxx - minx) or 1
+        height = (maxy - miny) or 1
+
+        def key(item):
+            box = item[0]
+            x = (box[0] + box[2]) / 2
+            y = (box[1] + box[3]) / 2
+            return _hilbert(int(HILBERT_MAX * (x - minx) / width),
+                            int(HILBERT_MAX * (y - miny) / height))
+
+        features.sort(key=key)
+    columns = _columns(feature for box, feature in features)
+    types = set(feature['geometry']['type'] for box, feature in features)
+    header = [
+        (0, 'string', name or ''),
+        (2, 'B', GEOMETRY_TYPES[types.pop()] if len(types) == 1 else 0),
+        (8, 'Q', len(features)),
+        (9, 'H', NODE_SIZE if features else 0),
+        (10, 'table', [(0, 'string', 'EPSG'), (1, 'i', 4326)]),
+    ]
+    if envelope:
+        header.append((1, 'vector', ('d', envelope)))
+    if columns:
+        header.append((7, 'tables', [[(0, 'string', column), (1, 'B', kind)]
+                                     for column, kind in columns]))
+    chunks, offsets, offset = [], [], 0
+    for box, feature in features:
+        fields = [(0, 'table', _geometry(feature['geometry']))]
+        properties = _properties(feature.get('properties') or {}, columns)
+        if properties:
+            fields.append((1, 'vector', ('B', properties)))
+        chunk = _size_prefixed(fields)
+        chunks.append(chunk)
+        offsets.append(offset)
+        offset += len(chunk)
+    index = _index([box for box, feature in features], offsets) \
+        if features else b''
+    return MAGIC + _size_prefixed(header) + index + b''.join(chunks)
@@ -7,8 +7,11 @@ from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 from django.conf import settings
 from django.forms.utils import ErrorList
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
 
 from .models import Map, DataLayer
+from .validation import validate, GeoJSONError
 
 DEFAULT_LATITUDE = settings.LEAFLET_LATITUDE if hasattr(settings, "LEAFLET_LATITUDE") else 51
 DEFAULT_LONGITUDE = settings.LEAFLET_LONGITUDE if hasattr(settings, "LEAFLET_LONGITUDE") else 2
@@ -55,8 +58,39 @@ class AnonymousMapPermissionsForm(forms.ModelForm):
         fields = ('edit_status', )
 
 
+def check_datalayer_size(size):
+    """
+    Raise a ValidationError if `size` (bytes) is over
+    LEAFLET_STORAGE_DATALAYER_MAX_SIZE.
+    """
+    max_size = getattr(settings, 'LEAFLET_STORAGE_DATALAYER_MAX_SIZE', None)
+    if max_size and size > max_size:
+        raise forms.ValidationError(
+            _('Data is too big (%(size)s, max is %(max)s).') % {
+                'size': filesizeformat(size),
+                'max': filesizeformat(max_size)})
+
+
 class DataLayerForm(forms.ModelForm):
 
+    def clean_geojson(self):
+        """
+        Validate uploaded GeoJSON by streaming it, before it is written to
+        the storage. The resulting summary (features count and bbox) is kept
+        as `self.geojson_summary`.
+        """
+        geojson = self.cleaned_data.get('geojson')
+        self.geojson_summary = None
+        if not isinstance(geojson, UploadedFile):
+            return geojson  # Unchanged.
+        check_datalayer_size(geojson.size)
+        try:
+            self.geojson_summary = validate(geojson.chunks())
+        except GeoJSONError as e:
+            raise forms.ValidationError(_('Invalid GeoJSON: %s') % e)
+        geojson.seek(0)
+        return geojson
+
     class Meta:
         model = DataLayer
         fields = ('geojson', 'name', 'display_on_load', 'rank')
@@ -0,0 +1,102 @@
+"""
+Streaming of datalayer features one by one, as GeoJSON text sequence
+(RFC 8142: each feature prefixed by a record separator) or newline
+delimited GeoJSON.
+
+Features are extracted from the stored FeatureCollection as it is read
+(see `validation.iter_tokens`), so memory only depends on the largest
+feature, and consumers can use the first features before the last ones
+are sent.
+"""
+from .validation import GeoJSONError, iter_tokens
+
+FORMATS = {
+    'geojsonseq': 'application/geo+json-seq',
+    'ndjson': 'application/x-ndjson',
+}
+RS = b'\x1e'
+CHUNK_SIZE = 64 * 1024
+
+
+def _next(tokens):
+    kind, raw = next(tokens)
+    if kind is None:
+        raise GeoJSONError('Unexpected end of data')
+    return kind, raw
+
+
+def _token_text(kind, raw):
+    if kind == 'string':
+        return u'"{}"'.format(raw)
+    if kind == 'position':
+        return u''.join(raw.split())  # May span lines.
+    return raw
+
+
+def _value_text(kind, raw, tokens):
+    """
+    Return the compact text of the value starting with token (kind, raw),
+    consuming its tokens.
+    """
+    if kind != 'punctuation':
+        return _token_text(kind, raw)
+    if raw not in u'[{':
+        raise GeoJSONError('Unexpected "{}"'.format(raw))
+    parts, depth = [raw], 1
+    while depth:
+        kind, raw = _next(tokens)
+        if kind == 'punctuation':
+            if raw in u'[{':
+                depth += 1
+            elif raw in u']}':
+                depth -= 1
+        parts.append(_token_text(kind, raw))
+    return u''.join(parts)
+
+
+def iter_features(chunks):
+    """
+    Yield the features of a FeatureCollection given as an iterable of bytes
+    `chunks`, each as compact JSON bytes.
+    """
+    tokens = iter_tokens(chunks)
+    if _next(tokens) != ('punctuation', u'{'):
+        raise GeoJSONError('Not a FeatureCollection')
+    while True:
+        kind, raw = _next(tokens)
+        if kind == 'punctuation' and raw == u'}':
+            return
+        if kind == 'punctuation' and raw == u',':
+            continue
+        if kind != 'string':
+            raise GeoJSONError('Expected a string')
+        if _next(tokens) != ('punctuation', u':'):
+            raise GeoJSONError('Expected ":"')
+        kind, value = _next(tokens)
+        if raw != u'features' or (kind, value) != ('punctuation', u'['):
+            _value_text(kind, value, tokens)  # Other member, skip it.
+            continue
+        while True:
+            kind, raw = _next(tokens)
+            if kind == 'punctuation' and raw == u']':
+                break
+            if kind == 'punctuation' and raw == u',':
+                continue
+            yield _value_text(kind, raw, tokens).encode('utf-8')
+
+
+def dump_sequence(features, format):
+    """
+    Yield the bytes of the `format` sequence of encoded `features`, by
+    chunks.
+    """
+    prefix = RS if format == 'geojsonseq' else b''
+    parts, size = [], 0
+    for feature in features:
+        parts.append(prefix + feature + b'\n')
+        size += len(feature) + 2
+        if size >= CHUNK_SIZE:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from leaflet_storage.models import DataLayer
+
+
+class Command(BaseCommand):
+    help = ('Record in the versions index the datalayers versions saved '
+            'before it existed. '
+            'Eg.: python manage.py index_versions')
+
+    def handle(self, *args, **options):
+        qs = DataLayer.objects.exclude(geojson='').select_related('map')
+        for datalayer in qs.iterator():
+            count = datalayer.index_versions()
+            if count:
+                self.stdout.write('Indexed {} versions of datalayer {}'.format(
+                    count, datalayer.pk))
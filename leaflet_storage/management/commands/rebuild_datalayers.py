@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from leaflet_storage.models import DataLayer
+
+
+class Command(BaseCommand):
+    help = ('Compute the data derived from the datalayers files, for layers '
+            'saved before it was stored. '
+            'Eg.: python manage.py rebuild_datalayers --all')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Rebuild all datalayers, not only the '
+                                 'incomplete ones.')
+
+    def handle(self, *args, **options):
+        qs = DataLayer.objects.exclude(geojson='')
+        if not options['all']:
+            qs = qs.filter(Q(content_hash='') | Q(stats__isnull=True))
+        for datalayer in qs.iterator():
+            datalayer.update_content_hash()
+            datalayer.update_stats(datalayer.build_derived())
+            self.stdout.write('Rebuilt datalayer {}'.format(datalayer.pk))
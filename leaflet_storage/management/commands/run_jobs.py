@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage.models import Job
+
+
+class Command(BaseCommand):
+    help = ('Run the pending storage jobs (versions purge, files deletion), '
+            'when LEAFLET_STORAGE_ASYNC_JOBS is set. '
+            'Eg.: python manage.py run_jobs --loop')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Max number of jobs per batch.')
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep running, waiting for new jobs.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when there is no job.')
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = Job.run_pending(options['limit'])
+            if done or failed:
+                self.stdout.write('{} jobs done, {} failed'.format(done,
+                                                                   failed))
+            if not options['loop']:
+                break
+            if done + failed < options['limit']:
+                time.sleep(options['interval'])
@@ -0,0 +1,53 @@
+from multiprocessing import Pool, cpu_count
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from leaflet_storage import mvt
+from leaflet_storage.models import DataLayer
+
+
+def seed(task):
+    datalayer, z, x, y = task
+    datalayer.get_tile(z, x, y)
+
+
+class Command(BaseCommand):
+    help = ('Generate the vector tiles of datalayers for low zooms, to warm '
+            'the cache. Eg.: python manage.py seed_tiles --max-zoom 5 1234')
+
+    def add_arguments(self, parser):
+        parser.add_argument('pk', nargs='*',
+                            help='PK of the datalayers to seed '
+                                 '(default: all).')
+        parser.add_argument('--max-zoom', type=int, default=5,
+                            help='Seed tiles from zoom 0 up to this zoom.')
+        parser.add_argument('--processes', type=int, default=cpu_count(),
+                            help='Number of worker processes.')
+
+    def handle(self, *args, **options):
+        qs = DataLayer.objects.exclude(geojson='').select_related('map')
+        if options['pk']:
+            qs = qs.filter(pk__in=options['pk'])
+        tasks = []
+        for datalayer in qs:
+            if not datalayer.is_local():
+                continue  # No tiles, see DataLayerTile.
+            if not datalayer.content_hash:
+                datalayer.update_content_hash()
+            extent = datalayer.get_extent()
+            if not extent:
+                continue
+            for z in range(options['max_zoom'] + 1):
+                for x, y in mvt.tiles_for_bbox(extent, z):
+                    tasks.append((datalayer, z, x, y))
+        # Workers are forked: they must not share the parent connections.
+        connections.close_all()
+        pool = Pool(options['processes'])
+        try:
+            for _ in pool.imap_unordered(seed, tasks, 16):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write('Seeded {} tiles'.format(len(tasks)))
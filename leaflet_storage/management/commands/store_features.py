@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from leaflet_storage.models import DataLayer
+
+
+class Command(BaseCommand):
+    help = ('Copy to the features table the features of the datalayers '
+            'saved before LEAFLET_STORAGE_FEATURES_BACKEND was "postgis" '
+            '(or remove them if it is not anymore). '
+            'Eg.: python manage.py store_features')
+
+    def handle(self, *args, **options):
+        qs = DataLayer.objects.exclude(geojson='').select_related('map')
+        for datalayer in qs.iterator():
+            datalayer.store_features()
+            if datalayer.members:
+                self.stdout.write('Stored features of datalayer {}'.format(
+                    datalayer.pk))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leaflet_storage', '0005_datalayer_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataLayerVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('at', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('content_hash', models.CharField(blank=True, max_length=32)),
+                ('datalayer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='version_entries', to='leaflet_storage.DataLayer')),
+            ],
+            options={
+                'ordering': ('-at', '-name'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='datalayerversion',
+            unique_together=set([('datalayer', 'name')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import leaflet_storage.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leaflet_storage', '0008_content_addressed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datalayer',
+            name='members',
+            field=leaflet_storage.fields.DictField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='Feature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('data', models.TextField()),
+                ('geom', django.contrib.gis.db.models.fields.GeometryField(null=True, srid=4326)),
+                ('datalayer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leaflet_storage.DataLayer')),
+            ],
+            options={
+                'ordering': ('rank',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='feature',
+            index_together=set([('datalayer', 'rank')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import leaflet_storage.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leaflet_storage', '0009_feature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datalayer',
+            name='stats',
+            field=leaflet_storage.fields.DictField(blank=True, editable=False, null=True),
+        ),
+    ]
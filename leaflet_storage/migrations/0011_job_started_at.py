@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leaflet_storage', '0010_datalayer_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,19 +1,41 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+import errno
+import hashlib
+import json
 import os
+import tempfile
 import time
 
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.gis.geos import Polygon
 from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.core.signing import Signer
 from django.contrib import messages
 from django.template.defaultfilters import slugify
 from django.core.files.base import File
+from django.utils.encoding import force_bytes
 
+from . import cache
 from .fields import DictField
 from .managers import PublicManager
+from . import fgb, mvt, simplify, spatial, topojson
+from .stats import collection_stats
+from .bundle import BUNDLE_EXT, write_frame
+from .delta import DELTA_EXT, make_delta, apply_delta, read_header
+from .utils import (file_md5, compress_stored, get_encodings,
+                    get_simplify_zooms, link_or_copy, local_path,
+                    replace_stored, save_stored, delete_stored_tree,
+                    delete_stored_derived, delete_stored_prefix,
+                    stored_mtime, ENCODINGS, EXTENSIONS)
 
 
 class NamedModel(models.Model):
@@ -208,6 +230,21 @@ class Map(NamedModel):
     def get_tilelayer(self):
         return self.tilelayer or TileLayer.get_default()
 
+    def datalayers_root(self):
+        path = ["datalayer", str(self.pk)[-1]]
+        if len(str(self.pk)) > 1:
+            path.append(str(self.pk)[-2])
+        path.append(str(self.pk))
+        return os.path.join(*path)
+
+    def delete(self, *args, **kwargs):
+        # Datalayers are deleted in cascade, without calling their delete.
+        Job.enqueue('delete_files', trees=[self.datalayers_root()])
+        release_blobs(list(DataLayerVersion.objects.filter(
+            datalayer__map=self).exclude(blob='').values_list(
+            'blob', flat=True)))
+        return super(Map, self).delete(*args, **kwargs)
+
     def clone(self, **kwargs):
         new = self.__class__.objects.get(pk=self.pk)
         new.pk = None
@@ -216,12 +253,107 @@ class Map(NamedModel):
             # can be None in case of anonymous cloning
             new.owner = kwargs["owner"]
         new.save()
-        for editor in self.editors.all():
-            new.editors.add(editor)
-        for datalayer in self.datalayer_set.all():
-            datalayer.clone(map_inst=new)
+        new.editors.add(*self.editors.values_list('pk', flat=True))
+        DataLayer.bulk_clone(self.datalayer_set.all(), new)
+        new.schedule_bundle()
         return new
 
+    def bundled_datalayers(self):
+        return self.datalayer_set.filter(display_on_load=True).exclude(
+            geojson='')
+
+    def get_bundle_name(self, layers=None):
+        """
+        Storage name of the bundle (see `bundle`) of the datalayers displayed
+        on load, given as (pk, content_hash) by rank. It changes with them,
+        so it identifies the bundle content.
+        """
+        if layers is None:
+            layers = self.bundled_datalayers().values_list('pk',
+                                                           'content_hash')
+        key = hashlib.md5(force_bytes(u','.join(
+            u'{}:{}'.format(pk, content_hash)
+            for pk, content_hash in layers))).hexdigest()
+        return os.path.join(self.datalayers_root(), 'bundles',
+                            key + BUNDLE_EXT)
+
+    def build_bundle(self):
+        """
+        Write the bundle of the datalayers displayed on load, precompressed,
+        delete the older ones, and return its name. Nothing is written if
+        it is already built (eg. only metadata changed).
+        """
+        storage = DataLayer._meta.get_field('geojson').storage
+        datalayers = list(self.bundled_datalayers())
+        name = self.get_bundle_name([(datalayer.pk, datalayer.content_hash)
+                                     for datalayer in datalayers])
+        names = [name] + [name + EXTENSIONS[encoding]
+                          for encoding in get_encodings()]
+        if all(storage.exists(n) for n in names):
+            return name
+        with tempfile.TemporaryFile() as f:
+            for datalayer in datalayers:
+                with storage.open(datalayer.geojson.name, 'rb') as f_in:
+                    write_frame(f, datalayer.pk, f_in)
+            f.seek(0)
+            replace_stored(storage, name, File(f))
+        for encoding in get_encodings():
+            compress_stored(storage, name, name + EXTENSIONS[encoding],
+                            encoding)
+        self.purge_bundles(name)
+        return name
+
+    def purge_bundles(self, name):
+        """
+        Delete the bundles older than bundle `name`, but the previous one,
+        which may still be served. Newer ones, and the ones being written
+        (see atomic_path), are from concurrent builds.
+        """
+        storage = DataLayer._meta.get_field('geojson').storage
+        root, basename = os.path.split(name)
+        key = basename.split('.')[0]
+        current = stored_mtime(storage, name)
+        files, mtimes = {}, {}
+        for filename in storage.listdir(root)[1]:
+            other = filename.split('.')[0]
+            if other == key or filename.endswith('.tmp'):
+                continue
+            try:
+                mtime = stored_mtime(storage, os.path.join(root, filename))
+            except (IOError, OSError):
+                continue  # Deleted in the meantime.
+            files.setdefault(other, []).append(filename)
+            mtimes[other] = max(mtimes.get(other, mtime), mtime)
+        older = sorted((mtime, other) for other, mtime in mtimes.items()
+                       if mtime <= current)
+        for mtime, other in older[:-1]:
+            for filename in files[other]:
+                try:
+                    storage.delete(os.path.join(root, filename))
+                except FileNotFoundError:
+                    pass
+
+    def get_bundle(self):
+        """
+        Return the name of the current bundle, building it if it is missing
+        (eg. its build job is still pending).
+        """
+        storage = DataLayer._meta.get_field('geojson').storage
+        name = self.get_bundle_name()
+        if not storage.exists(name):
+            name = self.build_bundle()
+        return name
+
+    def schedule_bundle(self):
+        """
+        Build the bundle out of the request path when jobs are run by a
+        worker. Otherwise, it is built by the next `get_bundle` call, so
+        writes do not pay for it.
+        """
+        if getattr(settings, 'LEAFLET_STORAGE_ASYNC_JOBS', False):
+            Job.enqueue('build_bundle', key='build_bundle:{}'.format(self.pk),
+                        map=self.pk)
+
 
 class Pictogram(NamedModel):
     """
@@ -266,15 +398,29 @@ class DataLayer(NamedModel):
         help_text=_("Display this layer on load.")
     )
     rank = models.SmallIntegerField(default=0)
+    content_hash = models.CharField(max_length=32, blank=True,
+                                    editable=False)
+    # FeatureCollection members other than features, when the features are
+    # in the features table (see Feature); empty otherwise.
+    members = DictField(blank=True, null=True, editable=False)
+    # Statistics of the current content, see `stats`.
+    stats = DictField(blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ('rank',)
 
     def save(self, force_insert=False, force_update=False, **kwargs):
         is_new = not bool(self.pk)
+        has_new_content = bool(self.geojson) and not self.geojson._committed
+        blob_written = False
+        if has_new_content:
+            # New content: hash it once here, instead of at each request.
+            self.content_hash = file_md5(self.geojson)
+            if is_content_addressed():
+                blob_written = self.store_blob()
         super(DataLayer, self).save(force_insert, force_update, **kwargs)
 
-        if is_new:
+        if is_new and not self.is_blob():
             force_insert, force_update = False, True
             filename = self.upload_to()
             old_name = self.geojson.name
@@ -282,7 +428,298 @@ class DataLayer(NamedModel):
             self.geojson.storage.delete(old_name)
             self.geojson.name = new_name
             super(DataLayer, self).save(force_insert, force_update, **kwargs)
-        self.purge_old_versions()
+        if has_new_content:
+            self.add_version()
+            data = None
+            if blob_written or not self.is_blob():
+                data = self.build_derived()
+            self.store_features(data)
+            self.update_stats(data)
+            self.purge_tiles()
+        Job.enqueue('purge_versions', key='purge_versions:{}'.format(self.pk),
+                    datalayer=self.pk)
+        if has_new_content:
+            # Only a new version can leave a previous one in full.
+            Job.enqueue('compact_versions',
+                        key='compact_versions:{}'.format(self.pk),
+                        datalayer=self.pk)
+        self.map.schedule_bundle()
+
+    def delete(self, *args, **kwargs):
+        # All the files named after the layer, even versions not indexed.
+        prefix = os.path.join(self.storage_root(), '%s_' % self.pk)
+        Job.enqueue('delete_files', prefixes=[prefix],
+                    trees=[self.tiles_root()])
+        release_blobs([blob for blob in self.version_entries.exclude(
+            blob='').values_list('blob', flat=True)])
+        deleted = super(DataLayer, self).delete(*args, **kwargs)
+        self.map.schedule_bundle()
+        return deleted
+
+    def is_blob(self):
+        return bool(self.geojson) and self.geojson.name.startswith(
+            BLOBS_ROOT + '/')
+
+    def store_blob(self):
+        """
+        Point the geojson field to the content addressed blob of its new
+        content, only writing it if no other version has the same content.
+        Return whether it was written.
+        """
+        name = blob_name(self.content_hash)
+        Blob.acquire(name)
+        storage = self.geojson.storage
+        written = not storage.exists(name)
+        if written:
+            # Concurrent first saves write the same content: replace rather
+            # than let the storage pick an alternate name.
+            replace_stored(storage, name, self.geojson.file)
+        self.geojson.name = name
+        self.geojson._committed = True
+        return written
+
+    def update_content_hash(self):
+        """
+        Compute hash from the stored file, for data saved before the hash
+        was stored.
+        """
+        self.content_hash = file_md5(self.geojson)
+        self.geojson.close()
+        self.__class__.objects.filter(pk=self.pk).update(
+            content_hash=self.content_hash)
+
+    def build_derived(self):
+        """
+        Generate the files derived from the current version, next to it, so
+        the read path never has to. Return the parsed data, if any.
+        """
+        self.compress()
+        data = self.read_data()
+        if data is not None:
+            if self.is_local():
+                # bbox queries and tiles need random access to the files.
+                self.build_index(data)
+            self.build_simplified(data)
+            self.build_topojson(data)
+            self.build_flatgeobuf(data)
+        return data
+
+    @staticmethod
+    def simplified_ext(zoom):
+        return '.z{}'.format(zoom)
+
+    @classmethod
+    def derived_extensions(cls):
+        encodings = [''] + [ext for encoding, ext in ENCODINGS]
+        variants = [''] + [cls.simplified_ext(z) for z in get_simplify_zooms()]
+        variants.append(topojson.TOPOJSON_EXT)
+        extensions = [v + e for v in variants for e in encodings]
+        return extensions[1:] + [spatial.SEQ_EXT, spatial.INDEX_EXT,
+                                 fgb.FGB_EXT]
+
+    def read_data(self):
+        """
+        Return current GeoJSON as a dict, or None if it is not an object.
+        """
+        with self.geojson.storage.open(self.geojson.name, 'rb') as f:
+            try:
+                data = json.loads(f.read().decode('utf-8'))
+            except ValueError:
+                return None
+        return data if isinstance(data, dict) else None
+
+    def compress(self, name=None):
+        """
+        Precompress current file (or stored file `name`) in each enabled
+        encoding, so the read path never has to.
+        """
+        name = name or self.geojson.name
+        for encoding in get_encodings():
+            compress_stored(self.geojson.storage, name,
+                            name + EXTENSIONS[encoding], encoding)
+
+    def is_local(self):
+        return local_path(self.geojson.storage, self.geojson.name) is not None
+
+    def derived_name(self, ext):
+        return self.geojson.name + ext
+
+    def derived_path(self, ext):
+        # Only for local files (see is_local): raises NotImplementedError
+        # otherwise.
+        return self.geojson.path + ext
+
+    def build_index(self, data=None):
+        """
+        Build the spatial index used by bbox queries and tiles. Data that
+        is not a GeoJSON object is indexed as empty.
+        """
+        if data is None:
+            data = self.read_data() or {}
+        spatial.build_index(data, self.derived_path(spatial.SEQ_EXT),
+                            self.derived_path(spatial.INDEX_EXT))
+
+    def build_simplified(self, data):
+        """
+        Write a simplified, precompressed, variant of `data` for each zoom
+        of LEAFLET_STORAGE_SIMPLIFY_ZOOMS, unless it would not remove any
+        position.
+        """
+        features = data.get('features') or []
+        junctions = simplify.find_junctions(features)
+        pixels = getattr(settings, 'LEAFLET_STORAGE_SIMPLIFY_PIXELS', 1)
+        for zoom in get_simplify_zooms():
+            tolerance = simplify.zoom_tolerance(zoom, pixels)
+            variant = simplify.simplify_collection(data, tolerance,
+                                                   junctions)
+            if variant is None:
+                continue
+            name = self.derived_name(self.simplified_ext(zoom))
+            save_stored(self.geojson.storage, name,
+                        json.dumps(variant, separators=(',', ':'))
+                        .encode('utf-8'))
+            self.compress(name)
+
+    def get_quantization(self):
+        """
+        Map `quantization` setting, or LEAFLET_STORAGE_TOPOJSON_QUANTIZATION.
+        """
+        default = getattr(settings, 'LEAFLET_STORAGE_TOPOJSON_QUANTIZATION',
+                          100000)
+        properties = (self.map.settings or {}).get('properties') or {}
+        try:
+            quantization = int(properties.get('quantization', default))
+        except (TypeError, ValueError):
+            quantization = default
+        return max(quantization, 2)
+
+    def build_topojson(self, data):
+        """
+        Write the quantized TopoJSON variant of `data`, precompressed.
+        """
+        topology = topojson.dump_topology(data, self.get_quantization())
+        name = self.derived_name(topojson.TOPOJSON_EXT)
+        save_stored(self.geojson.storage, name,
+                    json.dumps(topology, separators=(',', ':'))
+                    .encode('utf-8'))
+        self.compress(name)
+
+    def build_flatgeobuf(self, data):
+        """
+        Write the FlatGeobuf variant of `data`. It is not compressed: clients
+        read it by byte ranges.
+        """
+        save_stored(self.geojson.storage, self.derived_name(fgb.FGB_EXT),
+                    fgb.dump_flatgeobuf(data, self.name))
+
+    def ensure_index(self):
+        if not os.path.exists(self.derived_path(spatial.INDEX_EXT)):
+            # Layer saved before indexes existed.
+            self.build_index()
+
+    def uses_features_table(self):
+        return uses_features_table() and bool(self.members)
+
+    def store_features(self, data=None):
+        """
+        Copy the current features to the features table, when enabled (see
+        Feature). Data the table can not hold (eg. invalid geometries) is
+        left to the file backend.
+        """
+        enabled = uses_features_table()
+        if not enabled and not self.members:
+            return
+        Feature.objects.filter(datalayer=self).delete()
+        members = {}
+        if enabled and data is None:
+            data = self.read_data()
+        if enabled and data is not None:
+            try:
+                with transaction.atomic():
+                    Feature.store(self, data)
+            except (ValueError, DatabaseError):
+                pass
+            else:
+                members = dict((k, v) for k, v in data.items()
+                               if k != 'features')
+                members['type'] = 'FeatureCollection'
+        self.members = members
+        self.__class__.objects.filter(pk=self.pk).update(members=members)
+
+    def update_stats(self, data=None):
+        """
+        Compute and store the statistics of the current content (see
+        `stats`), sent with the metadata.
+        """
+        if data is None:
+            data = self.read_data()
+        stats = collection_stats(data) if data is not None else {}
+        stats['size'] = self.geojson.storage.size(self.geojson.name)
+        self.stats = stats
+        self.__class__.objects.filter(pk=self.pk).update(stats=stats)
+        # Stats are in the map settings, and updates send no signal.
+        cache.bump(self.map_id)
+
+    def iter_features_json(self):
+        """
+        Yield the current FeatureCollection as bytes, by chunks, from the
+        features table.
+        """
+        return Feature.dump(self.members, self.feature_set.all())
+
+    def query_bbox(self, bbox):
+        """
+        Return FeatureCollection bytes of the features intersecting `bbox`.
+        """
+        if self.uses_features_table():
+            envelope = Polygon.from_bbox(bbox)
+            envelope.srid = 4326
+            return b''.join(Feature.dump(self.members, self.feature_set.filter(
+                geom__bboverlaps=envelope)))
+        self.ensure_index()
+        members, features = spatial.query(
+            self.derived_path(spatial.SEQ_EXT),
+            self.derived_path(spatial.INDEX_EXT), bbox)
+        return spatial.dump_collection(members, features)
+
+    def get_extent(self):
+        """
+        Return (west, south, east, north) of the features, or None.
+        """
+        self.ensure_index()
+        return spatial.index_bounds(self.derived_path(spatial.INDEX_EXT))
+
+    def tiles_root(self):
+        return os.path.join(self.storage_root(), 'tiles', str(self.pk))
+
+    def get_tile(self, z, x, y):
+        """
+        Return the path of the z/x/y vector tile, generating it on cache miss.
+        Tiles are keyed by content hash, so stale ones are never served.
+        """
+        if not self.content_hash:
+            self.update_content_hash()
+        name = os.path.join(self.tiles_root(), self.content_hash, str(z),
+                            str(x), '%s.pbf' % y)
+        path = self.geojson.storage.path(name)
+        if not os.path.exists(path):
+            self.ensure_index()
+            content = mvt.render_tile(self.derived_path(spatial.SEQ_EXT),
+                                      self.derived_path(spatial.INDEX_EXT),
+                                      str(self.pk), z, x, y)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            mvt.write_tile(path, content)
+        return path
+
+    def purge_tiles(self):
+        """
+        Delete cached tiles, only valid for a previous content.
+        """
+        delete_stored_tree(self.geojson.storage, self.tiles_root())
 
     def upload_to(self):
         root = self.storage_root()
@@ -290,67 +727,597 @@ class DataLayer(NamedModel):
         return os.path.join(root, name)
 
     def storage_root(self):
-        path = ["datalayer", str(self.map.pk)[-1]]
-        if len(str(self.map.pk)) > 1:
-            path.append(str(self.map.pk)[-2])
-        path.append(str(self.map.pk))
-        return os.path.join(*path)
+        return self.map.datalayers_root()
 
     @property
     def metadata(self):
-        return {
+        metadata = {
             "name": self.name,
             "id": self.pk,
             "displayOnLoad": self.display_on_load
         }
+        if self.stats:
+            metadata["stats"] = self.stats
+        return metadata
 
     def clone(self, map_inst=None):
-        new = self.__class__.objects.get(pk=self.pk)
-        new.pk = None
-        if map_inst:
-            new.map = map_inst
-        new.geojson = File(new.geojson.file.file)
-        new.save()
-        return new
+        return self.bulk_clone([self], map_inst or self.map)[0]
+
+    @classmethod
+    def bulk_clone(cls, datalayers, map_inst):
+        """
+        Clone `datalayers` into `map_inst`, with a number of queries that
+        does not depend on how many they are. Files (current version and
+        derived ones) are linked rather than copied when the storage allows
+        it, and content addressed blobs are shared.
+        """
+        datalayers = list(datalayers)
+        if not datalayers:
+            return []
+        fields = [f.attname for f in cls._meta.concrete_fields
+                  if not f.primary_key and f.name not in ('map', 'geojson')]
+        clones = []
+        for datalayer in datalayers:
+            if datalayer.geojson and not datalayer.content_hash:
+                datalayer.update_content_hash()
+            clone = cls(map=map_inst, geojson=datalayer.geojson.name,
+                        **dict((f, getattr(datalayer, f)) for f in fields))
+            clones.append(clone)
+        cls.objects.bulk_create(clones)  # Sets the pks on PostgreSQL.
+        Feature.copy([(datalayer.pk, clone.pk)
+                      for datalayer, clone in zip(datalayers, clones)
+                      if datalayer.members])
+
+        storage = cls._meta.get_field('geojson').storage
+        extensions = [''] + cls.derived_extensions()
+        names, blobs, versions = {}, [], []
+        for datalayer, clone in zip(datalayers, clones):
+            if not datalayer.geojson:
+                continue
+            source = datalayer.geojson.name
+            blob = ''
+            if datalayer.is_blob():
+                blob = source
+                blobs.append(blob)
+                name = os.path.basename(clone.upload_to())
+            else:
+                clone.geojson.name = names[clone.pk] = clone.upload_to()
+                for ext in extensions:
+                    if ext and not storage.exists(source + ext):
+                        continue
+                    link_or_copy(storage, source + ext,
+                                 clone.geojson.name + ext)
+                name = os.path.basename(clone.geojson.name)
+            versions.append(DataLayerVersion(
+                datalayer=clone, name=name, at=cls.version_at(name),
+                size=storage.size(source), content_hash=clone.content_hash,
+                blob=blob))
+        if names:
+            cls.objects.filter(pk__in=names).update(geojson=Case(
+                *[When(pk=pk, then=Value(name)) for pk, name in names.items()],
+                output_field=models.CharField()))
+        DataLayerVersion.objects.bulk_create(versions)
+        if blobs:
+            added = Case(*[When(name=name, then=Value(blobs.count(name)))
+                           for name in set(blobs)],
+                         output_field=models.IntegerField())
+            Blob.objects.filter(name__in=set(blobs)).update(
+                refs=F('refs') + added)
+        return clones
 
     def is_valid_version(self, name):
         return name.startswith('%s_' % self.pk) and name.endswith('.geojson')
 
+    @staticmethod
+    def version_at(name):
+        return int(name.split('.')[0].split('_')[1])
+
     def version_metadata(self, name):
-        els = name.split('.')[0].split('_')
+        """
+        Metadata of version `name`, from the storage.
+        """
+        path = self.get_version_path(name)
+        if self.geojson.storage.exists(path):
+            size = self.geojson.storage.size(path)
+        else:
+            with self.geojson.storage.open(path + DELTA_EXT, 'rb') as f:
+                size = read_header(f)['size']
         return {
             "name": name,
-            "at": els[1],
-            "size": self.geojson.storage.size(self.get_version_path(name))
+            "at": str(self.version_at(name)),
+            "size": size
         }
 
-    def get_versions(self):
+    def scan_versions(self):
+        """
+        Names of the versions found in the storage, recent first.
+        """
         root = self.storage_root()
-        names = self.geojson.storage.listdir(root)[1]
+        try:
+            names = self.geojson.storage.listdir(root)[1]
+        except (IOError, OSError):
+            return []  # No such directory (eg. only blobs).
+        names = set(name[:-len(DELTA_EXT)] if name.endswith(DELTA_EXT)
+                    else name for name in names)
         names = [name for name in names if self.is_valid_version(name)]
         names.sort(reverse=True)  # Recent first.
         return names
 
+    def get_versions(self):
+        names = list(self.version_entries.values_list('name', flat=True))
+        if not names and self.geojson:
+            # Saved before the index existed, see index_versions.
+            names = self.scan_versions()
+        return names
+
     @property
     def versions(self):
-        names = self.get_versions()
-        return [self.version_metadata(name) for name in names]
+        entries = self.version_entries.values_list('name', 'at', 'size')
+        if not entries and self.geojson:
+            # Saved before the index existed, see index_versions.
+            return [self.version_metadata(name)
+                    for name in self.scan_versions()]
+        return [{"name": name, "at": str(at), "size": size}
+                for name, at, size in entries]
+
+    def add_version(self):
+        """
+        Record the current file in the versions index, and at the first
+        time, the versions stored before the index existed (see
+        `index_versions`), which would not be listed nor purged anymore.
+        """
+        indexed = self.version_entries.exists()
+        blob = ''
+        if self.is_blob():
+            blob = self.geojson.name
+            name = os.path.basename(self.upload_to())
+        else:
+            name = os.path.basename(self.geojson.name)
+        DataLayerVersion.objects.create(
+            datalayer=self, name=name, at=self.version_at(name),
+            size=self.geojson.size, content_hash=self.content_hash,
+            blob=blob)
+        if not indexed:
+            self.index_versions()
+
+    def index_versions(self):
+        """
+        Record the versions found in the storage but not in the index, for
+        data saved before the index existed. Return how many were added.
+        """
+        known = set(self.version_entries.values_list('name', flat=True))
+        entries = []
+        for name in self.scan_versions():
+            if name in known:
+                continue
+            metadata = self.version_metadata(name)
+            content = self.get_version_content(name)
+            entries.append(DataLayerVersion(
+                datalayer=self, name=name, at=int(metadata['at']),
+                size=metadata['size'],
+                content_hash=hashlib.md5(content).hexdigest()))
+        DataLayerVersion.objects.bulk_create(entries)
+        return len(entries)
 
     def get_version(self, name):
-        path = self.get_version_path(name)
-        with self.geojson.storage.open(path, 'r') as f:
-            return f.read()
+        return self.get_version_content(name).decode('utf-8')
+
+    def get_version_content(self, name):
+        """
+        Return the bytes of version `name`, rebuilt from the delta chain if
+        it is not stored in full.
+        """
+        storage = self.geojson.storage
+        deltas, seen = [], set()
+        while True:
+            path = self.get_version_path(name)
+            if storage.exists(path):
+                with storage.open(path, 'rb') as f:
+                    content = f.read()
+                break
+            if name in seen:
+                raise ValueError('Delta chain loop on {}'.format(name))
+            seen.add(name)
+            with storage.open(path + DELTA_EXT, 'rb') as f:
+                name = read_header(f)['base']
+                deltas.append(f.read())
+        for delta in reversed(deltas):
+            content = apply_delta(delta, content)
+        return content
 
     def get_version_path(self, name):
+        blob = self.version_entries.filter(name=name).values_list(
+            'blob', flat=True).first()
+        if blob:
+            return blob
         return '{root}/{name}'.format(root=self.storage_root(), name=name)
 
-    def purge_old_versions(self):
+    def delete_version_files(self, names, keep=()):
+        """
+        Delete the files of versions `names`, and their derived files, but
+        the ones ending with an extension of `keep`.
+        """
         root = self.storage_root()
-        names = self.get_versions()[settings.LEAFLET_STORAGE_KEEP_VERSIONS:]
+        delete_stored_derived(self.geojson.storage,
+                              [os.path.join(root, name) for name in names],
+                              keep)
+
+    def compact_versions(self):
+        """
+        Replace the full copies of previous versions by deltas against the
+        next newer version, only the current one being kept in full.
+        """
+        if not getattr(settings, 'LEAFLET_STORAGE_VERSION_DELTAS', True):
+            return
+        storage = self.geojson.storage
+        names = []
+        # Blobs are shared by other versions, they must stay full.
+        entries = self.version_entries.values_list('name', 'blob')
+        for name in [name for name, blob in entries if not blob]:
+            if not storage.exists(self.get_version_path(name)):
+                break  # Already a delta, so are the older ones.
+            names.append(name)
+        if len(names) < 2:
+            return  # Only the current version is full.
+        newer_name = newer_content = None
         for name in names:
-            for ext in ['', '.gz']:
-                path = os.path.join(root, name + ext)
+            path = self.get_version_path(name)
+            with storage.open(path, 'rb') as f:
+                content = f.read()
+            if newer_name is not None:
                 try:
-                    self.geojson.storage.delete(path)
-                except FileNotFoundError:
-                    pass
+                    delta = make_delta(content, newer_content, newer_name)
+                except UnicodeDecodeError:
+                    break  # Not text, keep it as is.
+                save_stored(storage, path + DELTA_EXT, delta)
+                self.delete_version_files([name], keep=[DELTA_EXT])
+            newer_name, newer_content = name, content
+
+    def purge_old_versions(self):
+        entries = self.version_entries.values_list('pk', 'name', 'blob')
+        entries = list(entries[settings.LEAFLET_STORAGE_KEEP_VERSIONS:])
+        self.delete_version_files([name for pk, name, blob in entries
+                                   if not blob])
+        if entries:
+            DataLayerVersion.objects.filter(
+                pk__in=[pk for pk, name, blob in entries]).delete()
+            release_blobs([blob for pk, name, blob in entries if blob])
+
+
+class DataLayerVersion(models.Model):
+    """
+    Index of the stored versions of a datalayer, so listing and purging
+    them does not need to hit the storage.
+    """
+    datalayer = models.ForeignKey(DataLayer, related_name='version_entries')
+    name = models.CharField(max_length=200)
+    at = models.BigIntegerField()  # Milliseconds timestamp, as in name.
+    size = models.BigIntegerField()
+    content_hash = models.CharField(max_length=32, blank=True)
+    # Storage name of the content, when content addressed.
+    blob = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ('-at', '-name')
+        unique_together = ('datalayer', 'name')
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+
+def uses_features_table():
+    return getattr(settings, 'LEAFLET_STORAGE_FEATURES_BACKEND',
+                   'file') == 'postgis'
+
+
+class Feature(models.Model):
+    """
+    A datalayer feature, when LEAFLET_STORAGE_FEATURES_BACKEND is 'postgis':
+    features are then also stored in this table, with a spatial index, and
+    served from it. Files remain the reference for versions and variants.
+    """
+    datalayer = models.ForeignKey(DataLayer)
+    rank = models.PositiveIntegerField()  # Position in the collection.
+    data = models.TextField()  # Feature as JSON, without its geometry.
+    geom = models.GeometryField(srid=4326, null=True)
+
+    class Meta:
+        ordering = ('rank',)
+        index_together = (('datalayer', 'rank'),)
+
+    # Features per INSERT, and approximate size of the yielded chunks.
+    BATCH_SIZE = 500
+    CHUNK_SIZE = 64 * 1024
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.datalayer_id, self.rank)
+
+    def __str__(self):
+        return u'{} {}'.format(self.datalayer_id, self.rank)
+
+    @classmethod
+    def store(cls, datalayer, data):
+        """
+        Insert the features of FeatureCollection `data` for `datalayer`, by
+        batches. Raise ValueError if `data` does not fit in the table.
+        """
+        features = data.get('features')
+        if not isinstance(features, list):
+            raise ValueError('No features list')
+        sql = ('INSERT INTO {table} (datalayer_id, rank, data, geom) '
+               'VALUES '.format(table=connection.ops.quote_name(
+                   cls._meta.db_table)))
+        # Only two dimensions are kept.
+        row = ('(%s, %s, %s, '
+               'ST_SetSRID(ST_Force2D(ST_GeomFromGeoJSON(%s)), 4326))')
+        with connection.cursor() as cursor:
+            for start in range(0, len(features), cls.BATCH_SIZE):
+                batch = features[start:start + cls.BATCH_SIZE]
+                params = []
+                for rank, feature in enumerate(batch, start):
+                    if not isinstance(feature, dict):
+                        raise ValueError('Feature must be an object')
+                    feature = dict(feature)
+                    geometry = feature.pop('geometry', None)
+                    if not feature:
+                        raise ValueError('Feature without members')
+                    params.extend([
+                        datalayer.pk, rank, json.dumps(feature),
+                        json.dumps(geometry) if geometry else None])
+                cursor.execute(sql + ', '.join([row] * len(batch)), params)
+
+    @classmethod
+    def copy(cls, pairs):
+        """
+        Copy, in one query, the features of each (source, target) pair of
+        datalayer pks.
+        """
+        if not pairs:
+            return
+        sql = ('INSERT INTO {table} (datalayer_id, rank, data, geom) '
+               'SELECT CASE datalayer_id {cases} END, rank, data, geom '
+               'FROM {table} WHERE datalayer_id IN ({ids})').format(
+                   table=connection.ops.quote_name(cls._meta.db_table),
+                   cases=' '.join(['WHEN %s THEN %s'] * len(pairs)),
+                   ids=', '.join(['%s'] * len(pairs)))
+        params = [pk for pair in pairs for pk in pair]
+        params += [source for source, target in pairs]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @classmethod
+    def dump(cls, members, queryset):
+        """
+        Yield FeatureCollection bytes, by chunks, from `members` and the
+        features of `queryset`, read through a server side cursor, with
+        their geometry serialized by the database.
+        """
+        head = json.dumps(dict(members, type='FeatureCollection'))[:-1]
+        parts = [head + ', "features": [']
+        size = 0
+        rows = queryset.order_by('rank').annotate(
+            geometry=AsGeoJSON('geom', precision=15)).values_list(
+            'data', 'geometry').iterator()
+        for index, (data, geometry) in enumerate(rows):
+            part = u'{sep}{data}, "geometry": {geometry}}}'.format(
+                sep=', ' if index else '', data=data[:-1],
+                geometry=geometry or 'null')
+            parts.append(part)
+            size += len(part)
+            if size >= cls.CHUNK_SIZE:
+                yield u''.join(parts).encode('utf-8')
+                parts, size = [], 0
+        parts.append(u']}')
+        yield u''.join(parts).encode('utf-8')
+
+
+class Job(models.Model):
+    """
+    Storage maintenance, run out of the request path by the `run_jobs`
+    command when LEAFLET_STORAGE_ASYNC_JOBS is set, at once otherwise.
+    """
+    kind = models.CharField(max_length=50)
+    # Pending jobs with the same key are only run once.
+    key = models.CharField(max_length=200, blank=True, db_index=True)
+    payload = DictField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    # Set while a worker runs the job, see `run_pending`.
+    started_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('run_after', 'pk')
+
+    def __unicode__(self):
+        return u'{} {}'.format(self.kind, self.key)
+
+    def __str__(self):
+        return u'{} {}'.format(self.kind, self.key)
+
+    @classmethod
+    def enqueue(cls, kind, key='', **payload):
+        job = cls(kind=kind, key=key, payload=payload)
+        if not getattr(settings, 'LEAFLET_STORAGE_ASYNC_JOBS', False):
+            job.run()
+            return None
+        # A running job may have read the data before the current change.
+        if key and cls.objects.filter(key=key, attempts=0,
+                                      started_at__isnull=True).exists():
+            return None  # Will be done by the pending one.
+        job.save()
+        return job
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Mark up to `limit` due jobs as taken, and return them. Jobs taken
+        for longer than LEAFLET_STORAGE_JOBS_TIMEOUT seconds (eg. their
+        worker died) are taken again.
+        """
+        max_attempts = getattr(settings, 'LEAFLET_STORAGE_JOBS_MAX_ATTEMPTS',
+                               5)
+        timeout = getattr(settings, 'LEAFLET_STORAGE_JOBS_TIMEOUT', 3600)
+        now = timezone.now()
+        with transaction.atomic():
+            # Concurrent workers skip the jobs being claimed.
+            pks = list(cls.objects.select_for_update(skip_locked=True).filter(
+                models.Q(started_at__isnull=True) |
+                models.Q(started_at__lt=now - datetime.timedelta(
+                    seconds=timeout)),
+                run_after__lte=now, attempts__lt=max_attempts).values_list(
+                'pk', flat=True)[:limit])
+            cls.objects.filter(pk__in=pks).update(started_at=now)
+        return list(cls.objects.filter(pk__in=pks))
+
+    @classmethod
+    def run_pending(cls, limit=100):
+        """
+        Run up to `limit` due jobs, and return (succeeded, failed) counts.
+        Each job runs in its own transaction, out of the one claiming them.
+        Failed jobs are retried later, with an exponential backoff, up to
+        LEAFLET_STORAGE_JOBS_MAX_ATTEMPTS times.
+        """
+        done, failed, keys = 0, 0, set()
+        for job in cls.claim(limit):
+            if job.key and job.key in keys:
+                job.delete()  # Already run in this batch.
+                done += 1
+                continue
+            try:
+                with transaction.atomic():
+                    job.run()
+            except Exception as e:
+                failed += 1
+                job.attempts += 1
+                job.last_error = repr(e)
+                job.started_at = None
+                job.run_after = timezone.now() + datetime.timedelta(
+                    minutes=2 ** job.attempts)
+                job.save()
+            else:
+                job.delete()
+                done += 1
+                keys.add(job.key)
+        return done, failed
+
+    def run(self):
+        getattr(self, 'run_{}'.format(self.kind))(**self.payload)
+
+    def run_purge_versions(self, datalayer):
+        datalayer = DataLayer.objects.filter(pk=datalayer).first()
+        if datalayer:
+            datalayer.purge_old_versions()
+
+    def run_compact_versions(self, datalayer):
+        datalayer = DataLayer.objects.filter(pk=datalayer).first()
+        if datalayer:
+            datalayer.compact_versions()
+
+    def run_build_bundle(self, map):
+        map = Map.objects.filter(pk=map).first()
+        if map:
+            map.build_bundle()
+
+    def run_delete_blobs(self, names):
+        storage = DataLayer._meta.get_field('geojson').storage
+        for name in names:
+            with transaction.atomic():
+                # Locked, so it can not be acquired while files are deleted.
+                blob = Blob.objects.select_for_update().filter(
+                    name=name).first()
+                if blob is None or blob.refs > 0:
+                    continue  # Already deleted, or referenced again.
+                delete_stored_derived(storage, [name])
+                blob.delete()
+
+    def run_delete_files(self, names=(), trees=(), prefixes=()):
+        storage = DataLayer._meta.get_field('geojson').storage
+        for name in names:
+            try:
+                storage.delete(name)
+            except FileNotFoundError:
+                pass
+        for prefix in prefixes:
+            delete_stored_prefix(storage, prefix)
+        for tree in trees:
+            delete_stored_tree(storage, tree)
+
+
+BLOBS_ROOT = 'blobs'
+
+
+def is_content_addressed():
+    return getattr(settings, 'LEAFLET_STORAGE_CONTENT_ADDRESSED', False)
+
+
+def blob_name(content_hash):
+    return '{root}/{prefix}/{hash}.geojson'.format(
+        root=BLOBS_ROOT, prefix=content_hash[:2], hash=content_hash)
+
+
+def release_blobs(names):
+    """
+    Drop one reference to each of blob `names`, and delete the files of the
+    ones no longer referenced.
+    """
+    orphans = Blob.release(names)
+    if orphans:
+        Job.enqueue('delete_blobs', names=orphans)
+
+
+class Blob(models.Model):
+    """
+    Content addressed datalayer file (LEAFLET_STORAGE_CONTENT_ADDRESSED),
+    shared by all the versions with the same content.
+    """
+    name = models.CharField(max_length=200, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name):
+        with transaction.atomic():
+            blob, created = cls.objects.select_for_update().get_or_create(
+                name=name)
+            blob.refs += 1
+            blob.save()
+
+    @classmethod
+    def release(cls, names):
+        """
+        Drop one reference per occurrence in `names`, and return the names
+        no longer referenced. Their rows are kept, with no reference, until
+        their files are deleted (see Job.run_delete_blobs).
+        """
+        orphans = []
+        if not names:
+            return orphans
+        with transaction.atomic():
+            for blob in cls.objects.select_for_update().filter(
+                    name__in=set(names)):
+                blob.refs = max(blob.refs - names.count(blob.name), 0)
+                blob.save()
+                if not blob.refs:
+                    orphans.append(blob.name)
+        return orphans
+
+
+# Invalidate the cached map settings, see `cache`.
+post_save.connect(cache.map_changed, sender=Map)
+post_delete.connect(cache.map_changed, sender=Map)
+post_save.connect(cache.datalayer_changed, sender=DataLayer)
+post_delete.connect(cache.datalayer_changed, sender=DataLayer)
+post_save.connect(cache.global_changed, sender=TileLayer)
+post_delete.connect(cache.global_changed, sender=TileLayer)
+post_save.connect(cache.global_changed, sender=Licence)
+post_delete.connect(cache.global_changed, sender=Licence)
@@ -0,0 +1,368 @@
+"""
+Minimal Mapbox Vector Tile (v2) encoder for datalayer features.
+
+Features are fetched from the datalayer spatial index (see `spatial`),
+projected to Web Mercator tile coordinates, clipped to the tile (plus a
+buffer) and encoded by hand, so no protobuf dependency is needed.
+"""
+from __future__ import division
+
+import json
+import math
+import struct
+
+from .utils import atomic_path
+from . import spatial
+
+EXTENT = 4096
+BUFFER = 64
+MAX_LATITUDE = 85.0511287798
+POINT, LINESTRING, POLYGON = 1, 2, 3
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+
+def tile_bounds(z, x, y):
+    """
+    Return (west, south, east, north) of tile z/x/y, in degrees.
+    """
+    n = 2.0 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def tiles_for_bbox(bbox, z):
+    """
+    Yield (x, y) of the zoom `z` tiles covering (west, south, east, north).
+    """
+    n = 2 ** z
+    west, south, east, north = bbox
+    min_x, max_y = _lonlat_to_tile(west, south, z)
+    max_x, min_y = _lonlat_to_tile(east, north, z)
+    for x in range(max(int(min_x), 0), min(int(max_x), n - 1) + 1):
+        for y in range(max(int(min_y), 0), min(int(max_y), n - 1) + 1):
+            yield x, y
+
+
+def _lonlat_to_tile(lon, lat, z):
+    n = 2.0 ** z
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    sin = math.sin(math.radians(lat))
+    return ((lon + 180.0) / 360.0 * n,
+            (0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * n)
+
+
+def _projector(z, x, y):
+    def project(position):
+        tx, ty = _lonlat_to_tile(position[0], position[1], z)
+        return (tx - x) * EXTENT, (ty - y) * EXTENT
+    return project
+
+
+# Clipping, in tile coordinates.
+
+def _inside(point, edge, value):
+    axis, is_min = edge
+    return point[axis] >= value if is_min else point[axis] <= value
+
+
+def _intersect(a, b, edge, value):
+    axis = edge[0]
+    t = (value - a[axis]) / (b[axis] - a[axis])
+    other = 1 - axis
+    point = [0, 0]
+    point[axis] = value
+    point[other] = a[other] + t * (b[other] - a[other])
+    return tuple(point)
+
+
+def _clip_edges():
+    low, high = -BUFFER, EXTENT + BUFFER
+    return [((0, True), low), ((0, False), high),
+            ((1, True), low), ((1, False), high)]
+
+
+def clip_ring(ring):
+    """Sutherland-Hodgman clipping of a closed ring."""
+    for edge, value in _clip_edges():
+        if not ring:
+            break
+        output = []
+        previous = ring[-1]
+        for point in ring:
+            if _inside(point, edge, value):
+                if not _inside(previous, edge, value):
+                    output.append(_intersect(previous, point, edge, value))
+                output.append(point)
+            elif _inside(previous, edge, value):
+                output.append(_intersect(previous, point, edge, value))
+            previous = point
+        ring = output
+    return ring
+
+
+def clip_line(line):
+    """Clip a line, which can be split in several parts."""
+    parts = [line]
+    for edge, value in _clip_edges():
+        clipped = []
+        for part in parts:
+            current = []
+            for i, point in enumerate(part):
+                if _inside(point, edge, value):
+                    if i and not _inside(part[i - 1], edge, value):
+                        current.append(
+                            _intersect(part[i - 1], point, edge, value))
+                    current.append(point)
+                else:
+                    if i and _inside(part[i - 1], edge, value):
+                        current.append(
+                            _intersect(part[i - 1], point, edge, value))
+                    if len(current) > 1:
+                        clipped.append(current)
+                    current = []
+            if len(current) > 1:
+                clipped.append(current)
+        parts = clipped
+    return parts
+
+
+def _round(points):
+    rounded = []
+    for point in points:
+        point = (int(round(point[0])), int(round(point[1])))
+        if not rounded or rounded[-1] != point:
+            rounded.append(point)
+    return rounded
+
+
+def _area(ring):
+    """Surveyor's formula, in tile coordinates (y down)."""
+    return sum(ring[i - 1][0] * ring[i][1] - ring[i][0] * ring[i - 1][1]
+               for i in range(len(ring))) / 2.0
+
+
+# Geometry conversion.
+
+def _polygon_rings(polygon, project):
+    rings = []
+    for index, ring in enumerate(polygon):
+        ring = [project(p) for p in ring]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        ring = _round(clip_ring(ring))
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        area = _area(ring) if len(ring) > 2 else 0
+        if not area:
+            if not index:
+                return []  # Exterior vanished, so do holes.
+            continue
+        # MVT 2: exterior rings have a positive area, holes a negative one.
+        if (area > 0) != (index == 0):
+            ring.reverse()
+        rings.append(ring)
+    return rings
+
+
+def convert_geometry(geometry, project):
+    """
+    Return (type, parts) of a GeoJSON geometry in tile coordinates, parts
+    being a list of points lists (or of rings lists, for polygons).
+    """
+    if not geometry:
+        return None, []
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    limit = (-BUFFER, EXTENT + BUFFER)
+    if kind in ('Point', 'MultiPoint'):
+        if kind == 'Point':
+            coordinates = [coordinates] if coordinates else []
+        points = _round(project(p) for p in coordinates)
+        points = [p for p in points
+                  if limit[0] <= p[0] <= limit[1] and
+                  limit[0] <= p[1] <= limit[1]]
+        return POINT, [points] if points else []
+    if kind in ('LineString', 'MultiLineString'):
+        if kind == 'LineString':
+            coordinates = [coordinates]
+        parts = []
+        for line in coordinates:
+            for part in clip_line([project(p) for p in line]):
+                part = _round(part)
+                if len(part) > 1:
+                    parts.append(part)
+        return LINESTRING, parts
+    if kind in ('Polygon', 'MultiPolygon'):
+        if kind == 'Polygon':
+            coordinates = [coordinates]
+        polygons = [_polygon_rings(p, project) for p in coordinates]
+        return POLYGON, [p for p in polygons if p]
+    return None, []
+
+
+def convert_geometries(geometry, project):
+    """
+    Return a list of (type, parts) of a GeoJSON geometry in tile
+    coordinates (see convert_geometry). MVT has no geometry collection: the
+    members of a GeometryCollection are merged by type.
+    """
+    if geometry and geometry.get('type') == 'GeometryCollection':
+        merged = {}
+        for member in geometry.get('geometries') or []:
+            for kind, parts in convert_geometries(member, project):
+                merged.setdefault(kind, []).extend(parts)
+        return sorted(merged.items())
+    kind, parts = convert_geometry(geometry, project)
+    return [(kind, parts)] if parts else []
+
+
+# Protobuf encoding.
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes(number, data):
+    return _field(number, 2) + _varint(len(data)) + data
+
+
+def _packed(number, values):
+    return _bytes(number, b''.join(_varint(v) for v in values))
+
+
+def _command(command, count):
+    return (command & 0x7) | (count << 3)
+
+
+def encode_geometry(kind, parts):
+    commands = []
+    cursor = [0, 0]
+
+    def move(points, first_command):
+        for i, point in enumerate(points):
+            if i == 0:
+                commands.append(_command(first_command, 1))
+            elif i == 1:
+                commands.append(_command(LINE_TO, len(points) - 1))
+            commands.append(_zigzag(point[0] - cursor[0]))
+            commands.append(_zigzag(point[1] - cursor[1]))
+            cursor[0], cursor[1] = point
+
+    if kind == POINT:
+        points = [p for part in parts for p in part]
+        commands.append(_command(MOVE_TO, len(points)))
+        for point in points:
+            commands.append(_zigzag(point[0] - cursor[0]))
+            commands.append(_zigzag(point[1] - cursor[1]))
+            cursor[0], cursor[1] = point
+    elif kind == LINESTRING:
+        for line in parts:
+            move(line, MOVE_TO)
+    else:
+        for polygon in parts:
+            for ring in polygon:
+                move(ring, MOVE_TO)
+                commands.append(_command(CLOSE_PATH, 1))
+    return commands
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        if INT64_MIN <= value <= INT64_MAX:
+            return _field(6, 0) + _varint(_zigzag(value))
+        try:
+            value = float(value)  # Out of sint64 range.
+        except OverflowError:
+            value = str(value)
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack('<d', value)
+    if not isinstance(value, type(u'')):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        else:
+            value = json.dumps(value)
+    return _bytes(1, value.encode('utf-8'))
+
+
+def encode_layer(name, features):
+    """
+    Encode a list of GeoJSON `features`, already in tile coordinates as
+    (kind, parts, properties), to a MVT layer.
+    """
+    keys, values = [], []
+    key_index, value_index = {}, {}
+    encoded = []
+    for kind, parts, properties in features:
+        tags = []
+        for key, value in sorted(properties.items()):
+            if value is None:
+                continue
+            encoded_value = _encode_value(value)
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            if encoded_value not in value_index:
+                value_index[encoded_value] = len(values)
+                values.append(encoded_value)
+            tags.extend((key_index[key], value_index[encoded_value]))
+        feature = (_packed(2, tags) + _field(3, 0) + _varint(kind) +
+                   _packed(4, encode_geometry(kind, parts)))
+        encoded.append(_bytes(2, feature))
+    layer = (_field(15, 0) + _varint(2) +
+             _bytes(1, name.encode('utf-8')) +
+             b''.join(encoded) +
+             b''.join(_bytes(3, k.encode('utf-8')) for k in keys) +
+             b''.join(_bytes(4, v) for v in values) +
+             _field(5, 0) + _varint(EXTENT))
+    return layer
+
+
+def render_tile(seq_path, index_path, name, z, x, y):
+    """
+    Return the MVT bytes of tile z/x/y for the indexed features.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    dx = (east - west) * BUFFER / EXTENT
+    dy = (north - south) * BUFFER / EXTENT
+    members, lines = spatial.query(seq_path, index_path,
+                                   (west - dx, south - dy, east + dx,
+                                    north + dy))
+    project = _projector(z, x, y)
+    features = []
+    for line in lines:
+        feature = json.loads(line.decode('utf-8'))
+        properties = feature.get('properties') or {}
+        for kind, parts in convert_geometries(feature.get('geometry'),
+                                              project):
+            features.append((kind, parts, properties))
+    if not features:
+        return b''
+    return _bytes(3, encode_layer(name, features))
+
+
+def write_tile(path, content):
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
@@ -0,0 +1,98 @@
+"""
+Feature level edits of datalayers.
+
+A patch is a JSON list of operations, applied in order, features being
+matched by their GeoJSON `id`:
+
+    [
+        {"op": "add", "feature": {...}},
+        {"op": "update", "id": 12, "feature": {...}},
+        {"op": "delete", "id": 13}
+    ]
+"""
+import json
+import numbers
+
+from django.utils import six
+
+from .validation import validate, GeoJSONError
+
+OPERATIONS = ('add', 'update', 'delete')
+
+
+class PatchError(ValueError):
+    pass
+
+
+def check_feature(feature):
+    if not isinstance(feature, dict):
+        raise PatchError('Feature must be an object')
+    collection = {'type': 'FeatureCollection', 'features': [feature]}
+    try:
+        validate([json.dumps(collection).encode('utf-8')])
+    except GeoJSONError as e:
+        raise PatchError('Invalid feature: {}'.format(e))
+
+
+def is_valid_id(value):
+    """
+    GeoJSON ids are strings or numbers.
+    """
+    return (isinstance(value, six.string_types + (numbers.Number, )) and
+            not isinstance(value, bool))
+
+
+def check_id(value):
+    if not is_valid_id(value):
+        raise PatchError('Feature id must be a string or a number')
+
+
+def apply_operations(data, operations):
+    """
+    Apply `operations` to FeatureCollection `data`, in place, and return it.
+    Raise PatchError, and leave `data` untouched, if any operation is
+    invalid.
+    """
+    if not isinstance(operations, list):
+        raise PatchError('Operations must be a list')
+    features = list(data.get('features') or [])
+    # Features with an invalid id can not be matched.
+    ids = dict((f['id'], i) for i, f in enumerate(features)
+               if isinstance(f, dict) and is_valid_id(f.get('id')))
+    deleted = False
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise PatchError('Operation {} must be an object'.format(index))
+        op = operation.get('op')
+        if op not in OPERATIONS:
+            raise PatchError('Unknown operation: {}'.format(op))
+        if op == 'add':
+            feature = operation.get('feature')
+            check_feature(feature)
+            if feature.get('id') is not None:
+                check_id(feature['id'])
+                if feature['id'] in ids:
+                    raise PatchError(
+                        'Duplicate feature id: {}'.format(feature['id']))
+                ids[feature['id']] = len(features)
+            features.append(feature)
+            continue
+        feature_id = operation.get('id')
+        check_id(feature_id)
+        if feature_id not in ids:
+            raise PatchError('Unknown feature id: {}'.format(feature_id))
+        if op == 'update':
+            feature = operation.get('feature')
+            check_feature(feature)
+            feature.setdefault('id', feature_id)
+            if feature['id'] != feature_id:
+                raise PatchError('Feature id can not be changed')
+            features[ids[feature_id]] = feature
+        else:
+            # Keep indexes valid, and remove once at the end.
+            features[ids.pop(feature_id)] = None
+            deleted = True
+    if deleted:
+        features = [f for f in features if f is not None]
+    data['features'] = features
+    return data
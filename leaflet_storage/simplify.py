@@ -0,0 +1,234 @@
+"""
+Topology preserving Douglas-Peucker simplification of datalayers.
+
+Points where lines or rings meet or split (junctions) are never removed,
+and simplification runs on each arc between two junctions: a border shared
+by two polygons is made of the same arc in both, so it is simplified the
+same way and no gap or overlap appears between them.
+"""
+from __future__ import division
+
+import copy
+
+TILE_SIZE = 256
+
+
+def zoom_tolerance(zoom, pixels=1):
+    """
+    Return the tolerance, in degrees, matching `pixels` at `zoom`.
+    """
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * pixels
+
+
+def pick_zoom(zooms, pixels=1, zoom=None, tolerance=None):
+    """
+    Return the simplification zoom to serve for the requested `zoom` or
+    `tolerance` (in degrees), or None for full resolution.
+    """
+    if zoom is not None:
+        candidates = [z for z in zooms if z >= zoom]
+        return min(candidates) if candidates else None
+    if tolerance is not None:
+        candidates = [z for z in zooms
+                      if zoom_tolerance(z, pixels) <= tolerance]
+        return min(candidates) if candidates else None
+    return None
+
+
+def _sq_segment_distance(p, a, b):
+    x, y = a[0], a[1]
+    dx, dy = b[0] - x, b[1] - y
+    if dx or dy:
+        t = ((p[0] - x) * dx + (p[1] - y) * dy) / (dx * dx + dy * dy)
+        if t > 1:
+            x, y = b[0], b[1]
+        elif t > 0:
+            x += dx * t
+            y += dy * t
+    dx, dy = p[0] - x, p[1] - y
+    return dx * dx + dy * dy
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Return the indexes of the `points` to keep, ends included.
+    """
+    last = len(points) - 1
+    if last < 2:
+        return list(range(last + 1))
+    sq_tolerance = tolerance * tolerance
+    keep = set([0, last])
+    stack = [(0, last)]
+    while stack:
+        first, end = stack.pop()
+        max_distance, index = 0, None
+        for i in range(first + 1, end):
+            distance = _sq_segment_distance(points[i], points[first],
+                                            points[end])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > sq_tolerance:
+            keep.add(index)
+            stack.append((first, index))
+            stack.append((index, end))
+    return sorted(keep)
+
+
+def _key(position):
+    return (position[0], position[1])
+
+
+def _iter_paths(geometry):
+    """
+    Yield (path, is_ring) for each line and ring of `geometry`.
+    """
+    if not geometry:
+        return
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    if kind == 'GeometryCollection':
+        for child in geometry.get('geometries') or []:
+            for path in _iter_paths(child):
+                yield path
+    elif kind == 'LineString':
+        yield coordinates, False
+    elif kind == 'MultiLineString':
+        for line in coordinates:
+            yield line, False
+    elif kind == 'Polygon':
+        for ring in coordinates:
+            yield ring, True
+    elif kind == 'MultiPolygon':
+        for polygon in coordinates:
+            for ring in polygon:
+                yield ring, True
+
+
+def _open_ring(ring):
+    if len(ring) > 1 and _key(ring[0]) == _key(ring[-1]):
+        return ring[:-1]
+    return ring
+
+
+def find_junctions(features):
+    """
+    Return the set of positions where paths meet with different neighbours,
+    plus the ends of lines.
+    """
+    neighbours = {}
+    junctions = set()
+    for feature in features:
+        for path, is_ring in _iter_paths(feature.get('geometry')):
+            points = [_key(p) for p in (_open_ring(path) if is_ring else path)]
+            count = len(points)
+            if not count:
+                continue
+            if not is_ring:
+                junctions.add(points[0])
+                junctions.add(points[-1])
+            for i, point in enumerate(points):
+                if is_ring:
+                    pair = (points[i - 1], points[(i + 1) % count])
+                else:
+                    pair = (points[i - 1] if i else None,
+                            points[i + 1] if i + 1 < count else None)
+                pair = tuple(sorted(pair, key=repr))
+                seen = neighbours.setdefault(point, pair)
+                if seen != pair:
+                    junctions.add(point)
+    return junctions
+
+
+def _simplify_line(line, tolerance, junctions):
+    if len(line) < 3:
+        return line
+    fixed = [i for i, p in enumerate(line)
+             if i in (0, len(line) - 1) or _key(p) in junctions]
+    keep = []
+    for start, end in zip(fixed, fixed[1:]):
+        arc = line[start:end + 1]
+        keep.extend(start + i for i in douglas_peucker(arc, tolerance)[:-1])
+    keep.append(len(line) - 1)
+    return [line[i] for i in keep]
+
+
+def _simplify_ring(ring, tolerance, junctions, is_exterior):
+    points = _open_ring(ring)
+    count = len(points)
+    if count < 4:
+        return ring
+    fixed = [i for i, p in enumerate(points) if _key(p) in junctions]
+    if not fixed:
+        # Isolated ring: split it at the farthest point from the first one.
+        far = max(range(count),
+                  key=lambda i: _sq_segment_distance(points[i], points[0],
+                                                     points[0]))
+        fixed = [0, far] if far else [0]
+    keep = []
+    for index, start in enumerate(fixed):
+        end = fixed[(index + 1) % len(fixed)]
+        length = (end - start) % count or count
+        arc = [points[(start + i) % count] for i in range(length + 1)]
+        keep.extend((start + i) % count
+                    for i in douglas_peucker(arc, tolerance)[:-1])
+    if len(keep) < 3:
+        # Collapsed: drop holes, keep exteriors untouched.
+        return None if not is_exterior else ring
+    result = [points[i] for i in sorted(keep)]
+    return result + [result[0]]
+
+
+def simplify_geometry(geometry, tolerance, junctions):
+    """
+    Return a simplified copy of a GeoJSON `geometry`.
+    """
+    if not geometry:
+        return geometry
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    result = dict(geometry)
+    if kind == 'GeometryCollection':
+        result['geometries'] = [simplify_geometry(g, tolerance, junctions)
+                                for g in geometry.get('geometries') or []]
+    elif kind == 'LineString':
+        result['coordinates'] = _simplify_line(coordinates, tolerance,
+                                               junctions)
+    elif kind == 'MultiLineString':
+        result['coordinates'] = [_simplify_line(line, tolerance, junctions)
+                                 for line in coordinates]
+    elif kind in ('Polygon', 'MultiPolygon'):
+        polygons = [coordinates] if kind == 'Polygon' else coordinates
+        simplified = []
+        for polygon in polygons:
+            rings = [_simplify_ring(r, tolerance, junctions, not i)
+                     for i, r in enumerate(polygon)]
+            simplified.append([r for r in rings if r])
+        result['coordinates'] = (simplified[0] if kind == 'Polygon'
+                                 else simplified)
+    return result
+
+
+def count_positions(features):
+    return sum(len(path) for feature in features
+               for path, is_ring in _iter_paths(feature.get('geometry')))
+
+
+def simplify_collection(data, tolerance, junctions=None):
+    """
+    Return a simplified copy of FeatureCollection `data`, or None if the
+    simplification removes no position.
+    """
+    features = data.get('features') or []
+    if junctions is None:
+        junctions = find_junctions(features)
+    simplified = []
+    for feature in features:
+        feature = copy.copy(feature)
+        feature['geometry'] = simplify_geometry(feature.get('geometry'),
+                                                tolerance, junctions)
+        simplified.append(feature)
+    if count_positions(simplified) == count_positions(features):
+        return None
+    result = dict(data)
+    result['features'] = simplified
+    return result
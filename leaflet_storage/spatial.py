@@ -0,0 +1,275 @@
+"""
+Packed Hilbert R-tree, to query datalayer features by bounding box.
+
+The index is built once when a datalayer is saved, next to the GeoJSON file:
+
+- `<name>.seq` holds one feature per line (GeoJSON text sequence);
+- `<name>.idx` holds the tree and the offset of each feature in `.seq`.
+
+A query only reads the index and the matching lines.
+"""
+import json
+import math
+import struct
+from array import array
+
+from .utils import atomic_path
+
+MAGIC = b'LSIX'
+VERSION = 1
+NODE_SIZE = 16
+HILBERT_MAX = (1 << 16) - 1
+SEQ_EXT = '.seq'
+INDEX_EXT = '.idx'
+
+
+def _iter_positions(coordinates):
+    if not coordinates:
+        return
+    if isinstance(coordinates[0], (int, float)):
+        yield coordinates
+        return
+    for item in coordinates:
+        for position in _iter_positions(item):
+            yield position
+
+
+def geometry_bbox(geometry):
+    """
+    Return (minx, miny, maxx, maxy) of a GeoJSON geometry, or None if empty.
+    """
+    if not geometry:
+        return None
+    if geometry.get('type') == 'GeometryCollection':
+        boxes = [geometry_bbox(g) for g in geometry.get('geometries') or []]
+        return merge_bboxes(b for b in boxes if b)
+    xs, ys = [], []
+    for position in _iter_positions(geometry.get('coordinates')):
+        xs.append(position[0])
+        ys.append(position[1])
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def merge_bboxes(boxes):
+    merged = None
+    for box in boxes:
+        if merged is None:
+            merged = list(box)
+        else:
+            merged = [min(merged[0], box[0]), min(merged[1], box[1]),
+                      max(merged[2], box[2]), max(merged[3], box[3])]
+    return tuple(merged) if merged else None
+
+
+def _hilbert(x, y):
+    """Distance of (x, y) on a 2^16 Hilbert curve."""
+    d = 0
+    s = (HILBERT_MAX + 1) >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x = HILBERT_MAX - x
+                y = HILBERT_MAX - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def _level_bounds(num_items, node_size):
+    n = num_items
+    num_nodes = n
+    bounds = [n * 4]
+    while True:
+        n = int(math.ceil(float(n) / node_size))
+        num_nodes += n
+        bounds.append(num_nodes * 4)
+        if n <= 1:
+            break
+    return bounds
+
+
+class PackedIndex(object):
+    """
+    Static R-tree of boxes, packed by Hilbert order (as in flatbush).
+
+    Leaves reference the item ordinal, upper nodes the position of their
+    first child in `boxes`.
+    """
+
+    def __init__(self, num_items, node_size=NODE_SIZE):
+        self.num_items = num_items
+        self.node_size = node_size
+        self.level_bounds = _level_bounds(num_items, node_size)
+        self.num_nodes = self.level_bounds[-1] // 4
+        self.boxes = array('d')
+        self.indices = array('I')
+
+    def add(self, minx, miny, maxx, maxy):
+        self.indices.append(len(self.boxes) // 4)
+        self.boxes.extend((minx, miny, maxx, maxy))
+
+    def finish(self):
+        boxes, indices = self.boxes, self.indices
+        n = self.num_items
+        bounds = merge_bboxes(boxes[i:i + 4] for i in range(0, n * 4, 4))
+        minx, miny, maxx, maxy = bounds or (0, 0, 0, 0)
+        width = (maxx - minx) or 1
+        height = (maxy - miny) or 1
+
+        def key(i):
+            x = (boxes[i * 4] + boxes[i * 4 + 2]) / 2
+            y = (boxes[i * 4 + 1] + boxes[i * 4 + 3]) / 2
+            return _hilbert(int(HILBERT_MAX * (x - minx) / width),
+                            int(HILBERT_MAX * (y - miny) / height))
+
+        order = sorted(range(n), key=key) if n > self.node_size else range(n)
+        sorted_boxes = array('d')
+        sorted_indices = array('I')
+        for i in order:
+            sorted_boxes.extend(boxes[i * 4:i * 4 + 4])
+            sorted_indices.append(indices[i])
+        # Build parent nodes, level by level.
+        pos = 0
+        for end in self.level_bounds[:-1]:
+            while pos < end:
+                node_index = pos
+                node = merge_bboxes(
+                    sorted_boxes[j:j + 4]
+                    for j in range(pos, min(pos + self.node_size * 4, end),
+                                   4))
+                pos = min(pos + self.node_size * 4, end)
+                sorted_indices.append(node_index)
+                sorted_boxes.extend(node)
+        self.boxes, self.indices = sorted_boxes, sorted_indices
+
+    def _upper_bound(self, value):
+        for bound in self.level_bounds:
+            if bound > value:
+                return bound
+        return self.level_bounds[-1]
+
+    def search(self, minx, miny, maxx, maxy):
+        """
+        Return the ordinals of the items intersecting the given box.
+        """
+        if not self.num_items:
+            return []
+        boxes, indices = self.boxes, self.indices
+        leaves_end = self.num_items * 4
+        node_index = len(boxes) - 4
+        queue = []
+        results = []
+        while node_index is not None:
+            end = min(node_index + self.node_size * 4,
+                      self._upper_bound(node_index))
+            for pos in range(node_index, end, 4):
+                if (maxx < boxes[pos] or maxy < boxes[pos + 1] or
+                        minx > boxes[pos + 2] or miny > boxes[pos + 3]):
+                    continue
+                index = indices[pos // 4]
+                if node_index < leaves_end:
+                    results.append(index)
+                else:
+                    queue.append(index)
+            node_index = queue.pop() if queue else None
+        return sorted(results)
+
+
+def build_index(data, seq_path, index_path):
+    """
+    Write features of FeatureCollection `data` to `seq_path`, one per line,
+    and their packed index to `index_path`.
+    """
+    features = data.get('features') or []
+    members = dict((k, v) for k, v in data.items() if k != 'features')
+    offsets, lengths, boxes = array('I'), array('I'), []
+    with atomic_path(seq_path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            offset = 0
+            for feature in features:
+                line = json.dumps(feature).encode('utf-8') + b'\n'
+                f.write(line)
+                offsets.append(offset)
+                lengths.append(len(line))
+                offset += len(line)
+                boxes.append(geometry_bbox(feature.get('geometry')))
+    # Features without geometry can never intersect, leave them out.
+    ordinals = [i for i, box in enumerate(boxes) if box]
+    index = PackedIndex(len(ordinals))
+    for i in ordinals:
+        index.add(*boxes[i])
+    index.finish()
+    # Map leaves to feature ordinals in `.seq`.
+    for pos in range(index.num_items):
+        index.indices[pos] = ordinals[index.indices[pos]]
+    header = json.dumps({
+        'num_items': index.num_items,
+        'node_size': index.node_size,
+        'num_features': len(features),
+        'members': members,
+    }).encode('utf-8')
+    with atomic_path(index_path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(struct.pack('<4sII', MAGIC, VERSION, len(header)))
+            f.write(header)
+            index.boxes.tofile(f)
+            index.indices.tofile(f)
+            offsets.tofile(f)
+            lengths.tofile(f)
+
+
+def read_index(index_path):
+    """
+    Return (header, PackedIndex, offsets, lengths) from `index_path`.
+    """
+    with open(index_path, 'rb') as f:
+        magic, version, size = struct.unpack('<4sII', f.read(12))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unknown index format: {}'.format(index_path))
+        header = json.loads(f.read(size).decode('utf-8'))
+        index = PackedIndex(header['num_items'], header['node_size'])
+        index.boxes.fromfile(f, index.num_nodes * 4)
+        index.indices.fromfile(f, index.num_nodes)
+        offsets, lengths = array('I'), array('I')
+        offsets.fromfile(f, header['num_features'])
+        lengths.fromfile(f, header['num_features'])
+    return header, index, offsets, lengths
+
+
+def query(seq_path, index_path, bbox):
+    """
+    Return (members, features) where features are the encoded lines of the
+    features intersecting `bbox`, and members the other FeatureCollection
+    members.
+    """
+    header, index, offsets, lengths = read_index(index_path)
+    features = []
+    with open(seq_path, 'rb') as f:
+        for ordinal in index.search(*bbox):
+            f.seek(offsets[ordinal])
+            features.append(f.read(lengths[ordinal]).rstrip(b'\n'))
+    return header['members'], features
+
+
+def dump_collection(members, features):
+    """
+    Return FeatureCollection bytes from `members` and encoded `features`.
+    """
+    members = dict(members, type='FeatureCollection')
+    head = json.dumps(members).encode('utf-8')[:-1]
+    return (head + b', "features": [' + b', '.join(features) + b']}')
+
+
+def index_bounds(index_path):
+    """
+    Return (minx, miny, maxx, maxy) of all indexed features, or None.
+    """
+    header, index, offsets, lengths = read_index(index_path)
+    if not index.num_items:
+        return None
+    return tuple(index.boxes[-4:])
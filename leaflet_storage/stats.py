@@ -0,0 +1,71 @@
+"""
+Statistics of a datalayer content, computed when it is saved and sent with
+its metadata, so clients know its extent and weight before loading it.
+"""
+from .spatial import geometry_bbox, merge_bboxes
+
+# Keep the metadata of layers with very heterogeneous properties small.
+MAX_PROPERTIES = 100
+
+
+def _json_type(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, list):
+        return 'array'
+    return 'string'
+
+
+def _schema(types):
+    """
+    Return the JSON type of each property, 'mixed' when there are several,
+    null values only counting when there is no other.
+    """
+    schema = {}
+    for key, seen in types.items():
+        if len(seen) > 1:
+            seen.discard('null')
+        schema[key] = seen.pop() if len(seen) == 1 else 'mixed'
+    return schema
+
+
+def collection_stats(data):
+    """
+    Return the statistics of FeatureCollection `data`: `bbox` (None if no
+    feature has coordinates), `featureCount`, `geometryTypes` (count of
+    features by geometry type) and `properties` (JSON type by key).
+    """
+    features = [f for f in data.get('features') or []
+                if isinstance(f, dict)]
+    boxes, geometry_types, types = [], {}, {}
+    for feature in features:
+        geometry = feature.get('geometry')
+        if isinstance(geometry, dict):
+            kind = geometry.get('type')
+            geometry_types[kind] = geometry_types.get(kind, 0) + 1
+            box = geometry_bbox(geometry)
+            if box:
+                boxes.append(box)
+        properties = feature.get('properties')
+        if not isinstance(properties, dict):
+            continue
+        for key, value in properties.items():
+            # Underscore keys are for the client (eg. _storage_options).
+            if key.startswith('_'):
+                continue
+            if key not in types and len(types) >= MAX_PROPERTIES:
+                continue
+            types.setdefault(key, set()).add(_json_type(value))
+    bbox = merge_bboxes(boxes)
+    return {
+        'bbox': list(bbox) if bbox else None,
+        'featureCount': len(features),
+        'geometryTypes': geometry_types,
+        'properties': _schema(types),
+    }
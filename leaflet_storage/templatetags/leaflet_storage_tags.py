@@ -4,7 +4,7 @@ from django import template
 from django.conf import settings
 
 from ..models import DataLayer, TileLayer
-from ..views import _urls_for_js
+from ..views import _urls_for_js, _urls_js
 
 register = template.Library()
 
@@ -20,7 +20,8 @@ def leaflet_storage_css():
 def leaflet_storage_js(locale=None):
     return {
         "STATIC_URL": settings.STATIC_URL,
-        "locale": locale
+        "locale": locale,
+        "urls_js": _urls_js()
     }
 
 
@@ -35,7 +36,6 @@ def map_fragment(map_instance, **kwargs):
     map_settings['properties'].update({
         'tilelayers': tilelayers,
         'datalayers': datalayer_data,
-        'urls': _urls_for_js(),
         'STATIC_URL': settings.STATIC_URL,
         "allowEdit": False,
         'hash': False,
@@ -49,6 +49,8 @@ def map_fragment(map_instance, **kwargs):
         'default_iconUrl': "%sstorage/src/img/marker.png" % settings.STATIC_URL,
         'slideshow': {}
     })
+    if not _urls_js():
+        map_settings['properties']['urls'] = _urls_for_js()
     map_settings['properties'].update(kwargs)
     prefix = kwargs.pop('prefix', None) or 'map_'
     return {
@@ -0,0 +1,188 @@
+"""
+Quantized TopoJSON encoding of datalayers.
+
+Positions are quantized on a `quantization` x `quantization` grid spanning
+the layer extent, lines and rings are cut at junctions into arcs stored
+once (a border shared by two polygons is written once, and referenced
+reversed by one of them), and arcs positions are delta encoded.
+
+See https://github.com/topojson/topojson-specification.
+"""
+from __future__ import division
+
+from .simplify import find_junctions
+from .spatial import geometry_bbox, merge_bboxes
+
+TOPOJSON_EXT = '.topojson'
+OBJECT_NAME = 'data'
+
+
+def _transform(features, quantization):
+    boxes = [geometry_bbox(f.get('geometry')) for f in features]
+    bbox = merge_bboxes(b for b in boxes if b) or (0, 0, 0, 0)
+    minx, miny, maxx, maxy = bbox
+    return bbox, {
+        'scale': [(maxx - minx) / (quantization - 1) or 1,
+                  (maxy - miny) / (quantization - 1) or 1],
+        'translate': [minx, miny],
+    }
+
+
+def _quantizer(transform):
+    (kx, ky), (x0, y0) = transform['scale'], transform['translate']
+
+    def quantize(position):
+        return (int(round((position[0] - x0) / kx)),
+                int(round((position[1] - y0) / ky)))
+    return quantize
+
+
+def _dedupe(points):
+    result = []
+    for point in points:
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+def _quantize_geometry(geometry, quantize):
+    """
+    Return a copy of `geometry` with quantized positions, without
+    consecutive duplicates.
+    """
+    if not geometry:
+        return geometry
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    result = dict(geometry)
+    if kind == 'GeometryCollection':
+        result['geometries'] = [_quantize_geometry(g, quantize)
+                                for g in geometry.get('geometries') or []]
+    elif kind == 'Point':
+        result['coordinates'] = quantize(coordinates) if coordinates else []
+    elif kind == 'MultiPoint':
+        result['coordinates'] = [quantize(p) for p in coordinates]
+    elif kind == 'LineString':
+        result['coordinates'] = _dedupe(quantize(p) for p in coordinates)
+    elif kind in ('MultiLineString', 'Polygon'):
+        result['coordinates'] = [_dedupe(quantize(p) for p in line)
+                                 for line in coordinates]
+    elif kind == 'MultiPolygon':
+        result['coordinates'] = [[_dedupe(quantize(p) for p in ring)
+                                  for ring in polygon]
+                                 for polygon in coordinates]
+    return result
+
+
+class ArcIndex(object):
+    """
+    Cut lines and rings at junctions, and store each arc once.
+    """
+
+    def __init__(self, junctions):
+        self.junctions = junctions
+        self.arcs = []
+        self.index = {}
+
+    def _add(self, arc):
+        arc = tuple(arc)
+        if arc in self.index:
+            return self.index[arc]
+        reverse = arc[::-1]
+        if reverse in self.index:
+            return ~self.index[reverse]
+        self.index[arc] = len(self.arcs)
+        self.arcs.append(arc)
+        return self.index[arc]
+
+    def _cut(self, points, fixed):
+        return [self._add(points[start:end + 1])
+                for start, end in zip(fixed, fixed[1:])]
+
+    def line(self, points):
+        if len(points) < 2:
+            points = points * 2
+        last = len(points) - 1
+        fixed = [i for i, p in enumerate(points)
+                 if i in (0, last) or p in self.junctions]
+        return self._cut(points, fixed)
+
+    def ring(self, points):
+        if len(points) > 1 and points[0] == points[-1]:
+            points = points[:-1]
+        if not points:
+            return []
+        starts = [i for i, p in enumerate(points) if p in self.junctions]
+        # Without junction, start at the smallest position, so the same
+        # ring is always cut the same way.
+        start = starts[0] if starts else points.index(min(points))
+        points = points[start:] + points[:start] + [points[start]]
+        fixed = [0] + [i for i, p in enumerate(points[:-1])
+                       if i and p in self.junctions] + [len(points) - 1]
+        return self._cut(points, fixed)
+
+
+def _encode_geometry(geometry, arcs):
+    if not geometry:
+        return {'type': None}
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    result = {'type': kind}
+    if kind == 'GeometryCollection':
+        result['geometries'] = [_encode_geometry(g, arcs)
+                                for g in geometry.get('geometries') or []]
+    elif kind in ('Point', 'MultiPoint'):
+        result['coordinates'] = coordinates
+    elif kind == 'LineString':
+        result['arcs'] = arcs.line(coordinates)
+    elif kind == 'MultiLineString':
+        result['arcs'] = [arcs.line(line) for line in coordinates]
+    elif kind == 'Polygon':
+        result['arcs'] = [arcs.ring(ring) for ring in coordinates]
+    elif kind == 'MultiPolygon':
+        result['arcs'] = [[arcs.ring(ring) for ring in polygon]
+                          for polygon in coordinates]
+    else:
+        return {'type': None}
+    return result
+
+
+def _delta(arc):
+    encoded = [list(arc[0])]
+    for previous, point in zip(arc, arc[1:]):
+        encoded.append([point[0] - previous[0], point[1] - previous[1]])
+    return encoded
+
+
+def dump_topology(data, quantization):
+    """
+    Return the quantized TopoJSON topology of FeatureCollection `data`.
+
+    Features are the geometries of the `data` object; other members of the
+    FeatureCollection (eg. `_storage`) are kept on this object.
+    """
+    features = data.get('features') or []
+    bbox, transform = _transform(features, quantization)
+    quantize = _quantizer(transform)
+    quantized = [dict(f, geometry=_quantize_geometry(f.get('geometry'),
+                                                     quantize))
+                 for f in features]
+    arcs = ArcIndex(find_junctions(quantized))
+    geometries = []
+    for feature in quantized:
+        geometry = _encode_geometry(feature.get('geometry'), arcs)
+        if feature.get('properties') is not None:
+            geometry['properties'] = feature['properties']
+        if feature.get('id') is not None:
+            geometry['id'] = feature['id']
+        geometries.append(geometry)
+    collection = dict((k, v) for k, v in data.items()
+                      if k not in ('type', 'features'))
+    collection.update(type='GeometryCollection', geometries=geometries)
+    return {
+        'type': 'Topology',
+        'bbox': list(bbox),
+        'transform': transform,
+        'objects': {OBJECT_NAME: collection},
+        'arcs': [_delta(arc) for arc in arcs.arcs],
+    }
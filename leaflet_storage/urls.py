@@ -26,7 +26,11 @@ urlpatterns = [
 ]
 urlpatterns += decorated_patterns(cache_control(must_revalidate=True),
     url(r'^datalayer/(?P<pk>[\d]+)/$', views.DataLayerView.as_view(), name='datalayer_view'),  # noqa
+    url(r'^map/(?P<pk>[\d]+)/datalayers/bundle/$', views.MapDataLayersBundle.as_view(), name='map_datalayers_bundle'),  # noqa
     url(r'^datalayer/(?P<pk>[\d]+)/versions/$', views.DataLayerVersions.as_view(), name='datalayer_versions'),  # noqa
+    url(r'^datalayer/(?P<pk>[\d]+)/bbox/$', views.DataLayerBBox.as_view(), name='datalayer_bbox'),  # noqa
+    url(r'^datalayer/(?P<pk>[\d]+)/fgb/$', views.DataLayerFlatGeobuf.as_view(), name='datalayer_fgb'),  # noqa
+    url(r'^datalayer/(?P<pk>[\d]+)/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf$', views.DataLayerTile.as_view(), name='datalayer_tile'),  # noqa
     url(r'^datalayer/(?P<pk>[\d]+)/(?P<name>[_\w]+.geojson)$', views.DataLayerVersion.as_view(), name='datalayer_version'),  # noqa
 )
 urlpatterns += decorated_patterns([ensure_csrf_cookie],
@@ -51,6 +55,8 @@ urlpatterns += decorated_patterns(
         views.DataLayerCreate.as_view(), name='datalayer_create'),
     url(r'^map/(?P<map_id>[\d]+)/datalayer/update/(?P<pk>\d+)/$',
         views.DataLayerUpdate.as_view(), name='datalayer_update'),
+    url(r'^map/(?P<map_id>[\d]+)/datalayer/patch/(?P<pk>\d+)/$',
+        views.DataLayerPatch.as_view(), name='datalayer_patch'),
     url(r'^map/(?P<map_id>[\d]+)/datalayer/delete/(?P<pk>\d+)/$',
         views.DataLayerDelete.as_view(), name='datalayer_delete'),
 )
@@ -1,7 +1,29 @@
+import calendar
+import errno
 import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
 
+from django.conf import settings
+from django.core.files.base import ContentFile, File
 from django.core.urlresolvers import get_resolver
 from django.core.urlresolvers import RegexURLPattern, RegexURLResolver
+from django.utils.encoding import force_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 def get_uri_template(urlname, args=None, prefix=""):
@@ -106,6 +128,358 @@ def decorated_patterns(func, *urls):
 
 
 def gzip_file(from_path, to_path):
-    with open(from_path, 'rb') as f_in:
-        with gzip.open(to_path, 'wb') as f_out:
-            f_out.writelines(f_in)
+    compress_file(from_path, to_path, 'gzip')
+
+
+def _brotli_copy(f_in, f_out):
+    compressor = brotli.Compressor(quality=11)
+    for chunk in iter(lambda: f_in.read(64 * 1024), b''):
+        f_out.write(compressor.process(chunk))
+    f_out.write(compressor.finish())
+
+
+def _zstd_copy(f_in, f_out):
+    zstandard.ZstdCompressor(level=19).copy_stream(f_in, f_out)
+
+
+# Supported Content-Encoding values, by order of preference, with the
+# extension of the precompressed sibling file.
+ENCODINGS = (
+    ('br', '.br'),
+    ('zstd', '.zst'),
+    ('gzip', '.gz'),
+)
+EXTENSIONS = dict(ENCODINGS)
+
+
+def get_encodings():
+    """
+    Return the enabled encodings, by order of preference.
+    """
+    if not getattr(settings, 'LEAFLET_STORAGE_GZIP', True):
+        return []
+    enabled = getattr(settings, 'LEAFLET_STORAGE_ENCODINGS',
+                      [name for name, ext in ENCODINGS])
+    available = {'gzip': True, 'br': bool(brotli), 'zstd': bool(zstandard)}
+    return [name for name, ext in ENCODINGS
+            if name in enabled and available[name]]
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yield a temporary path next to `path`, renamed to `path` once written,
+    so readers never see a half written file.
+    """
+    tmp_path = '{path}.{uid}.tmp'.format(path=path, uid=uuid.uuid4().hex)
+    try:
+        yield tmp_path
+        os.rename(tmp_path, path)  # Atomic on POSIX.
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def link_or_copy(storage, from_name, to_name):
+    """
+    Copy stored file `from_name` to `to_name`, as a hardlink when the
+    storage is on a local filesystem: stored files are never modified in
+    place (see atomic_path), so sharing their inode is safe.
+    """
+    try:
+        from_path, to_path = storage.path(from_name), storage.path(to_name)
+    except NotImplementedError:
+        with storage.open(from_name, 'rb') as f:
+            storage.save(to_name, f)
+        return
+    try:
+        os.makedirs(os.path.dirname(to_path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    try:
+        os.link(from_path, to_path)
+    except OSError:
+        # Eg. another device, or a filesystem without hardlinks.
+        shutil.copyfile(from_path, to_path)
+
+
+def get_simplify_zooms():
+    """
+    Return the zooms for which a simplified variant of datalayers is built.
+    """
+    return sorted(getattr(settings, 'LEAFLET_STORAGE_SIMPLIFY_ZOOMS',
+                          [4, 7, 10]))
+
+
+def compress_stream(f_in, f_out, encoding):
+    if encoding == 'gzip':
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f_out) as f:
+            shutil.copyfileobj(f_in, f)
+    else:
+        copy = _brotli_copy if encoding == 'br' else _zstd_copy
+        copy(f_in, f_out)
+
+
+def compress_iterator(chunks, encoding):
+    """
+    Yield bytes `chunks` compressed with `encoding`, as they come. Levels
+    are lower than the ones of precompressed files, as this runs while
+    serving.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        chunk = process(chunk)
+        if chunk:
+            yield chunk
+    yield finish()
+
+
+def compress_file(from_path, to_path, encoding):
+    with atomic_path(to_path) as tmp_path:
+        with open(from_path, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+            compress_stream(f_in, f_out, encoding)
+
+
+def local_path(storage, name):
+    """
+    Return the filesystem path of stored file `name`, or None if `storage`
+    is not on a local filesystem (eg. object storage).
+    """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def replace_stored(storage, name, content):
+    """
+    Store `content` (a File) at `name`, replacing the previous file: on a
+    local filesystem readers never see a half written file (see
+    atomic_path), other storages are expected to replace objects at once.
+    """
+    path = local_path(storage, name)
+    if path is not None:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+        return
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, content)
+
+
+def compress_stored(storage, from_name, to_name, encoding):
+    """
+    Store at `to_name` stored file `from_name` compressed with `encoding`.
+    """
+    from_path = local_path(storage, from_name)
+    if from_path is not None:
+        compress_file(from_path, storage.path(to_name), encoding)
+        return
+    with storage.open(from_name, 'rb') as f_in:
+        with tempfile.TemporaryFile() as f_out:
+            compress_stream(f_in, f_out, encoding)
+            f_out.seek(0)
+            replace_stored(storage, to_name, File(f_out))
+
+
+def save_stored(storage, name, content):
+    """
+    Store bytes `content` at `name`, replacing the previous file.
+    """
+    replace_stored(storage, name, ContentFile(content))
+
+
+def delete_stored_tree(storage, name):
+    """
+    Delete directory `name` and all its content.
+    """
+    path = local_path(storage, name)
+    if path is not None:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    directories, files = storage.listdir(name)
+    for directory in directories:
+        delete_stored_tree(storage, os.path.join(name, directory))
+    for filename in files:
+        storage.delete(os.path.join(name, filename))
+
+
+def delete_stored_prefix(storage, prefix):
+    """
+    Delete the stored files of the directory of `prefix` whose name starts
+    with its basename.
+    """
+    root, start = os.path.split(prefix)
+    try:
+        filenames = storage.listdir(root)[1]
+    except (IOError, OSError):
+        return  # No such directory.
+    for filename in filenames:
+        if not filename.startswith(start):
+            continue
+        try:
+            storage.delete(os.path.join(root, filename))
+        except FileNotFoundError:
+            pass
+
+
+def delete_stored_derived(storage, names, keep=()):
+    """
+    Delete stored files `names` and the ones derived from them, ie. named
+    after them with more extensions (whatever the settings they were built
+    with), but the ones ending with an extension of `keep`. Each directory
+    is only listed once.
+    """
+    roots = {}
+    for name in names:
+        root, basename = os.path.split(name)
+        roots.setdefault(root, set()).add(basename)
+    for root, basenames in roots.items():
+        try:
+            filenames = storage.listdir(root)[1]
+        except (IOError, OSError):
+            continue  # No such directory.
+        for filename in filenames:
+            base = filename
+            while base not in basenames and '.' in base:
+                base = base.rsplit('.', 1)[0]
+            if base not in basenames or filename.endswith(tuple(keep)):
+                continue
+            try:
+                storage.delete(os.path.join(root, filename))
+            except FileNotFoundError:
+                pass
+
+
+def stored_mtime(storage, name):
+    """
+    Return the modification time of stored file `name`, as a timestamp.
+    """
+    path = local_path(storage, name)
+    if path is not None:
+        return os.path.getmtime(path)
+    modified = storage.get_modified_time(name)
+    if modified.utcoffset() is None:
+        return time.mktime(modified.timetuple())  # Naive: local time.
+    return calendar.timegm(modified.utctimetuple())
+
+
+def parse_accept_encoding(header):
+    """
+    Return a dict of content-coding: qvalue from an Accept-Encoding header.
+    """
+    codings = {}
+    for item in header.split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        qvalue = 1.0
+        for param in parts[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value.strip())
+                except ValueError:
+                    qvalue = 0.0
+        codings[coding] = qvalue
+    return codings
+
+
+def negotiate_encodings(header, encodings):
+    """
+    Return the `encodings` acceptable per `header`, that the client does
+    not explicitly rank below identity, best first. Ties are broken by
+    `encodings` order, so compressed wins over identity.
+    """
+    codings = parse_accept_encoding(header)
+    default = codings.get('*', 0.0)
+    # Identity is always acceptable, but only ranked when listed.
+    identity = codings.get('identity', default)
+    accepted = []
+    for index, name in enumerate(encodings):
+        qvalue = codings.get(name, default)
+        if qvalue > 0 and qvalue >= identity:
+            accepted.append((-qvalue, index, name))
+    return [name for qvalue, index, name in sorted(accepted)]
+
+
+def file_md5(f, chunk_size=64 * 1024):
+    """Return md5 hexdigest of Django File `f`, reading it by chunks."""
+    md5 = hashlib.md5()
+    for chunk in f.chunks(chunk_size):
+        md5.update(force_bytes(chunk))
+    f.seek(0)
+    return md5.hexdigest()
+
+
+def parse_range(header, size):
+    """
+    Parse a single range "bytes=" Range header for a `size` long content.
+    Return (start, end), end included, or None if the header must be
+    ignored (absent, malformed, multiple ranges). Raise ValueError if the
+    range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    start, end = [v.strip() for v in spec.split('-', 1)]
+    if not start:
+        # Suffix range: last `end` bytes.
+        if not end.isdigit():
+            return None
+        if not int(end) or not size:
+            raise ValueError('Range not satisfiable')
+        return max(size - int(end), 0), size - 1
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise ValueError('Range not satisfiable')
+    end = int(end) if end else size - 1
+    return start, min(end, size - 1)
+
+
+def file_range_iterator(path, start, length, chunk_size=64 * 1024):
+    """
+    Yield `length` bytes from file at `path`, starting at `start`.
+    """
+    return range_iterator(open(path, 'rb'), start, length, chunk_size)
+
+
+def range_iterator(f, start, length, chunk_size=64 * 1024):
+    """
+    Yield `length` bytes from open file `f`, starting at `start`, and close
+    it.
+    """
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,321 @@
+"""
+Streaming validation of uploaded GeoJSON.
+
+The upload is read by chunks and tokenized on the fly, so memory does not
+depend on the layer size (only on the longest single token, eg. a long
+string property); structure is checked, features counted and the bbox
+computed in the same pass.
+"""
+import codecs
+import json
+import re
+
+# Types and the nesting of their `coordinates`, a position being 0.
+GEOMETRY_DEPTHS = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'MultiLineString': 2,
+    'Polygon': 2,
+    'MultiPolygon': 3,
+}
+MAX_DEPTH = 64
+
+NUMBER = r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?'
+TOKEN = re.compile(r'''
+    [ \t\n\r]*
+    (?:
+        # Shortcut for the bulk of the data: a whole array of numbers.
+        (?P<position>\[[ \t\n\r]*{number}(?:[ \t\n\r]*,[ \t\n\r]*{number})*
+                     [ \t\n\r]*\])
+      | (?P<punctuation>[{{}}\[\],:])
+      | "(?P<string>(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{{4}}))*)"
+      | (?P<number>{number})
+      | (?P<literal>true|false|null)
+    )'''.format(number=NUMBER), re.VERBOSE)
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Longest incomplete number or literal worth waiting more data for.
+MAX_PARTIAL = 64
+PARTIAL_CHARS = u'0123456789+-.eEaflnrstu'
+
+
+class GeoJSONError(ValueError):
+    pass
+
+
+class Summary(object):
+
+    def __init__(self):
+        self.features = 0
+        self.bbox = None
+
+    def extend(self, position):
+        x, y = position[0], position[1]
+        if self.bbox is None:
+            self.bbox = [x, y, x, y]
+        else:
+            bbox = self.bbox
+            if x < bbox[0]:
+                bbox[0] = x
+            if y < bbox[1]:
+                bbox[1] = y
+            if x > bbox[2]:
+                bbox[2] = x
+            if y > bbox[3]:
+                bbox[3] = y
+
+
+def iter_tokens(chunks):
+    """
+    Yield (kind, raw) JSON tokens from an iterable of bytes `chunks`.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = u''
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            final = True
+            chunk = b''
+        try:
+            buffer += decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise GeoJSONError('Invalid UTF-8: {}'.format(e))
+        if buffer.startswith(u'\ufeff'):
+            buffer = buffer[1:]
+        pos, length = 0, len(buffer)
+        while True:
+            match = TOKEN.match(buffer, pos)
+            if not match:
+                break
+            if (not final and match.lastgroup in ('number', 'literal') and
+                    (match.end() == length or
+                     buffer[match.end()] in PARTIAL_CHARS)):
+                break  # Could continue in next chunk.
+            pos = match.end()
+            yield match.lastgroup, match.group(match.lastgroup)
+        pos = WHITESPACE.match(buffer, pos).end()
+        rest = buffer[pos:]
+        if rest and (final or not (rest.startswith(u'"') or
+                                   len(rest) <= MAX_PARTIAL)):
+            raise GeoJSONError('Invalid JSON near "{}"'.format(rest[:20]))
+        buffer = rest
+    yield None, None
+
+
+class Parser(object):
+    """
+    Recursive descent over the tokens of a FeatureCollection.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.summary = Summary()
+        self.advance()
+
+    def advance(self):
+        self.kind, self.raw = next(self.tokens)
+
+    def error(self, message):
+        raise GeoJSONError(message)
+
+    def expect(self, punctuation):
+        if self.kind != 'punctuation' or self.raw != punctuation:
+            self.error('Expected "{}"'.format(punctuation))
+        self.advance()
+
+    def is_punctuation(self, punctuation):
+        return self.kind == 'punctuation' and self.raw == punctuation
+
+    def string(self):
+        if self.kind != 'string':
+            self.error('Expected a string')
+        value = json.loads(u'"{}"'.format(self.raw))
+        self.advance()
+        return value
+
+    def members(self, depth):
+        """
+        Yield the keys of an object; the caller must consume each value.
+        """
+        if depth > MAX_DEPTH:
+            self.error('Too deeply nested')
+        self.expect('{')
+        if self.is_punctuation('}'):
+            self.advance()
+            return
+        while True:
+            key = self.string()
+            self.expect(':')
+            yield key
+            if self.is_punctuation(','):
+                self.advance()
+                continue
+            self.expect('}')
+            return
+
+    def items(self, depth):
+        """
+        Yield for each item of an array; the caller must consume the item.
+        """
+        if depth > MAX_DEPTH:
+            self.error('Too deeply nested')
+        self.expect('[')
+        if self.is_punctuation(']'):
+            self.advance()
+            return
+        while True:
+            yield
+            if self.is_punctuation(','):
+                self.advance()
+                continue
+            self.expect(']')
+            return
+
+    def skip(self, depth=0):
+        """
+        Consume any JSON value.
+        """
+        if self.is_punctuation('{'):
+            for key in self.members(depth + 1):
+                self.skip(depth + 1)
+        elif self.is_punctuation('['):
+            for item in self.items(depth + 1):
+                self.skip(depth + 1)
+        elif self.kind in ('string', 'number', 'literal', 'position'):
+            self.advance()
+        else:
+            self.error('Unexpected end of data' if self.kind is None
+                       else 'Unexpected "{}"'.format(self.raw))
+
+    def null(self):
+        if self.kind == 'literal' and self.raw == 'null':
+            self.advance()
+            return True
+        return False
+
+    def feature_collection(self):
+        kind, has_features = None, False
+        for key in self.members(1):
+            if key == 'type':
+                kind = self.string()
+            elif key == 'features':
+                has_features = True
+                for item in self.items(2):
+                    self.feature(3)
+            else:
+                self.skip(1)
+        if self.kind is not None:
+            self.error('Extra data after FeatureCollection')
+        if kind != 'FeatureCollection':
+            self.error('Not a FeatureCollection')
+        if not has_features:
+            self.error('FeatureCollection without features')
+        return self.summary
+
+    def feature(self, depth):
+        kind, has_geometry = None, False
+        for key in self.members(depth):
+            if key == 'type':
+                kind = self.string()
+            elif key == 'geometry':
+                has_geometry = True
+                if not self.null():
+                    self.geometry(depth + 1)
+            elif key == 'properties':
+                if not self.null():
+                    if not self.is_punctuation('{'):
+                        self.error('Feature properties must be an object')
+                    self.skip(depth)
+            else:
+                self.skip(depth)
+        if kind != 'Feature':
+            self.error('Not a Feature')
+        if not has_geometry:
+            self.error('Feature without geometry')
+        self.summary.features += 1
+
+    def geometry(self, depth):
+        kind, coordinates_depth, has_geometries = None, None, False
+        has_coordinates = False
+        for key in self.members(depth):
+            if key == 'type':
+                kind = self.string()
+            elif key == 'coordinates':
+                has_coordinates = True
+                coordinates_depth = self.coordinates(depth + 1)
+            elif key == 'geometries':
+                has_geometries = True
+                for item in self.items(depth + 1):
+                    self.geometry(depth + 2)
+            else:
+                self.skip(depth)
+        if kind == 'GeometryCollection':
+            if not has_geometries:
+                self.error('GeometryCollection without geometries')
+            return
+        if kind not in GEOMETRY_DEPTHS:
+            self.error('Unknown geometry type: {}'.format(kind))
+        if not has_coordinates:
+            self.error('{} without coordinates'.format(kind))
+        # None means empty coordinates, which are allowed.
+        if coordinates_depth not in (None, GEOMETRY_DEPTHS[kind]):
+            self.error('Invalid {} coordinates'.format(kind))
+
+    def coordinates(self, depth):
+        """
+        Consume a coordinates array, and return its nesting depth.
+        """
+        if self.kind == 'position':
+            position = [float(v) for v in self.raw[1:-1].split(',')]
+            self.advance()
+            if len(position) < 2:
+                self.error('Position must have at least two elements')
+            self.summary.extend(position)
+            return 0
+        self.expect('[')
+        if self.kind == 'number':
+            position = []
+            while True:
+                if self.kind != 'number':
+                    self.error('Invalid position')
+                position.append(float(self.raw))
+                self.advance()
+                if self.is_punctuation(','):
+                    self.advance()
+                    continue
+                self.expect(']')
+                break
+            if len(position) < 2:
+                self.error('Position must have at least two elements')
+            self.summary.extend(position)
+            return 0
+        if self.is_punctuation(']'):
+            self.advance()
+            return None
+        if depth > MAX_DEPTH:
+            self.error('Too deeply nested')
+        found = None
+        while True:
+            if not (self.is_punctuation('[') or self.kind == 'position'):
+                self.error('Invalid coordinates')
+            child = self.coordinates(depth + 1)
+            if child is not None:
+                if found is not None and found != child + 1:
+                    self.error('Mixed coordinates nesting')
+                found = child + 1
+            if self.is_punctuation(','):
+                self.advance()
+                continue
+            self.expect(']')
+            return found
+
+
+def validate(chunks):
+    """
+    Validate a FeatureCollection given as an iterable of bytes `chunks`,
+    and return its Summary. Raise GeoJSONError if invalid.
+    """
+    return Parser(iter_tokens(chunks)).feature_collection()
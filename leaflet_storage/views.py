@@ -8,10 +8,18 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout as do_logout
 from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import (HashedFilesMixin,
+                                                staticfiles_storage)
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
 from django.core.signing import Signer, BadSignature
 from django.core.urlresolvers import reverse_lazy, reverse
 from django.http import (HttpResponse, HttpResponseForbidden,
-                         HttpResponseRedirect, HttpResponsePermanentRedirect)
+                         HttpResponseBadRequest, Http404,
+                         HttpResponseRedirect, HttpResponsePermanentRedirect,
+                         FileResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext as _
@@ -21,16 +29,27 @@ from django.views.generic.detail import BaseDetailView
 from django.views.generic.list import ListView
 from django.views.generic.base import TemplateView, RedirectView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.encoding import force_bytes
-from django.utils.http import http_date
-from django.middleware.gzip import re_accepts_gzip
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import to_locale
 
 from .models import Map, DataLayer, TileLayer, Pictogram, Licence
-from .utils import get_uri_template, gzip_file
+from . import cache as map_settings_cache
+from .bundle import CONTENT_TYPE as BUNDLE_CONTENT_TYPE
+from .delta import DELTA_EXT
+from .fgb import CONTENT_TYPE as FGB_CONTENT_TYPE, FGB_EXT
+from . import geojsonseq
+from .patch import apply_operations
+from .simplify import pick_zoom
+from .spatial import SEQ_EXT
+from .topojson import TOPOJSON_EXT
+from .utils import (get_uri_template, get_encodings, negotiate_encodings,
+                    get_simplify_zooms, parse_range, range_iterator,
+                    stored_mtime, compress_iterator, ENCODINGS, EXTENSIONS)
 from .forms import (DataLayerForm, UpdateMapPermissionsForm, MapSettingsForm,
                     AnonymousMapPermissionsForm, DEFAULT_LATITUDE,
-                    DEFAULT_LONGITUDE, FlatErrorList)
+                    DEFAULT_LONGITUDE, FlatErrorList, check_datalayer_size)
 
 User = get_user_model()
 ANONYMOUS_COOKIE_MAX_AGE = 60 * 60 * 24 * 30  # One month
@@ -40,19 +59,71 @@ ANONYMOUS_COOKIE_MAX_AGE = 60 * 60 * 24 * 30  # One month
 #     Utils      #
 # ############## #
 
+# Computed once per process, see _urls_for_js and _urls_js.
+_JS_URLS = {}
+
+
 def _urls_for_js(urls=None):
     """
     Return templated URLs prepared for javascript.
+
+    The table of all the named URLs only depends on the URLconf and the
+    settings, so it is computed once per process (see reset_urls_for_js).
     """
     if urls is None:
-        # prevent circular import
-        from .urls import urlpatterns
-        urls = [url.name for url in urlpatterns if getattr(url, 'name', None)]
+        if 'urls' not in _JS_URLS:
+            # prevent circular import
+            from .urls import urlpatterns
+            names = [url.name for url in urlpatterns
+                     if getattr(url, 'name', None)]
+            _JS_URLS['urls'] = _urls_for_js(names)
+        return dict(_JS_URLS['urls'])
     urls = dict(zip(urls, [get_uri_template(url) for url in urls]))
     urls.update(getattr(settings, 'LEAFLET_STORAGE_EXTRA_URLS', {}))
     return urls
 
 
+def _urls_js():
+    """
+    Return the URL of a static JS file setting the templated URLs as
+    default map option, when LEAFLET_STORAGE_URLS_JS is set, so they are
+    not inlined in each map page; None otherwise. The file is named after
+    its content hash, and written once per process if missing.
+
+    Only local, non hashing, static storages are written to while serving:
+    hashing ones would give the URL of a file never post-processed, and
+    remote ones an upload per process. URLs are inlined with the others.
+    """
+    if not getattr(settings, 'LEAFLET_STORAGE_URLS_JS', False):
+        return None
+    if (not isinstance(staticfiles_storage, FileSystemStorage) or
+            isinstance(staticfiles_storage, HashedFilesMixin)):
+        return None
+    if 'js' not in _JS_URLS:
+        content = 'L.Storage.Map.mergeOptions({{urls: {}}});\n'.format(
+            json.dumps(_urls_for_js(), sort_keys=True)).encode('utf-8')
+        name = 'storage/urls.{}.js'.format(
+            hashlib.md5(content).hexdigest()[:12])
+        if not staticfiles_storage.exists(name):
+            name = staticfiles_storage.save(name, ContentFile(content))
+        _JS_URLS['js'] = staticfiles_storage.url(name)
+    return _JS_URLS['js']
+
+
+def reset_urls_for_js(setting=None, **kwargs):
+    """
+    Forget the computed URLs, eg. when the URLconf is reloaded. Also
+    called when a setting they depend on changes (mostly in tests).
+    """
+    if setting in (None, 'ROOT_URLCONF', 'LEAFLET_STORAGE_EXTRA_URLS',
+                   'LEAFLET_STORAGE_URLS_JS', 'STATIC_URL',
+                   'STATICFILES_STORAGE'):
+        _JS_URLS.clear()
+
+
+setting_changed.connect(reset_urls_for_js)
+
+
 def render_to_json(templates, context, request):
     """
     Generate a JSON HttpResponse with rendered template HTML.
@@ -96,33 +167,52 @@ class MapDetailMixin(object):
 
     def get_context_data(self, **kwargs):
         context = super(MapDetailMixin, self).get_context_data(**kwargs)
+        allow_edit = self.is_edit_allowed()
+        locale = None
+        if settings.USE_I18N:
+            locale = settings.LANGUAGE_CODE
+            # Check attr in case the middleware is not active
+            if hasattr(self.request, "LANGUAGE_CODE"):
+                locale = self.request.LANGUAGE_CODE
+            locale = to_locale(locale)
+            context['locale'] = locale
+
+        def build():
+            return self.get_map_settings(allow_edit, locale)
+
+        storage_id = self.get_storage_id()
+        if storage_id is None:
+            context['map_settings'] = build()
+        else:
+            variant = '{}:{:d}:{:d}'.format(locale, allow_edit,
+                                            self.inline_urls())
+            context['map_settings'] = map_settings_cache.get_map_settings(
+                storage_id, variant, build)
+        return context
+
+    def get_map_settings(self, allow_edit, locale):
+        """
+        Return the serialized settings of the map page.
+        """
         properties = {
-            'urls': _urls_for_js(),
             'tilelayers': self.get_tilelayers(),
-            'allowEdit': self.is_edit_allowed(),
+            'allowEdit': allow_edit,
             'default_iconUrl': "%sstorage/src/img/marker.png" % settings.STATIC_URL,  # noqa
             'storage_id': self.get_storage_id(),
             'licences': dict((l.name, l.json) for l in Licence.objects.all()),
         }
+        if self.inline_urls():
+            properties['urls'] = _urls_for_js()
         if self.get_short_url():
             properties['shortUrl'] = self.get_short_url()
-
-        if settings.USE_I18N:
-            locale = settings.LANGUAGE_CODE
-            # Check attr in case the middleware is not active
-            if hasattr(self.request, "LANGUAGE_CODE"):
-                locale = self.request.LANGUAGE_CODE
-            locale = to_locale(locale)
+        if locale:
             properties['locale'] = locale
-            context['locale'] = locale
         map_settings = self.get_geojson()
         if "properties" not in map_settings:
             map_settings['properties'] = {}
         map_settings['properties'].update(properties)
         map_settings['properties']['datalayers'] = self.get_datalayers()
-        context['map_settings'] = json.dumps(map_settings,
-                                             indent=settings.DEBUG)
-        return context
+        return json.dumps(map_settings, indent=settings.DEBUG)
 
     def get_tilelayers(self):
         return TileLayer.get_list(selected=TileLayer.get_default())
@@ -133,6 +223,13 @@ class MapDetailMixin(object):
     def is_edit_allowed(self):
         return True
 
+    def inline_urls(self):
+        """
+        Whether the URL templates go in the settings, rather than in the
+        script loaded by the page (see _urls_js).
+        """
+        return not _urls_js()
+
     def get_storage_id(self):
         return None
 
@@ -212,6 +309,56 @@ class MapViewGeoJSON(MapView):
     def render_to_response(self, context, *args, **kwargs):
         return HttpResponse(context['map_settings'])
 
+    def inline_urls(self):
+        return True  # Not loaded by a page.
+
+
+class MapDataLayersBundle(BaseDetailView):
+    """
+    All the datalayers displayed on load, in one response (see `bundle`),
+    served from the precompressed bundle built when they change.
+    """
+    model = Map
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.object.can_view(self.request):
+            return HttpResponseForbidden('Forbidden')
+        name, encoding, etag = self.negotiate(self.object.get_bundle())
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            storage = DataLayer._meta.get_field('geojson').storage
+            try:
+                f = storage.open(name, 'rb')
+            except (IOError, OSError):
+                # Deleted by a concurrent build since it was negotiated.
+                name, encoding, etag = self.negotiate(
+                    self.object.build_bundle())
+                f = storage.open(name, 'rb')
+            response = FileResponse(f, content_type=BUNDLE_CONTENT_TYPE)
+            response['Content-Length'] = storage.size(name)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+    def negotiate(self, name):
+        """
+        Return (name, encoding, etag) of the variant of bundle `name` to
+        serve, encoding being None for identity.
+        """
+        storage = DataLayer._meta.get_field('geojson').storage
+        key = os.path.basename(name).split('.')[0]
+        encoding = None
+        ae = self.request.META.get('HTTP_ACCEPT_ENCODING', '')
+        for candidate in negotiate_encodings(ae, get_encodings()):
+            if storage.exists(name + EXTENSIONS[candidate]):
+                name += EXTENSIONS[candidate]
+                encoding = candidate
+                break
+        etag = quote_etag(key + ('-' + encoding if encoding else ''))
+        return name, encoding, etag
+
 
 class MapNew(MapDetailMixin, TemplateView):
     template_name = "leaflet_storage/map_detail.html"
@@ -406,77 +553,420 @@ class MapAnonymousEditUrl(RedirectView):
 # ############## #
 
 
-class GZipMixin(object):
+class CompressedMixin(object):
+    """
+    Negotiate the best precompressed sibling of the datalayer file.
 
-    EXT = '.gz'
+    Files are only accessed through the storage API, so any storage (local
+    filesystem, object storage...) can serve them.
+    """
 
-    def _path(self):
-        return self.object.geojson.path
+    @property
+    def storage(self):
+        return self.object.geojson.storage
 
-    def path(self):
-        """
-        Serve gzip file if client accept it.
-        Generate or update the gzip file if needed.
-        """
-        path = self._path()
-        statobj = os.stat(path)
+    def _name(self):
+        return self.object.geojson.name
+
+    def accepted_encodings(self):
         ae = self.request.META.get('HTTP_ACCEPT_ENCODING', '')
-        if re_accepts_gzip.search(ae) and getattr(settings, 'LEAFLET_STORAGE_GZIP', True):
-            gzip_path = "{path}{ext}".format(path=path, ext=self.EXT)
-            up_to_date = True
-            if not os.path.exists(gzip_path):
-                up_to_date = False
-            else:
-                gzip_statobj = os.stat(gzip_path)
-                if statobj.st_mtime > gzip_statobj.st_mtime:
-                    up_to_date = False
-            if not up_to_date:
-                gzip_file(path, gzip_path)
-            path = gzip_path
-        return path
+        return negotiate_encodings(ae, get_encodings())
 
-    def etag(self):
-        path = self.path()
-        with open(path, mode='rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+    def simplified_zoom(self):
+        """
+        Return the simplification zoom matching the `zoom` or `tolerance`
+        (in degrees) query params, if any. Invalid values are ignored.
+        """
+        params = {}
+        for name, cast in (('zoom', int), ('tolerance', float)):
+            try:
+                params[name] = cast(self.request.GET[name])
+            except (KeyError, ValueError):
+                pass
+        if not params:
+            return None
+        pixels = getattr(settings, 'LEAFLET_STORAGE_SIMPLIFY_PIXELS', 1)
+        return pick_zoom(get_simplify_zooms(), pixels, **params)
+
+    def variant_name(self):
+        """
+        Return the storage name of the representation asked by the query
+        params: TopoJSON for `format=topojson`, else the simplified variant
+        matching `zoom` or `tolerance`, else the full resolution GeoJSON.
+        """
+        name = self._name()
+        if self.request.GET.get('format') == 'topojson':
+            name += TOPOJSON_EXT
+            if not self.storage.exists(name):
+                raise Http404('No TopoJSON for this version.')
+            return name
+        zoom = self.simplified_zoom()
+        if zoom is not None:
+            simplified_name = name + DataLayer.simplified_ext(zoom)
+            if self.storage.exists(simplified_name):
+                return simplified_name
+        return name
+
+    def negotiate(self):
+        """
+        Return (name, encoding) of the file to serve, encoding being None
+        for identity. Only serve files generated at save time (see
+        DataLayer.build_derived); never compress nor simplify while serving.
+        """
+        name = self.variant_name()
+        for encoding in self.accepted_encodings():
+            compressed_name = name + EXTENSIONS[encoding]
+            if self.storage.exists(compressed_name):
+                return compressed_name, encoding
+        return name, None
 
+    def content_hash(self):
+        return self.object.content_hash
 
-class DataLayerView(GZipMixin, BaseDetailView):
+    def etags(self):
+        """
+        All the valid ETags for the current content, one per encoding.
+        """
+        digest = self.content_hash()
+        if not digest:
+            return []
+        # Also the ones of the features table representation.
+        return [quote_etag(tag + suffix)
+                for tag in (digest, digest + '-db')
+                for suffix in [''] + ['-' + name for name, ext in ENCODINGS]]
+
+    def etag(self, name=None, mtime=None, size=None):
+        """
+        Use the content hash computed at save time when available, otherwise
+        compute ETag from file metadata, so we never need to read the file.
+        """
+        if name is None:
+            name = self.negotiate()[0]
+        digest = self.content_hash()
+        if digest:
+            # Each variant and encoding is a distinct representation, with
+            # its own ETag: "<hash>[-z<zoom>|-topojson][-<encoding>]".
+            suffix = name[len(self._name()):]
+            for encoding, ext in ENCODINGS:
+                if suffix.endswith(ext):
+                    suffix = '{}-{}'.format(suffix[:-len(ext)], encoding)
+                    break
+            return quote_etag(digest + suffix.replace('.', '-'))
+        if mtime is None:
+            mtime = stored_mtime(self.storage, name)
+        if size is None:
+            size = self.storage.size(name)
+        key = '{name}:{mtime}:{size}'.format(name=os.path.basename(name),
+                                             mtime=mtime, size=size)
+        return quote_etag(hashlib.md5(force_bytes(key)).hexdigest())
+
+
+# Backward compatibility.
+GZipMixin = CompressedMixin
+
+
+class DataLayerView(CompressedMixin, BaseDetailView):
     model = DataLayer
+    content_type = 'application/json'
 
     def render_to_response(self, context, **response_kwargs):
-        response = None
-        path = self.path()
+        if self.sequence_format():
+            return self.sequence_response()
+        if self.from_features_table():
+            return self.features_table_response()
+        if getattr(settings, 'LEAFLET_STORAGE_SERVE_REDIRECT', False):
+            return self.redirect_response()
+        name, encoding = self.negotiate()
+        mtime = stored_mtime(self.storage, name)
+        etag = self.etag(name, mtime)
+        # Short-circuit before opening the file when client cache is fresh.
+        response = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=int(mtime)
+        )
+        if response is None:
+            if getattr(settings, 'LEAFLET_STORAGE_XSENDFILE_HEADER', None):
+                response = HttpResponse()
+                internal = '/internal/{}'.format(name)
+                response[settings.LEAFLET_STORAGE_XSENDFILE_HEADER] = internal
+            else:
+                response = self.file_response(name, mtime, etag)
+            # Not for an error (eg. 416): it has no body.
+            if encoding and response.status_code < 400:
+                response['Content-Encoding'] = encoding
+        response["Last-Modified"] = http_date(mtime)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+    def redirect_response(self):
+        """
+        Let the storage serve the file (eg. through a presigned URL of an
+        object storage). Precompressed siblings are not used, as the
+        storage would not send their Content-Encoding.
+        """
+        return HttpResponseRedirect(self.storage.url(self.variant_name()))
+
+    def sequence_format(self):
+        """
+        Return the `format` param if it asks for one feature per line (see
+        `geojsonseq`), else None.
+        """
+        format = self.request.GET.get('format')
+        return format if format in geojsonseq.FORMATS else None
+
+    def iter_features(self):
+        """
+        Yield the features of the served version one by one, encoded,
+        without reading the whole file.
+        """
+        # Written at save time with one feature per line, see `spatial`.
+        seq_name = self._name() + SEQ_EXT
+        if self.storage.exists(seq_name):
+            with self.storage.open(seq_name, 'rb') as f:
+                for line in f:
+                    yield line.rstrip(b'\n')
+            return
+        with self.storage.open(self._name(), 'rb') as f:
+            chunks = iter(lambda: f.read(geojsonseq.CHUNK_SIZE), b'')
+            for feature in geojsonseq.iter_features(chunks):
+                yield feature
+
+    def sequence_response(self, etag=None, features=None):
+        format = self.sequence_format()
+        if etag is None:
+            etag = self.etag(self._name())
+        # Distinct representation, with its own ETag.
+        etag = quote_etag('{}-{}'.format(etag.strip('"'), format))
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            if features is None:
+                features = self.iter_features()
+            response = StreamingHttpResponse(
+                geojsonseq.dump_sequence(features, format),
+                content_type=geojsonseq.FORMATS[format])
+        response['ETag'] = etag
+        return response
+
+    def from_features_table(self):
+        """
+        Whether to serve the full resolution GeoJSON from the features
+        table (see Feature) instead of the file.
+        """
+        return (self.object.uses_features_table() and
+                self.variant_name() == self._name())
 
-        if getattr(settings, 'LEAFLET_STORAGE_XSENDFILE_HEADER', None):
-            response = HttpResponse()
-            path = path.replace(settings.MEDIA_ROOT, '/internal')
-            response[settings.LEAFLET_STORAGE_XSENDFILE_HEADER] = path
+    def features_table_response(self):
+        """
+        Stream the FeatureCollection from the database, as it is read, and
+        compressed on the fly if the client accepts it.
+        """
+        mtime = stored_mtime(self.storage, self._name())
+        encodings = self.accepted_encodings()
+        encoding = encodings[0] if encodings else None
+        # Serialized by the database, so not the same bytes as the file:
+        # distinct representation, with its own ETag.
+        etag = quote_etag('{}-db{}'.format(
+            self.etag(self._name(), mtime).strip('"'),
+            '-' + encoding if encoding else ''))
+        response = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=int(mtime)
+        )
+        if response is None:
+            content = self.object.iter_features_json()
+            if encoding:
+                content = compress_iterator(content, encoding)
+            response = StreamingHttpResponse(content,
+                                             content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response["Last-Modified"] = http_date(mtime)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+    def is_range_fresh(self, etag, mtime):
+        """
+        Only honour Range if If-Range, when given, matches the current
+        representation.
+        """
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        return if_range == http_date(mtime)
+
+    def file_response(self, name, mtime, etag):
+        size = self.storage.size(name)
+        byte_range = None
+        if self.is_range_fresh(etag, mtime):
+            try:
+                byte_range = parse_range(
+                    self.request.META.get('HTTP_RANGE'), size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{}'.format(size)
+                return response
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                range_iterator(self.storage.open(name, 'rb'), start,
+                               end - start + 1),
+                status=206,
+                content_type=self.content_type
+            )
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, size)
+            response['Content-Length'] = end - start + 1
         else:
-            # TODO IMS
-            statobj = os.stat(path)
-            with open(path, 'rb') as f:
-                response = HttpResponse(
-                    f.read(),  # should not be used in production!
-                    content_type='application/json'
-                )
-            response["Last-Modified"] = http_date(statobj.st_mtime)
-            response['ETag'] = '%s' % hashlib.md5(force_bytes(response.content)).hexdigest()  # noqa
-            response['Content-Length'] = len(response.content)
-        if path.endswith(self.EXT):
-            response['Content-Encoding'] = 'gzip'
+            # Stream the file by chunks, so memory does not grow with the
+            # layer size; WSGI servers providing wsgi.file_wrapper will
+            # use sendfile under the hood for local files.
+            response = FileResponse(self.storage.open(name, 'rb'),
+                                    content_type=self.content_type)
+            response['Content-Length'] = size
+        response['Accept-Ranges'] = 'bytes'
         return response
 
 
 class DataLayerVersion(DataLayerView):
 
-    def _path(self):
-        return '{root}/{path}'.format(
-            root=settings.MEDIA_ROOT,
-            path=self.object.get_version_path(self.kwargs['name']))
+    def content_hash(self):
+        # Stored hash is the one of the current version only.
+        return None
+
+    def from_features_table(self):
+        # Features table only holds the current version.
+        return False
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.storage.exists(self._name()):
+            return super(DataLayerVersion, self).render_to_response(
+                context, **response_kwargs)
+        # Stored as a delta, see DataLayer.compact_versions.
+        if not self.storage.exists(self._name() + DELTA_EXT):
+            raise Http404('No such version.')
+        # Versions never change, so the ETag only depends on the name, and
+        # the version is only rebuilt when needed.
+        etag = quote_etag(hashlib.md5(
+            force_bytes(self.kwargs['name'])).hexdigest())
+        if self.sequence_format():
+            return self.sequence_response(etag, self.iter_delta_features())
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            content = self.object.get_version_content(self.kwargs['name'])
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def iter_delta_features(self):
+        # Only rebuilt once the response is consumed, so not for a 304.
+        content = self.object.get_version_content(self.kwargs['name'])
+        for feature in geojsonseq.iter_features([content]):
+            yield feature
+
+    def _name(self):
+        return self.object.get_version_path(self.kwargs['name'])
+
+
+class DataLayerFlatGeobuf(DataLayerView):
+    """
+    Serve the FlatGeobuf variant (see `fgb`), which clients query by byte
+    ranges: header and index first, then the features of their viewport.
+    """
+    content_type = FGB_CONTENT_TYPE
+
+    def variant_name(self):
+        name = self._name() + FGB_EXT
+        if not self.storage.exists(name):
+            raise Http404('No FlatGeobuf for this layer.')
+        return name
 
+    def accepted_encodings(self):
+        # Byte ranges must be the ones of the uncompressed file.
+        return []
+
+    def sequence_format(self):
+        return None
+
+    def from_features_table(self):
+        return False
+
+
+class DataLayerBBox(BaseDetailView):
+    """
+    Only the features intersecting the `bbox=west,south,east,north` param.
+    """
+    model = DataLayer
 
-class DataLayerCreate(FormLessEditMixin, GZipMixin, CreateView):
+    def get_bbox(self):
+        try:
+            bbox = [float(v) for v in self.request.GET.get('bbox').split(',')]
+        except (AttributeError, ValueError):
+            return None
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return None
+        return bbox
+
+    def render_to_response(self, context, **response_kwargs):
+        bbox = self.get_bbox()
+        if not bbox:
+            return HttpResponseBadRequest(
+                'bbox param must be "west,south,east,north".')
+        if not (self.object.uses_features_table() or self.object.is_local()):
+            # Index is only built for local files, see build_derived.
+            return HttpResponse('bbox queries are not available for this '
+                                'layer storage.', status=501)
+        # URL contains the bbox, so content hash identifies the response.
+        etag = None
+        if self.object.content_hash:
+            etag = quote_etag(self.object.content_hash)
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = HttpResponse(self.object.query_bbox(bbox),
+                                    content_type='application/json')
+        if etag:
+            response['ETag'] = etag
+        return response
+
+
+class DataLayerTile(BaseDetailView):
+    """
+    Mapbox Vector Tile of the datalayer features.
+    """
+    model = DataLayer
+
+    def render_to_response(self, context, **response_kwargs):
+        z, x, y = [int(self.kwargs[k]) for k in ('z', 'x', 'y')]
+        max_zoom = getattr(settings, 'LEAFLET_STORAGE_TILES_MAX_ZOOM', 18)
+        if z > max_zoom or x >= 2 ** z or y >= 2 ** z:
+            raise Http404('Tile out of range.')
+        if not self.object.geojson:
+            return HttpResponse(status=204)  # No data, so no features.
+        if not self.object.is_local():
+            # Tiles are rendered from the index, see DataLayerBBox.
+            return HttpResponse('Tiles are not available for this layer '
+                                'storage.', status=501)
+        etag = None
+        if self.object.content_hash:
+            etag = quote_etag(self.object.content_hash)
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            path = self.object.get_tile(z, x, y)
+            response = FileResponse(
+                open(path, 'rb'),
+                content_type='application/vnd.mapbox-vector-tile')
+            response['Content-Length'] = os.path.getsize(path)
+            etag = quote_etag(self.object.content_hash)
+        response['ETag'] = etag
+        return response
+
+
+class DataLayerCreate(FormLessEditMixin, CompressedMixin, CreateView):
     model = DataLayer
     form_class = DataLayerForm
 
@@ -488,7 +978,7 @@ class DataLayerCreate(FormLessEditMixin, GZipMixin, CreateView):
         return response
 
 
-class DataLayerUpdate(FormLessEditMixin, GZipMixin, UpdateView):
+class DataLayerUpdate(FormLessEditMixin, CompressedMixin, UpdateView):
     model = DataLayer
     form_class = DataLayerForm
 
@@ -503,8 +993,8 @@ class DataLayerUpdate(FormLessEditMixin, GZipMixin, UpdateView):
         match = True
         if_match = self.request.META.get('HTTP_IF_MATCH')
         if if_match:
-            etag = self.etag()
-            if etag != if_match:
+            etags = self.etags() or [self.etag()]
+            if if_match not in etags:
                 match = False
         return match
 
@@ -514,9 +1004,43 @@ class DataLayerUpdate(FormLessEditMixin, GZipMixin, UpdateView):
             return HttpResponseForbidden('Route to nowhere')
         if not self.if_match():
             return HttpResponse(status=412)
+        return self.update(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
         return super(DataLayerUpdate, self).post(request, *args, **kwargs)
 
 
+class DataLayerPatch(DataLayerUpdate):
+    """
+    Apply a list of feature operations (see `patch`), given as JSON body, to
+    the current version and save the result as a new version, so the
+    client only has to send what changed. The whole document is rewritten,
+    as each version is a full file, and is subject to the upload size limit.
+    """
+
+    def update(self, request, *args, **kwargs):
+        data = self.object.read_data()
+        if data is None:
+            return simple_json_response(error=_('Invalid datalayer data.'))
+        try:
+            operations = json.loads(request.body.decode('utf-8'))
+            apply_operations(data, operations)
+        except ValueError as e:
+            return simple_json_response(error=str(e))
+        content = json.dumps(data).encode('utf-8')
+        try:
+            check_datalayer_size(len(content))
+        except ValidationError as e:
+            errors = FlatErrorList(e.messages)
+            return simple_json_response(errors={'geojson': errors},
+                                        error=errors.flat())
+        self.object.geojson = ContentFile(content, name='patch.geojson')
+        self.object.save()
+        response = simple_json_response(**self.object.metadata)
+        response['ETag'] = self.etag()
+        return response
+
+
 class DataLayerDelete(DeleteView):
     model = DataLayer
 
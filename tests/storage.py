@@ -0,0 +1,51 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+
+class MemoryStorage(Storage):
+    """
+    Keep files in memory, without filesystem paths, as object storages do.
+    """
+
+    def __init__(self):
+        self.files = {}  # name: (content, modified time)
+
+    def _open(self, name, mode='rb'):
+        if name not in self.files:
+            raise IOError('No such file: {}'.format(name))
+        return ContentFile(self.files[name][0], name=name)
+
+    def _save(self, name, content):
+        self.files[name] = (b''.join(force_bytes(chunk)
+                                     for chunk in content.chunks()),
+                            timezone.now())
+        return name
+
+    def exists(self, name):
+        return name in self.files
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+    def size(self, name):
+        return len(self.files[name][0])
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/'
+        directories, files = set(), []
+        for name in self.files:
+            if name.startswith(prefix):
+                rest = name[len(prefix):]
+                if '/' in rest:
+                    directories.add(rest.split('/')[0])
+                else:
+                    files.append(rest)
+        return sorted(directories), sorted(files)
+
+    def url(self, name):
+        return 'https://storage.example.org/{}?signature=abc'.format(name)
+
+    def get_modified_time(self, name):
+        return self.files[name][1]
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+
+from leaflet_storage.models import Blob, DataLayer, Job, blob_name
+
+from .base import DataLayerFactory, MapFactory
+
+pytestmark = pytest.mark.django_db
+
+CONTENT = b'{"type": "FeatureCollection", "features": []}'
+
+
+@pytest.fixture
+def content_addressed(settings):
+    settings.LEAFLET_STORAGE_CONTENT_ADDRESSED = True
+
+
+def test_save_should_store_content_once(map, content_addressed):
+    first = DataLayerFactory(map=map, geojson__data=CONTENT)
+    second = DataLayerFactory(map=map, geojson__data=CONTENT)
+    assert first.geojson.name == second.geojson.name
+    assert first.geojson.name == blob_name(first.content_hash)
+    assert first.is_blob()
+    assert Blob.objects.get(name=first.geojson.name).refs == 2
+    assert os.path.exists(first.geojson.path + '.gz')
+    # Versions keep their usual names.
+    name = first.get_versions()[0]
+    assert name.startswith('%s_' % first.pk)
+    assert first.get_version_content(name) == CONTENT
+
+
+def test_clone_should_share_blob(map, content_addressed):
+    datalayer = DataLayerFactory(map=map, geojson__data=CONTENT)
+    clone = datalayer.clone(map_inst=MapFactory(owner=map.owner))
+    assert clone.geojson.name == datalayer.geojson.name
+    assert Blob.objects.get(name=datalayer.geojson.name).refs == 2
+    assert len(clone.get_versions()) == 1
+
+
+def test_blob_should_be_deleted_when_no_more_referenced(map, content_addressed):  # noqa
+    first = DataLayerFactory(map=map, geojson__data=CONTENT)
+    second = first.clone()
+    path = first.geojson.path
+    first.delete()
+    assert os.path.exists(path)
+    second.delete()
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.gz')
+    assert not Blob.objects.exists()
+
+
+def test_blob_acquired_again_should_not_be_deleted(map, content_addressed,
+                                                   settings):
+    settings.LEAFLET_STORAGE_ASYNC_JOBS = True
+    datalayer = DataLayerFactory(map=map, geojson__data=CONTENT)
+    path = datalayer.geojson.path
+    datalayer.delete()
+    assert Blob.objects.get(name=datalayer.geojson.name).refs == 0
+    other = DataLayerFactory(map=map, geojson__data=CONTENT)
+    Job.run_pending()
+    assert other.geojson.path == path
+    assert os.path.exists(path)
+    assert Blob.objects.get(name=other.geojson.name).refs == 1
+
+
+def test_purge_should_release_old_blobs(map, content_addressed, settings):
+    settings.LEAFLET_STORAGE_KEEP_VERSIONS = 1
+    datalayer = DataLayerFactory(map=map, geojson__data=CONTENT)
+    old_path = datalayer.geojson.path
+    datalayer.geojson = ContentFile(CONTENT.replace(b'[]', b'[ ]'), 'x')
+    datalayer.save()
+    assert datalayer.geojson.path != old_path
+    assert not os.path.exists(old_path)
+    assert list(Blob.objects.values_list('refs', flat=True)) == [1]
+
+
+def test_map_delete_should_release_blobs(map, content_addressed):
+    datalayer = DataLayerFactory(map=map, geojson__data=CONTENT)
+    path = datalayer.geojson.path
+    map.delete()
+    assert not os.path.exists(path)
+    assert not DataLayer.objects.exists()
@@ -0,0 +1,122 @@
+import gzip
+import io
+import json
+import os
+
+import pytest
+from django.core.urlresolvers import reverse
+
+from leaflet_storage.bundle import read_bundle, write_frame
+from leaflet_storage.models import DataLayer, Map
+
+from .base import DataLayerFactory
+
+pytestmark = pytest.mark.django_db
+
+
+def test_write_frame_should_keep_content_as_is():
+    f = io.BytesIO()
+    write_frame(f, 1, io.BytesIO(b'{"type": "FeatureCollection",\n'
+                                 b' "features": []}'))
+    write_frame(f, 2, io.BytesIO(b'{"features": [1]}'))
+    assert read_bundle(f.getvalue()) == [
+        (1, {"type": "FeatureCollection", "features": []}),
+        (2, {"features": [1]}),
+    ]
+
+
+def bundle_content(map):
+    storage = DataLayer._meta.get_field('geojson').storage
+    with storage.open(map.get_bundle(), 'rb') as f:
+        return read_bundle(f.read())
+
+
+def test_bundle_should_contain_layers_displayed_on_load(map, datalayer):
+    DataLayerFactory(map=map, name='hidden', display_on_load=False)
+    other = DataLayerFactory(map=map, name='other', rank=2)
+    layers = bundle_content(map)
+    assert [pk for pk, data in layers] == [datalayer.pk, other.pk]
+    with open(datalayer.geojson.path) as f:
+        assert layers[0][1] == json.load(f)
+
+
+def test_bundle_should_be_rebuilt_when_a_layer_changes(map, datalayer):
+    name = map.get_bundle()
+    path = datalayer.geojson.storage.path(name)
+    datalayer.display_on_load = False
+    datalayer.save()
+    # Previous one is kept, it may be being served.
+    assert os.path.exists(path)
+    assert bundle_content(map) == []
+    other = DataLayerFactory(map=map, name='other')
+    assert [pk for pk, data in bundle_content(map)] == [other.pk]
+    assert not os.path.exists(path)
+    other.delete()
+    assert bundle_content(map) == []
+
+
+def test_bundle_should_not_be_rebuilt_when_unchanged(map, datalayer):
+    path = datalayer.geojson.storage.path(map.get_bundle())
+    mtime = os.path.getmtime(path)
+    datalayer.name = 'renamed'
+    datalayer.save()
+    assert map.build_bundle() == map.get_bundle()
+    assert os.path.getmtime(path) == mtime
+
+
+def test_purge_should_skip_bundles_being_written(map, datalayer):
+    name = map.get_bundle()
+    tmp_path = datalayer.geojson.storage.path(name) + '.0123.tmp'
+    with open(tmp_path, 'wb'):
+        pass
+    datalayer.display_on_load = False
+    datalayer.save()
+    map.get_bundle()
+    DataLayerFactory(map=map, name='other')
+    map.get_bundle()
+    assert os.path.exists(tmp_path)
+
+
+def test_save_should_not_build_bundle_by_default(map, datalayer):
+    path = datalayer.geojson.storage.path(map.get_bundle())
+    DataLayerFactory(map=map, name='other')
+    name = map.get_bundle_name()
+    assert not datalayer.geojson.storage.exists(name)
+    # Still there until the new one is built.
+    assert os.path.exists(path)
+    assert map.get_bundle() == name
+    assert datalayer.geojson.storage.exists(name)
+
+
+def test_bundle_view_should_rebuild_missing_bundle(client, map, datalayer,
+                                                   monkeypatch):
+    url = reverse('map_datalayers_bundle', args=(map.pk, ))
+    name = map.get_bundle()
+    storage = DataLayer._meta.get_field('geojson').storage
+    # As if deleted by a concurrent build once negotiated.
+    monkeypatch.setattr(Map, 'get_bundle', lambda self: name)
+    os.remove(storage.path(name))
+    response = client.get(url)
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content)
+    assert [pk for pk, data in read_bundle(content)] == [datalayer.pk]
+
+
+def test_bundle_view(client, map, datalayer):
+    url = reverse('map_datalayers_bundle', args=(map.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/json-seq'
+    assert response['Content-Encoding'] == 'gzip'
+    content = gzip.decompress(b''.join(response.streaming_content))
+    assert [pk for pk, data in read_bundle(content)] == [datalayer.pk]
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                          HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_bundle_view_should_check_map_permissions(client, map, datalayer):
+    map.share_status = Map.PRIVATE
+    map.save()
+    url = reverse('map_datalayers_bundle', args=(map.pk, ))
+    assert client.get(url).status_code == 403
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from leaflet_storage import cache
+
+from .base import DataLayerFactory, LicenceFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def enable_cache(settings):
+    # Tests run in a single process, so the local-memory cache is shared.
+    settings.LEAFLET_STORAGE_MAP_SETTINGS_CACHE_TIMEOUT = 60 * 60
+
+
+def get_settings(client, map):
+    response = client.get(reverse('map_geojson', args=(map.pk, )))
+    return json.loads(response.content.decode())['properties']
+
+
+def test_map_settings_should_be_cached(client, map, datalayer):
+    counters = cache.get_counters()
+    get_settings(client, map)
+    with CaptureQueriesContext(connection) as hit:
+        get_settings(client, map)
+    cache.bump(map.pk)
+    with CaptureQueriesContext(connection) as missed:
+        get_settings(client, map)
+    assert len(hit) < len(missed)
+    after = cache.get_counters()
+    assert after['hits'] == counters['hits'] + 1
+    assert after['misses'] == counters['misses'] + 2
+
+
+def test_saving_a_datalayer_should_invalidate(client, map, datalayer):
+    assert len(get_settings(client, map)['datalayers']) == 1
+    DataLayerFactory(map=map, name='other')
+    assert len(get_settings(client, map)['datalayers']) == 2
+    datalayer.delete()
+    assert len(get_settings(client, map)['datalayers']) == 1
+
+
+def test_saving_a_map_should_invalidate(client, map):
+    get_settings(client, map)
+    map.settings['properties'] = {'name': 'changed'}
+    map.save()
+    assert get_settings(client, map)['name'] == 'changed'
+
+
+def test_saving_a_licence_should_invalidate(client, map):
+    get_settings(client, map)
+    LicenceFactory(name='new licence')
+    assert 'new licence' in get_settings(client, map)['licences']
+
+
+def test_cache_should_depend_on_permissions(client, map):
+    assert get_settings(client, map)['allowEdit'] is False
+    client.login(username=map.owner.username, password="123123")
+    assert get_settings(client, map)['allowEdit'] is True
+
+
+def test_cache_should_be_disabled_by_default(client, map, settings):
+    del settings.LEAFLET_STORAGE_MAP_SETTINGS_CACHE_TIMEOUT
+    counters = cache.get_counters()
+    get_settings(client, map)
+    get_settings(client, map)
+    assert cache.get_counters() == counters
+
+
+def test_cache_can_be_disabled(client, map, settings):
+    settings.LEAFLET_STORAGE_MAP_SETTINGS_CACHE_TIMEOUT = 0
+    counters = cache.get_counters()
+    get_settings(client, map)
+    get_settings(client, map)
+    assert cache.get_counters() == counters
+
+
+def test_json_settings_should_keep_urls(client, map, settings, tmpdir):
+    settings.STATIC_ROOT = str(tmpdir)
+    settings.STATIC_URL = '/static/'
+    settings.LEAFLET_STORAGE_URLS_JS = True
+    response = client.get(reverse('map', args=(map.slug, map.pk)))
+    assert '"urls"' not in response.context['map_settings']
+    assert 'urls' in get_settings(client, map)
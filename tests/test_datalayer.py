@@ -1,7 +1,15 @@
+import gzip
+import hashlib
+import json
 import os
+import time
 
 import pytest
 from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from leaflet_storage.models import DataLayer
 
 from .base import DataLayerFactory, MapFactory
 
@@ -68,14 +76,244 @@ def test_should_remove_old_versions_on_save(datalayer, map, settings):
     for path in [medium, newer, older]:
         datalayer.geojson.storage.save(path, ContentFile("{}"))
         datalayer.geojson.storage.save(path + '.gz', ContentFile("{}"))
-    assert len(datalayer.geojson.storage.listdir(root)[1]) == 6 + before
+        datalayer.geojson.storage.save(path + '.br', ContentFile("{}"))
+    assert len(datalayer.geojson.storage.listdir(root)[1]) == 9 + before
+    datalayer.index_versions()
     datalayer.save()
-    files = datalayer.geojson.storage.listdir(root)[1]
-    assert len(files) == 5
+    files = [name for name in datalayer.geojson.storage.listdir(root)[1]
+             if not name.startswith(os.path.basename(datalayer.geojson.name))]
+    assert len(files) == 6
     assert os.path.basename(newer) in files
     assert os.path.basename(newer + '.gz') in files
     assert os.path.basename(medium) in files
     assert os.path.basename(medium + '.gz') in files
-    assert os.path.basename(datalayer.geojson.path) in files
+    assert os.path.basename(newer + '.br') in files
     assert os.path.basename(older) not in files
     assert os.path.basename(older + '.gz') not in files
+    assert os.path.basename(older + '.br') not in files
+    assert os.path.exists(datalayer.geojson.path)
+    assert os.path.exists(datalayer.geojson.path + '.gz')
+
+
+def test_save_should_store_content_hash(datalayer):
+    with open(datalayer.geojson.path, 'rb') as f:
+        expected = hashlib.md5(f.read()).hexdigest()
+    assert datalayer.content_hash == expected
+
+
+def test_update_content_hash_should_compute_hash_from_file(datalayer):
+    expected = datalayer.content_hash
+    DataLayer.objects.filter(pk=datalayer.pk).update(content_hash='')
+    datalayer = DataLayer.objects.get(pk=datalayer.pk)
+    datalayer.update_content_hash()
+    assert DataLayer.objects.get(pk=datalayer.pk).content_hash == expected
+
+
+def test_save_should_precompress_file(datalayer):
+    path = datalayer.geojson.path + '.gz'
+    assert os.path.exists(path)
+    with gzip.open(path, 'rb') as f:
+        with open(datalayer.geojson.path, 'rb') as original:
+            assert f.read() == original.read()
+    root = os.path.dirname(path)
+    assert not [n for n in os.listdir(root) if n.endswith('.tmp')]
+
+
+def test_save_should_purge_cached_tiles(datalayer):
+    path = datalayer.get_tile(0, 0, 0)
+    assert os.path.exists(path)
+    datalayer.geojson = ContentFile('{"type": "FeatureCollection", '
+                                    '"features": []}', 'new.geojson')
+    datalayer.save()
+    assert not os.path.exists(path)
+    assert os.path.exists(datalayer.get_tile(0, 0, 0))
+
+
+def test_save_should_build_simplified_variants(map, settings):
+    settings.LEAFLET_STORAGE_SIMPLIFY_ZOOMS = [4, 18]
+    line = [[i / 100.0, 0.0001 * (i % 2)] for i in range(100)]
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature', 'properties': {},
+        'geometry': {'type': 'LineString', 'coordinates': line}}]})
+    datalayer = DataLayerFactory(map=map, geojson__data=geojson)
+    path = datalayer.derived_path(DataLayer.simplified_ext(4))
+    with open(path) as f:
+        data = json.load(f)
+    assert data['features'][0]['geometry']['coordinates'] == [line[0],
+                                                              line[-1]]
+    assert os.path.exists(path + '.gz')
+    # Nothing to remove at this zoom: no variant.
+    assert not os.path.exists(
+        datalayer.derived_path(DataLayer.simplified_ext(18)))
+
+
+def test_topojson_quantization_should_follow_map_settings(map, settings):
+    settings.LEAFLET_STORAGE_TOPOJSON_QUANTIZATION = 1000
+    datalayer = DataLayerFactory(map=map)
+    assert datalayer.get_quantization() == 1000
+    map.settings = {'properties': {'quantization': 50}}
+    map.save()
+    datalayer.map = map
+    assert datalayer.get_quantization() == 50
+    map.settings = {'properties': {'quantization': 'invalid'}}
+    assert datalayer.get_quantization() == 1000
+
+
+def save_versions(datalayer, count):
+    contents = []
+    for i in range(count):
+        content = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'name': str(j)},
+             'geometry': {'type': 'Point', 'coordinates': [j, i]}}
+            for j in range(5)]}).encode()
+        time.sleep(0.002)  # Versions are named by millisecond.
+        datalayer.geojson = ContentFile(content, 'version.geojson')
+        datalayer.save()
+        contents.append(content)
+    return contents
+
+
+def test_save_should_store_previous_versions_as_deltas(datalayer):
+    contents = save_versions(datalayer, 3)
+    root = datalayer.storage_root()
+    names = datalayer.get_versions()
+    assert len(names) == 4
+    storage = datalayer.geojson.storage
+    assert storage.exists('%s/%s' % (root, names[0]))
+    for name in names[1:]:
+        assert not storage.exists('%s/%s' % (root, name))
+        assert not storage.exists('%s/%s.gz' % (root, name))
+        assert storage.exists('%s/%s.delta' % (root, name))
+    for name, content in zip(names, reversed(contents)):
+        assert datalayer.get_version_content(name) == content
+    assert datalayer.versions[1]['size'] == len(contents[1])
+
+
+def test_save_without_new_content_should_not_compact(datalayer):
+    save_versions(datalayer, 1)
+    root = datalayer.storage_root()
+    previous = '%s/%s' % (root, datalayer.get_versions()[1])
+    datalayer.geojson.storage.save(previous, ContentFile(b'{}'))
+    datalayer.name = 'renamed'
+    datalayer.save()
+    assert datalayer.geojson.storage.exists(previous)
+
+
+def test_save_should_keep_full_versions_if_deltas_are_disabled(datalayer, settings):  # noqa
+    settings.LEAFLET_STORAGE_VERSION_DELTAS = False
+    save_versions(datalayer, 2)
+    root = datalayer.storage_root()
+    for name in datalayer.get_versions():
+        assert datalayer.geojson.storage.exists('%s/%s' % (root, name))
+
+
+def test_compact_should_replace_existing_delta(datalayer, settings):
+    settings.LEAFLET_STORAGE_VERSION_DELTAS = False
+    with open(datalayer.geojson.path, 'rb') as f:
+        content = f.read()
+    save_versions(datalayer, 1)
+    name = datalayer.get_versions()[1]
+    root = datalayer.storage_root()
+    storage = datalayer.geojson.storage
+    # As left by an interrupted compaction.
+    storage.save('%s/%s.delta' % (root, name), ContentFile(b'stale'))
+    settings.LEAFLET_STORAGE_VERSION_DELTAS = True
+    datalayer.compact_versions()
+    assert [f for f in storage.listdir(root)[1]
+            if f.startswith(name)] == [name + '.delta']
+    assert datalayer.get_version_content(name) == content
+
+
+def test_purge_should_remove_old_deltas(datalayer, settings):
+    settings.LEAFLET_STORAGE_KEEP_VERSIONS = 2
+    save_versions(datalayer, 3)
+    names = datalayer.get_versions()
+    assert len(names) == 2
+    root = datalayer.storage_root()
+    files = datalayer.geojson.storage.listdir(root)[1]
+    assert len([f for f in files if f.endswith('.delta')]) == 1
+
+
+def test_purge_should_remove_variants_of_removed_zooms(map, settings):
+    settings.LEAFLET_STORAGE_SIMPLIFY_ZOOMS = [4]
+    line = [[i / 100.0, 0.0001 * (i % 2)] for i in range(100)]
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature', 'properties': {},
+        'geometry': {'type': 'LineString', 'coordinates': line}}]})
+    datalayer = DataLayerFactory(map=map, geojson__data=geojson)
+    path = datalayer.derived_path(DataLayer.simplified_ext(4))
+    assert os.path.exists(path + '.gz')
+    settings.LEAFLET_STORAGE_SIMPLIFY_ZOOMS = []
+    settings.LEAFLET_STORAGE_KEEP_VERSIONS = 1
+    save_versions(datalayer, 1)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.gz')
+
+
+def test_save_should_index_versions(datalayer):
+    assert datalayer.get_versions() == [
+        os.path.basename(datalayer.geojson.name)]
+    save_versions(datalayer, 2)
+    versions = datalayer.versions
+    assert len(versions) == 3
+    assert versions[0]['name'] == os.path.basename(datalayer.geojson.name)
+    assert versions[0]['size'] == datalayer.geojson.size
+    entry = datalayer.version_entries.first()
+    assert entry.content_hash == datalayer.content_hash
+
+
+def test_versions_should_not_hit_storage(datalayer, monkeypatch):
+    monkeypatch.setattr(datalayer.geojson.storage, 'listdir', None)
+    monkeypatch.setattr(datalayer.geojson.storage, 'size', None)
+    with CaptureQueriesContext(connection) as context:
+        assert len(datalayer.versions) == 1
+    assert len(context.captured_queries) == 1
+
+
+def test_index_versions_should_backfill_from_storage(datalayer):
+    save_versions(datalayer, 2)
+    expected = datalayer.versions
+    hashes = list(datalayer.version_entries.values_list('content_hash',
+                                                        flat=True))
+    datalayer.version_entries.all().delete()
+    # Listed from the storage until indexed.
+    assert datalayer.versions == expected
+    assert len(datalayer.get_versions()) == 3
+    assert datalayer.index_versions() == 3
+    assert datalayer.versions == expected
+    assert list(datalayer.version_entries.values_list(
+        'content_hash', flat=True)) == hashes
+    assert datalayer.index_versions() == 0
+
+
+def test_first_indexed_save_should_index_previous_versions(datalayer):
+    with open(datalayer.geojson.path, 'rb') as f:
+        content = f.read()
+    save_versions(datalayer, 1)
+    expected = datalayer.get_versions()
+    # As saved before the index existed.
+    datalayer.version_entries.all().delete()
+    save_versions(datalayer, 1)
+    names = datalayer.get_versions()
+    assert names[1:] == expected
+    assert datalayer.versions[2]['size'] == len(content)
+    assert datalayer.get_version_content(names[2]) == content
+
+
+def test_save_should_store_stats(datalayer):
+    stats = DataLayer.objects.get(pk=datalayer.pk).stats
+    assert stats == {
+        'bbox': [13.68896484375, 48.55297816440071,
+                 13.68896484375, 48.55297816440071],
+        'featureCount': 1,
+        'geometryTypes': {'Point': 1},
+        'properties': {'name': 'string', 'description': 'string'},
+        'size': os.path.getsize(datalayer.geojson.path),
+    }
+    assert datalayer.metadata['stats'] == stats
+    datalayer.geojson = ContentFile(
+        b'{"type": "FeatureCollection", "features": []}', 'x')
+    datalayer.save()
+    stats = DataLayer.objects.get(pk=datalayer.pk).stats
+    assert stats['featureCount'] == 0
+    assert stats['bbox'] is None
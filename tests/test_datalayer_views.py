@@ -1,12 +1,15 @@
 import json
+import os
 
 import pytest
 from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 
+from leaflet_storage import spatial
 from leaflet_storage.models import DataLayer, Map
 
-from .base import MapFactory
+from .base import DataLayerFactory, MapFactory
 
 pytestmark = pytest.mark.django_db
 
@@ -29,7 +32,7 @@ def test_get(client, settings, datalayer):
     assert response['Last-Modified'] is not None
     assert response['Cache-Control'] is not None
     assert 'Content-Encoding' not in response
-    j = json.loads(response.content.decode())
+    j = json.loads(b''.join(response.streaming_content).decode())
     assert '_storage' in j
     assert 'features' in j
     assert j['type'] == 'FeatureCollection'
@@ -97,6 +100,174 @@ def test_get_gzipped(client, datalayer, settings):
     assert response['Content-Encoding'] == 'gzip'
 
 
+def test_get_should_vary_on_accept_encoding(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert 'Accept-Encoding' in response['Vary']
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                          HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 304
+    assert 'Accept-Encoding' in response['Vary']
+
+
+def test_get_brotli(client, datalayer):
+    brotli = pytest.importorskip('brotli')
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+    assert response['Content-Encoding'] == 'br'
+    assert response['ETag'] == '"%s-br"' % datalayer.content_hash
+    content = brotli.decompress(b''.join(response.streaming_content))
+    assert json.loads(content.decode())['type'] == 'FeatureCollection'
+
+
+def test_get_zstd(client, datalayer):
+    zstandard = pytest.importorskip('zstandard')
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0.5, zstd')
+    assert response['Content-Encoding'] == 'zstd'
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    content = decompressor.decompress(b''.join(response.streaming_content))
+    assert json.loads(content.decode())['type'] == 'FeatureCollection'
+
+
+def test_get_should_respect_encodings_setting(client, datalayer, settings):
+    settings.LEAFLET_STORAGE_ENCODINGS = ['gzip']
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='br, gzip')
+    assert response['Content-Encoding'] == 'gzip'
+
+
+def test_get_gzipped_should_fallback_to_identity_if_not_compressed(client, datalayer):  # noqa
+    os.remove(datalayer.geojson.path + '.gz')
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response
+    # Read path should never compress.
+    assert not os.path.exists(datalayer.geojson.path + '.gz')
+
+
+def test_get_range(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    full = b''.join(client.get(url).streaming_content)
+    response = client.get(url, HTTP_RANGE='bytes=10-19')
+    assert response.status_code == 206
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Content-Range'] == 'bytes 10-19/%s' % len(full)
+    assert response['Content-Length'] == '10'
+    assert b''.join(response.streaming_content) == full[10:20]
+    response = client.get(url, HTTP_RANGE='bytes=-5')
+    assert b''.join(response.streaming_content) == full[-5:]
+
+
+def test_get_range_on_compressed_variant(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_RANGE='bytes=0-1',
+                          HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 206
+    assert response['Content-Encoding'] == 'gzip'
+    assert b''.join(response.streaming_content) == b'\x1f\x8b'
+
+
+def test_get_range_not_satisfiable(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    size = datalayer.geojson.size
+    response = client.get(url, HTTP_RANGE='bytes=%s-' % size)
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */%s' % size
+    gz_size = os.path.getsize(datalayer.geojson.path + '.gz')
+    response = client.get(url, HTTP_RANGE='bytes=%s-' % gz_size,
+                          HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 416
+    assert 'Content-Encoding' not in response
+
+
+def test_get_range_should_be_ignored_if_if_range_does_not_match(client, datalayer):  # noqa
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"xxx"')
+    assert response.status_code == 200
+    etag = response['ETag']
+    response = client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+    assert response.status_code == 206
+
+
+def test_bbox_should_return_only_intersecting_features(client, datalayer):
+    url = reverse('datalayer_bbox', args=(datalayer.pk, ))
+    response = client.get(url, {'bbox': '13,48,14,49'})
+    assert response.status_code == 200
+    assert response['ETag'] == '"%s"' % datalayer.content_hash
+    j = json.loads(response.content.decode())
+    assert j['type'] == 'FeatureCollection'
+    assert '_storage' in j
+    assert len(j['features']) == 1
+    response = client.get(url, {'bbox': '0,0,1,1'})
+    assert json.loads(response.content.decode())['features'] == []
+
+
+def test_bbox_should_build_missing_index(client, datalayer):
+    os.remove(datalayer.geojson.path + '.idx')
+    url = reverse('datalayer_bbox', args=(datalayer.pk, ))
+    response = client.get(url, {'bbox': '13,48,14,49'})
+    assert len(json.loads(response.content.decode())['features']) == 1
+    assert os.path.exists(datalayer.geojson.path + '.idx')
+
+
+def test_bbox_should_validate_bbox(client, datalayer):
+    url = reverse('datalayer_bbox', args=(datalayer.pk, ))
+    assert client.get(url).status_code == 400
+    assert client.get(url, {'bbox': '1,2,3'}).status_code == 400
+    assert client.get(url, {'bbox': 'a,b,c,d'}).status_code == 400
+    assert client.get(url, {'bbox': '3,0,1,1'}).status_code == 400
+
+
+def test_tile_should_return_vector_tile(client, datalayer):
+    url = reverse('datalayer_tile', args=(datalayer.pk, 7, 68, 44))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/vnd.mapbox-vector-tile'
+    assert response['ETag'] == '"%s"' % datalayer.content_hash
+    content = b''.join(response.streaming_content)
+    assert b'Da place anonymous again' in content
+    # Cached, keyed by content hash.
+    name = '%s/%s/7/68/44.pbf' % (datalayer.tiles_root(),
+                                  datalayer.content_hash)
+    assert datalayer.geojson.storage.exists(name)
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_tile_should_be_empty_outside_features(client, datalayer):
+    url = reverse('datalayer_tile', args=(datalayer.pk, 7, 0, 0))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b''
+
+
+def test_tile_of_layer_without_data_should_be_empty(client, datalayer):
+    DataLayer.objects.filter(pk=datalayer.pk).update(geojson='')
+    url = reverse('datalayer_tile', args=(datalayer.pk, 7, 68, 44))
+    response = client.get(url)
+    assert response.status_code == 204
+    assert response.content == b''
+
+
+def test_tile_of_invalid_data_should_be_empty(client, datalayer):
+    with open(datalayer.geojson.path, 'wb'):
+        pass
+    os.remove(datalayer.derived_path(spatial.INDEX_EXT))
+    url = reverse('datalayer_tile', args=(datalayer.pk, 7, 68, 44))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b''
+
+
+def test_tile_out_of_range_should_404(client, datalayer):
+    url = reverse('datalayer_tile', args=(datalayer.pk, 1, 2, 0))
+    assert client.get(url).status_code == 404
+    url = reverse('datalayer_tile', args=(datalayer.pk, 30, 0, 0))
+    assert client.get(url).status_code == 404
+
+
 def test_optimistic_concurrency_control_with_good_etag(client, datalayer, map, post_data):  # noqa
     # Get Etag
     url = reverse('datalayer_view', args=(datalayer.pk, ))
@@ -146,6 +317,7 @@ def test_versions_should_return_versions(client, datalayer, map, settings):
     datalayer.geojson.storage.save(
         '%s/%s_1440918637.geojson' % (root, datalayer.pk),
         ContentFile("{}"))
+    datalayer.index_versions()
     url = reverse('datalayer_versions', args=(datalayer.pk, ))
     versions = json.loads(client.get(url).content.decode())
     assert len(versions['versions']) == 4
@@ -159,4 +331,330 @@ def test_version_should_return_one_version_geojson(client, datalayer, map):
     name = '%s_1440924889.geojson' % datalayer.pk
     datalayer.geojson.storage.save('%s/%s' % (root, name), ContentFile("{}"))
     url = reverse('datalayer_version', args=(datalayer.pk, name))
-    assert client.get(url).content.decode() == "{}"
+    response = client.get(url)
+    assert b''.join(response.streaming_content).decode() == "{}"
+
+
+def test_get_should_stream_file(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    assert response.streaming
+    assert int(response['Content-Length']) == datalayer.geojson.size
+    content = b''.join(response.streaming_content)
+    assert len(content) == datalayer.geojson.size
+
+
+def test_get_should_use_stored_content_hash_as_etag(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    assert response['ETag'] == '"%s"' % datalayer.content_hash
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['ETag'] == '"%s-gzip"' % datalayer.content_hash
+
+
+def test_update_should_return_new_content_hash_as_etag(client, datalayer, map, post_data):  # noqa
+    url = reverse('datalayer_update', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    post_data['geojson'] = SimpleUploadedFile(
+        'name.geojson', post_data['geojson'].encode())
+    response = client.post(url, post_data, follow=True,
+                           HTTP_IF_MATCH='"%s"' % datalayer.content_hash)
+    assert response.status_code == 200
+    modified_datalayer = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified_datalayer.content_hash != datalayer.content_hash
+    assert response['ETag'] == '"%s"' % modified_datalayer.content_hash
+
+
+def test_get_should_return_304_if_etag_matches(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    etag = response['ETag']
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+    assert not response.content
+
+
+def test_get_should_return_304_if_not_modified_since(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    last_modified = response['Last-Modified']
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+
+def test_gzipped_and_identity_etags_should_differ(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    etag = client.get(url)['ETag']
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                          HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    gzip_etag = response['ETag']
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                          HTTP_IF_NONE_MATCH=gzip_etag)
+    assert response.status_code == 304
+
+
+def test_version_should_return_304_if_etag_matches(client, datalayer, map):
+    root = datalayer.storage_root()
+    name = '%s_1440924889.geojson' % datalayer.pk
+    datalayer.geojson.storage.save('%s/%s' % (root, name), ContentFile("{}"))
+    url = reverse('datalayer_version', args=(datalayer.pk, name))
+    etag = client.get(url)['ETag']
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+
+@pytest.fixture
+def wiggly_datalayer(map, settings):
+    settings.LEAFLET_STORAGE_SIMPLIFY_ZOOMS = [4, 7]
+    line = [[i / 100.0, 0.0001 * (i % 2)] for i in range(100)]
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature', 'properties': {},
+        'geometry': {'type': 'LineString', 'coordinates': line}}]})
+    return DataLayerFactory(map=map, geojson__data=geojson)
+
+
+def test_get_with_zoom_should_serve_simplified_variant(client, wiggly_datalayer):  # noqa
+    url = reverse('datalayer_view', args=(wiggly_datalayer.pk, ))
+    response = client.get(url, {'zoom': 3})
+    assert response['ETag'] == '"%s-z4"' % wiggly_datalayer.content_hash
+    data = json.loads(b''.join(response.streaming_content).decode())
+    assert len(data['features'][0]['geometry']['coordinates']) == 2
+    response = client.get(url, {'zoom': 5}, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['ETag'] == '"%s-z7-gzip"' % wiggly_datalayer.content_hash
+    assert response['Content-Encoding'] == 'gzip'
+
+
+def test_get_with_tolerance_should_serve_simplified_variant(client, wiggly_datalayer):  # noqa
+    url = reverse('datalayer_view', args=(wiggly_datalayer.pk, ))
+    response = client.get(url, {'tolerance': 1})
+    assert response['ETag'] == '"%s-z4"' % wiggly_datalayer.content_hash
+
+
+def test_get_with_high_zoom_should_serve_full_resolution(client, wiggly_datalayer):  # noqa
+    url = reverse('datalayer_view', args=(wiggly_datalayer.pk, ))
+    for params in ({'zoom': 12}, {'zoom': 'invalid'}, {}):
+        response = client.get(url, params)
+        assert response['ETag'] == '"%s"' % wiggly_datalayer.content_hash
+        data = json.loads(b''.join(response.streaming_content).decode())
+        assert len(data['features'][0]['geometry']['coordinates']) == 100
+
+
+def test_get_topojson(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, {'format': 'topojson'})
+    assert response.status_code == 200
+    assert response['ETag'] == '"%s-topojson"' % datalayer.content_hash
+    topology = json.loads(b''.join(response.streaming_content).decode())
+    assert topology['type'] == 'Topology'
+    collection = topology['objects']['data']
+    assert collection['_storage']['name'] == 'Donau'
+    assert collection['geometries'][0]['type'] == 'Point'
+    response = client.get(url, {'format': 'topojson'},
+                          HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['ETag'] == '"%s-topojson-gzip"' % datalayer.content_hash
+
+
+def test_get_topojson_should_404_if_not_generated(client, datalayer):
+    os.remove(datalayer.geojson.path + '.topojson')
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, {'format': 'topojson'})
+    assert response.status_code == 404
+
+
+def test_update_should_reject_invalid_geojson(client, datalayer, map, post_data):  # noqa
+    url = reverse('datalayer_update', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    post_data['geojson'] = SimpleUploadedFile(
+        'name.geojson', post_data['geojson'][:-10].encode())
+    response = client.post(url, post_data, follow=True)
+    assert response.status_code == 200
+    assert 'geojson' in json.loads(response.content.decode())['errors']
+    modified_datalayer = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified_datalayer.geojson.name == datalayer.geojson.name
+    assert modified_datalayer.content_hash == datalayer.content_hash
+
+
+def test_update_should_reject_too_big_geojson(client, datalayer, map, post_data, settings):  # noqa
+    settings.LEAFLET_STORAGE_DATALAYER_MAX_SIZE = 100
+    url = reverse('datalayer_update', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    post_data['geojson'] = SimpleUploadedFile(
+        'name.geojson', post_data['geojson'].encode())
+    response = client.post(url, post_data, follow=True)
+    assert 'geojson' in json.loads(response.content.decode())['errors']
+    modified_datalayer = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified_datalayer.content_hash == datalayer.content_hash
+
+
+@pytest.fixture
+def datalayer_with_ids(map):
+    geojson = json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': i, 'properties': {'name': str(i)},
+         'geometry': {'type': 'Point', 'coordinates': [i, i]}}
+        for i in range(3)]})
+    return DataLayerFactory(map=map, geojson__data=geojson)
+
+
+def test_patch(client, datalayer_with_ids, map):
+    datalayer = datalayer_with_ids
+    url = reverse('datalayer_patch', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    operations = [
+        {'op': 'delete', 'id': 0},
+        {'op': 'update', 'id': 1, 'feature': {
+            'type': 'Feature', 'properties': {'name': 'moved'},
+            'geometry': {'type': 'Point', 'coordinates': [10, 10]}}},
+        {'op': 'add', 'feature': {
+            'type': 'Feature', 'id': 3, 'properties': {},
+            'geometry': {'type': 'Point', 'coordinates': [3, 3]}}},
+    ]
+    response = client.post(url, json.dumps(operations),
+                           content_type='application/json',
+                           HTTP_IF_MATCH='"%s"' % datalayer.content_hash)
+    assert response.status_code == 200
+    modified = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified.geojson.name != datalayer.geojson.name
+    assert modified.content_hash != datalayer.content_hash
+    assert response['ETag'] == '"%s"' % modified.content_hash
+    assert json.loads(response.content.decode())['id'] == datalayer.pk
+    data = modified.read_data()
+    assert [f['id'] for f in data['features']] == [1, 2, 3]
+    assert data['features'][0]['properties']['name'] == 'moved'
+    assert data['features'][0]['geometry']['coordinates'] == [10, 10]
+    # Derived files are regenerated.
+    assert os.path.exists(modified.geojson.path + '.gz')
+
+
+def test_patch_should_reject_invalid_operations(client, datalayer_with_ids, map):  # noqa
+    datalayer = datalayer_with_ids
+    url = reverse('datalayer_patch', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    for body in ('not json', json.dumps([{'op': 'delete', 'id': 12}])):
+        response = client.post(url, body, content_type='application/json')
+        assert 'error' in json.loads(response.content.decode())
+    modified = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified.content_hash == datalayer.content_hash
+
+
+def test_patch_should_reject_too_big_result(client, datalayer_with_ids, map, settings):  # noqa
+    datalayer = datalayer_with_ids
+    settings.LEAFLET_STORAGE_DATALAYER_MAX_SIZE = datalayer.geojson.size + 10
+    url = reverse('datalayer_patch', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    operations = [{'op': 'add', 'feature': {
+        'type': 'Feature', 'id': 3, 'properties': {'name': 'x' * 100},
+        'geometry': {'type': 'Point', 'coordinates': [3, 3]}}}]
+    response = client.post(url, json.dumps(operations),
+                           content_type='application/json')
+    data = json.loads(response.content.decode())
+    assert 'geojson' in data['errors']
+    assert 'too big' in data['error']
+    modified = DataLayer.objects.get(pk=datalayer.pk)
+    assert modified.content_hash == datalayer.content_hash
+
+
+def test_patch_should_check_etag(client, datalayer_with_ids, map):
+    datalayer = datalayer_with_ids
+    url = reverse('datalayer_patch', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    response = client.post(url, json.dumps([{'op': 'delete', 'id': 1}]),
+                           content_type='application/json',
+                           HTTP_IF_MATCH='"xxx"')
+    assert response.status_code == 412
+
+
+def test_version_should_rebuild_delta_version(client, datalayer, map):
+    with open(datalayer.geojson.path, 'rb') as f:
+        previous = f.read()
+    datalayer.geojson = ContentFile(
+        previous.replace(b'Da place', b'Another place'), 'new.geojson')
+    datalayer.save()
+    name = datalayer.get_versions()[1]
+    root = datalayer.geojson.storage.path(datalayer.storage_root())
+    assert not os.path.exists('%s/%s' % (root, name))
+    url = reverse('datalayer_version', args=(datalayer.pk, name))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == previous
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+    url = reverse('datalayer_version',
+                  args=(datalayer.pk, '%s_1.geojson' % datalayer.pk))
+    assert client.get(url).status_code == 404
+
+
+def test_geojsonseq_should_stream_one_feature_per_record(client, datalayer):
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, {'format': 'geojsonseq'})
+    assert response['Content-Type'] == 'application/geo+json-seq'
+    records = b''.join(response.streaming_content).split(b'\x1e')[1:]
+    with open(datalayer.geojson.path) as f:
+        expected = json.load(f)['features']
+    assert [json.loads(r.decode()) for r in records] == expected
+    etag = response['ETag']
+    assert etag == '"{}-geojsonseq"'.format(datalayer.content_hash)
+    response = client.get(url, {'format': 'geojsonseq'},
+                          HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+
+def test_ndjson_should_not_need_spatial_index(client, datalayer):
+    os.remove(datalayer.geojson.path + '.seq')
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, {'format': 'ndjson'})
+    lines = b''.join(response.streaming_content).splitlines()
+    with open(datalayer.geojson.path) as f:
+        expected = json.load(f)['features']
+    assert [json.loads(line.decode()) for line in lines] == expected
+
+
+def test_geojsonseq_should_work_for_delta_version(client, datalayer):
+    with open(datalayer.geojson.path, 'rb') as f:
+        previous = f.read()
+    datalayer.geojson = ContentFile(
+        previous.replace(b'Da place', b'Another place'), 'new.geojson')
+    datalayer.save()
+    name = datalayer.get_versions()[1]
+    url = reverse('datalayer_version', args=(datalayer.pk, name))
+    response = client.get(url, {'format': 'ndjson'})
+    lines = b''.join(response.streaming_content).splitlines()
+    expected = json.loads(previous.decode())['features']
+    assert [json.loads(line.decode()) for line in lines] == expected
+
+
+def test_get_flatgeobuf_by_range(client, datalayer):
+    url = reverse('datalayer_fgb', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/octet-stream'
+    assert response['Accept-Ranges'] == 'bytes'
+    assert 'Content-Encoding' not in response
+    assert response['ETag'] == '"%s-fgb"' % datalayer.content_hash
+    content = b''.join(response.streaming_content)
+    with open(datalayer.geojson.path + '.fgb', 'rb') as f:
+        assert content == f.read()
+    response = client.get(url, HTTP_RANGE='bytes=0-7')
+    assert response.status_code == 206
+    assert b''.join(response.streaming_content) == b'fgb\x03fgb\x00'
+
+
+def test_get_flatgeobuf_should_404_if_not_generated(client, datalayer):
+    os.remove(datalayer.geojson.path + '.fgb')
+    url = reverse('datalayer_fgb', args=(datalayer.pk, ))
+    assert client.get(url).status_code == 404
+
+
+def test_update_should_return_stats(client, datalayer, map, post_data):
+    url = reverse('datalayer_update', args=(map.pk, datalayer.pk))
+    client.login(username=map.owner.username, password="123123")
+    post_data['geojson'] = SimpleUploadedFile(
+        'name.geojson', post_data['geojson'].encode())
+    response = client.post(url, post_data, follow=True)
+    stats = json.loads(response.content.decode())['stats']
+    assert stats['featureCount'] == 3
+    assert stats['geometryTypes'] == {'Polygon': 1, 'LineString': 1,
+                                      'Point': 1}
@@ -0,0 +1,46 @@
+import io
+import json
+
+from leaflet_storage.delta import (apply_delta, make_delta, read_header,
+                                   split_chunks)
+
+
+def feature(i, name=None):
+    return {'type': 'Feature', 'properties': {'name': name or str(i)},
+            'geometry': {'type': 'Point', 'coordinates': [i, i]}}
+
+
+def dumps(features):
+    return json.dumps({'type': 'FeatureCollection', 'features': features,
+                       '_storage': {'name': u'caf\xe9'}},
+                      ensure_ascii=False).encode('utf-8')
+
+
+def rebuild(delta, base):
+    f = io.BytesIO(delta)
+    header = read_header(f)
+    return header, apply_delta(f.read(), base)
+
+
+def test_split_chunks_should_keep_all_bytes():
+    content = dumps([feature(i) for i in range(3)])
+    chunks = split_chunks(content)
+    assert len(chunks) == 1 + 3 * 2
+    assert b''.join(chunks) == content
+
+
+def test_delta_should_rebuild_identical_content():
+    old = dumps([feature(i) for i in range(100)])
+    new = dumps([feature(i, 'changed') if i == 50 else feature(i)
+                 for i in range(100) if i != 10] + [feature(100)])
+    delta = make_delta(old, new, '1_123.geojson')
+    header, content = rebuild(delta, new)
+    assert content == old
+    assert header == {'base': '1_123.geojson', 'size': len(old)}
+    assert len(delta) < len(old) / 10
+
+
+def test_delta_without_common_chunks():
+    old = b'{"a": 1}'
+    new = b'[]'
+    assert rebuild(make_delta(old, new, 'x'), new)[1] == old
@@ -0,0 +1,134 @@
+import gzip
+import json
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+
+from leaflet_storage.models import Feature
+
+from .base import DataLayerFactory
+
+pytestmark = pytest.mark.django_db
+
+CONTENT = {
+    "type": "FeatureCollection",
+    "_storage": {"name": "Features"},
+    "features": [
+        {"type": "Feature", "id": 1, "properties": {"name": "here"},
+         "geometry": {"type": "Point", "coordinates": [13.5, 48.5]}},
+        {"type": "Feature", "properties": {"name": "nowhere"},
+         "geometry": None},
+        {"type": "Feature", "properties": {"name": "line"},
+         "geometry": {"type": "LineString",
+                      "coordinates": [[1.25, 2.5], [3.75, 4.125]]}},
+    ]
+}
+
+
+@pytest.fixture
+def postgis(settings):
+    settings.LEAFLET_STORAGE_FEATURES_BACKEND = 'postgis'
+
+
+def make_datalayer(map, content=CONTENT):
+    return DataLayerFactory(map=map,
+                            geojson__data=json.dumps(content).encode())
+
+
+def test_save_should_store_features(map, postgis):
+    datalayer = make_datalayer(map)
+    assert datalayer.uses_features_table()
+    assert datalayer.members == {"type": "FeatureCollection",
+                                 "_storage": {"name": "Features"}}
+    assert Feature.objects.filter(datalayer=datalayer).count() == 3
+    data = json.loads(b''.join(datalayer.iter_features_json()).decode())
+    assert data == CONTENT
+
+
+def test_save_should_replace_features(map, postgis):
+    datalayer = make_datalayer(map)
+    content = dict(CONTENT, features=CONTENT['features'][:1])
+    datalayer.geojson = ContentFile(json.dumps(content).encode(), 'x')
+    datalayer.save()
+    assert Feature.objects.filter(datalayer=datalayer).count() == 1
+
+
+def test_features_should_not_be_stored_by_default(map):
+    datalayer = make_datalayer(map)
+    assert not datalayer.uses_features_table()
+    assert not Feature.objects.exists()
+
+
+def test_invalid_geometry_should_fallback_to_file(map, postgis):
+    content = dict(CONTENT, features=[
+        {"type": "Feature", "properties": {},
+         "geometry": {"type": "Circle", "coordinates": [0, 0]}},
+    ])
+    datalayer = make_datalayer(map, content)
+    assert not datalayer.uses_features_table()
+    assert not Feature.objects.exists()
+
+
+def test_disabling_should_remove_features(map, postgis, settings):
+    datalayer = make_datalayer(map)
+    settings.LEAFLET_STORAGE_FEATURES_BACKEND = 'file'
+    datalayer.store_features()
+    assert not datalayer.members
+    assert not Feature.objects.exists()
+
+
+def test_query_bbox_should_use_features_table(map, postgis):
+    datalayer = make_datalayer(map)
+    data = json.loads(datalayer.query_bbox([13, 48, 14, 49]).decode())
+    assert data['_storage'] == {"name": "Features"}
+    assert [f['properties']['name'] for f in data['features']] == ['here']
+
+
+def test_clone_should_copy_features(map, postgis):
+    datalayer = make_datalayer(map)
+    clone = map.clone()
+    other = clone.datalayer_set.get()
+    assert other.members == datalayer.members
+    assert Feature.objects.filter(datalayer=other).count() == 3
+    data = json.loads(b''.join(other.iter_features_json()).decode())
+    assert data == CONTENT
+
+
+def test_view_should_stream_from_features_table(client, map, postgis):
+    datalayer = make_datalayer(map)
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    assert response.streaming
+    assert 'Content-Encoding' not in response
+    # Not the bytes of the file, so not its ETag.
+    assert response['ETag'] == '"{}-db"'.format(datalayer.content_hash)
+    data = json.loads(b''.join(response.streaming_content).decode())
+    assert data == CONTENT
+    response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_view_should_compress_from_features_table(client, map, postgis,
+                                                  settings):
+    settings.LEAFLET_STORAGE_ENCODINGS = ['gzip']
+    datalayer = make_datalayer(map)
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['ETag'] == '"{}-db-gzip"'.format(datalayer.content_hash)
+    assert 'Accept-Encoding' in response['Vary']
+    content = gzip.decompress(b''.join(response.streaming_content))
+    assert json.loads(content.decode()) == CONTENT
+
+
+def test_version_view_should_not_use_features_table(client, map, postgis):
+    datalayer = make_datalayer(map)
+    name = datalayer.get_versions()[0]
+    url = reverse('datalayer_version', args=(datalayer.pk, name))
+    response = client.get(url)
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content)
+    assert json.loads(content.decode()) == CONTENT
+    with open(datalayer.geojson.path, 'rb') as f:
+        assert content == f.read()
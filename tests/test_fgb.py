@@ -0,0 +1,169 @@
+import struct
+
+from leaflet_storage import fgb
+
+
+def point(x, y, **properties):
+    return {'type': 'Feature', 'properties': properties,
+            'geometry': {'type': 'Point', 'coordinates': [x, y]}}
+
+
+def table(buf, pos):
+    """
+    Return a function reading field `index` of the FlatBuffers table at
+    `pos`: a scalar of `fmt`, or the position of the child object.
+    """
+    vtable = pos - struct.unpack_from('<i', buf, pos)[0]
+    size = struct.unpack_from('<H', buf, vtable)[0]
+
+    def field(index, fmt=None):
+        if 4 + 2 * index >= size:
+            return None
+        offset = struct.unpack_from('<H', buf, vtable + 4 + 2 * index)[0]
+        if not offset:
+            return None
+        if fmt:
+            return struct.unpack_from('<' + fmt, buf, pos + offset)[0]
+        return pos + offset + struct.unpack_from('<I', buf, pos + offset)[0]
+    return field
+
+
+def root(buf, pos):
+    """
+    Return (root table, buffer, end position) of the size prefixed buffer
+    at `pos`.
+    """
+    size = struct.unpack_from('<I', buf, pos)[0]
+    data = buf[pos + 4:pos + 4 + size]
+    return table(data, struct.unpack_from('<I', data, 0)[0]), data, \
+        pos + 4 + size
+
+
+def vector(buf, pos, fmt):
+    count = struct.unpack_from('<I', buf, pos)[0]
+    return list(struct.unpack_from('<{}{}'.format(count, fmt), buf, pos + 4))
+
+
+def string(buf, pos):
+    size = struct.unpack_from('<I', buf, pos)[0]
+    return buf[pos + 4:pos + 4 + size].decode('utf-8')
+
+
+def read(content):
+    """
+    Return ((header, buffer), nodes, features by offset) of FlatGeobuf
+    `content`.
+    """
+    assert content[:8] == fgb.MAGIC
+    header, data, pos = root(content, 8)
+    count = header(8, 'Q')
+    node_size = header(9, 'H')
+    nodes = []
+    if node_size:
+        num_nodes = sum(e - s for s, e in fgb._level_bounds(count, node_size))
+        for i in range(num_nodes):
+            nodes.append(fgb.NODE_ITEM.unpack_from(content, pos))
+            pos += fgb.NODE_ITEM.size
+    start, features = pos, {}
+    while pos < len(content):
+        feature, buf, end = root(content, pos)
+        features[pos - start] = (feature, buf)
+        pos = end
+    return (header, data), nodes, features
+
+
+def test_header():
+    content = fgb.dump_flatgeobuf({'features': [
+        point(1, 2, name='a', count=1, ratio=1, flag=True, tags=['x']),
+        point(3, -4, name='b', count=2, ratio=.5, flag=False, tags=None),
+    ]}, 'Layer')
+    (header, data), nodes, features = read(content)
+    assert string(data, header(0)) == 'Layer'
+    assert vector(data, header(1), 'd') == [1, -4, 3, 2]
+    assert header(2, 'B') == 1
+    assert header(8, 'Q') == 2
+    assert header(9, 'H') == fgb.NODE_SIZE
+    columns = {}
+    pos = header(7)
+    for i in range(struct.unpack_from('<I', data, pos)[0]):
+        item = pos + 4 + 4 * i
+        column = table(data, item + struct.unpack_from('<I', data, item)[0])
+        columns[string(data, column(0))] = column(1, 'B')
+    assert columns == {'name': fgb.STRING, 'count': fgb.LONG,
+                       'ratio': fgb.DOUBLE, 'flag': fgb.BOOL,
+                       'tags': fgb.JSON}
+    crs = table(data, header(10))
+    assert (string(data, crs(0)), crs(1, 'i')) == ('EPSG', 4326)
+
+
+def test_properties():
+    columns = [('name', fgb.STRING), ('count', fgb.LONG),
+               ('flag', fgb.BOOL), ('tags', fgb.JSON)]
+    data = fgb._properties({'name': u'é', 'flag': True, 'tags': [1]},
+                           columns)
+    assert bytes(data) == (struct.pack('<HI', 0, 2) + u'é'.encode('utf-8') +
+                           struct.pack('<H?', 2, True) +
+                           struct.pack('<HI', 3, 3) + b'[1]')
+
+
+def test_geometries():
+    polygon = [[[0, 0], [4, 0], [4, 3], [0, 0]],
+               [[1, 1], [2, 1], [2, 2], [1, 1]]]
+    content = fgb.dump_flatgeobuf({'features': [
+        {'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'Polygon', 'coordinates': polygon}},
+        {'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'MultiPolygon',
+                      'coordinates': [polygon[:1], polygon[1:]]}},
+        {'type': 'Feature', 'properties': {}, 'geometry': None},
+    ]})
+    (header, data), nodes, features = read(content)
+    assert header(2, 'B') == 0  # Mixed types.
+    assert header(8, 'Q') == 2
+    types = {}
+    for feature, buf in features.values():
+        geometry = table(buf, feature(0))
+        types[geometry(6, 'B')] = (geometry, buf)
+    geometry, buf = types[fgb.GEOMETRY_TYPES['Polygon']]
+    assert vector(buf, geometry(0), 'I') == [4, 8]
+    assert vector(buf, geometry(1), 'd') == [
+        c for ring in polygon for position in ring for c in position]
+    geometry, buf = types[fgb.GEOMETRY_TYPES['MultiPolygon']]
+    assert geometry(1) is None
+    assert struct.unpack_from('<I', buf, geometry(7))[0] == 2
+
+
+def test_index_should_point_to_features_in_their_box():
+    content = fgb.dump_flatgeobuf({'features': [
+        point(i % 20, i // 20, id=i) for i in range(300)]})
+    (header, data), nodes, features = read(content)
+    bounds = fgb._level_bounds(300, fgb.NODE_SIZE)
+    assert nodes[0][:4] == (0, 0, 19, 14)
+    leaves = nodes[bounds[0][0]:]
+    assert len(leaves) == len(features) == 300
+    assert [leaf[4] for leaf in leaves] == sorted(features)
+    for minx, miny, maxx, maxy, offset in leaves:
+        feature, buf = features[offset]
+        x, y = vector(buf, table(buf, feature(0))(1), 'd')
+        assert (minx, miny, maxx, maxy) == (x, y, x, y)
+    # Parents cover their children.
+    for (start, end), (parent_start, _) in zip(bounds, bounds[1:]):
+        for i in range(start, end):
+            parent = nodes[parent_start + (i - start) // fgb.NODE_SIZE]
+            assert parent[4] <= i < parent[4] + fgb.NODE_SIZE
+            assert parent[0] <= nodes[i][0] and nodes[i][2] <= parent[2]
+            assert parent[1] <= nodes[i][1] and nodes[i][3] <= parent[3]
+
+
+def test_single_feature_should_have_a_root():
+    content = fgb.dump_flatgeobuf({'features': [point(1, 2)]})
+    (header, data), nodes, features = read(content)
+    assert [node[4] for node in nodes] == [1, 0]
+
+
+def test_empty_collection_should_have_no_index():
+    content = fgb.dump_flatgeobuf({'features': []})
+    (header, data), nodes, features = read(content)
+    assert header(8, 'Q') == 0
+    assert header(9, 'H') == 0
+    assert not nodes and not features
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from leaflet_storage.geojsonseq import dump_sequence, iter_features
+from leaflet_storage.validation import GeoJSONError
+
+DATA = {
+    "type": "FeatureCollection",
+    "_storage": {"features": ["not", "these"]},
+    "features": [
+        {"type": "Feature", "properties": {"name": "line\nbreak"},
+         "geometry": {"type": "LineString",
+                      "coordinates": [[1, 2], [3.5, -4]]}},
+        {"type": "Feature", "properties": {}, "geometry": None},
+    ]
+}
+
+
+def chunked(content, size=5):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+def test_iter_features_should_yield_each_feature():
+    content = json.dumps(DATA, indent=2).encode()
+    features = list(iter_features(chunked(content)))
+    assert [json.loads(f.decode()) for f in features] == DATA['features']
+    assert all(b'\n' not in f for f in features)
+
+
+def test_iter_features_should_handle_empty_collection():
+    content = b'{"type": "FeatureCollection", "features": []}'
+    assert list(iter_features([content])) == []
+
+
+def test_iter_features_should_raise_on_truncated_content():
+    content = json.dumps(DATA).encode()[:-20]
+    with pytest.raises(GeoJSONError):
+        list(iter_features([content]))
+
+
+def test_dump_sequence_should_frame_features():
+    features = [b'{"a":1}', b'{"b":2}']
+    assert b''.join(dump_sequence(features, 'geojsonseq')) == (
+        b'\x1e{"a":1}\n\x1e{"b":2}\n')
+    assert b''.join(dump_sequence(features, 'ndjson')) == (
+        b'{"a":1}\n{"b":2}\n')
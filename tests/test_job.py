@@ -0,0 +1,137 @@
+import datetime
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from leaflet_storage.models import DataLayer, Job
+
+from .base import DataLayerFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def async_jobs(settings):
+    settings.LEAFLET_STORAGE_ASYNC_JOBS = True
+
+
+def save_version(datalayer):
+    datalayer.geojson = ContentFile(
+        b'{"type": "FeatureCollection", "features": []}', 'new.geojson')
+    datalayer.save()
+
+
+def test_save_should_purge_synchronously_by_default(datalayer):
+    datalayer.save()
+    assert not Job.objects.exists()
+
+
+def test_save_should_queue_purge(datalayer, async_jobs, settings):
+    settings.LEAFLET_STORAGE_KEEP_VERSIONS = 1
+    old_path = datalayer.geojson.path
+    save_version(datalayer)
+    datalayer.save()
+    # Pending jobs of the same layer and map are only queued once.
+    assert sorted(Job.objects.values_list('kind', flat=True)) == [
+        'build_bundle', 'compact_versions', 'purge_versions']
+    assert os.path.exists(old_path)
+    assert Job.run_pending() == (3, 0)
+    assert not os.path.exists(old_path)
+    assert not os.path.exists(old_path + '.gz')
+    assert len(datalayer.get_versions()) == 1
+    assert not Job.objects.exists()
+
+
+def test_save_should_queue_bundle_build(map, datalayer, async_jobs):
+    other = DataLayerFactory(map=map, name='other')
+    name = map.get_bundle_name()
+    storage = datalayer.geojson.storage
+    assert not storage.exists(name)
+    assert Job.objects.filter(kind='build_bundle').count() == 1
+    Job.run_pending()
+    assert storage.exists(name)
+    assert storage.exists(name + '.gz')
+    other.delete()
+    assert Job.objects.filter(kind='build_bundle').count() == 1
+    Job.run_pending()
+    assert storage.exists(map.get_bundle_name())
+
+
+def test_failed_job_should_be_retried_later(async_jobs, settings):
+    settings.LEAFLET_STORAGE_JOBS_MAX_ATTEMPTS = 2
+    job = Job.enqueue('unknown')
+    assert Job.run_pending() == (0, 1)
+    job = Job.objects.get(pk=job.pk)
+    assert job.attempts == 1
+    assert 'unknown' in job.last_error
+    # Not due yet.
+    assert Job.run_pending() == (0, 0)
+    Job.objects.update(run_after=job.created_at)
+    assert Job.run_pending() == (0, 1)
+    Job.objects.update(run_after=job.created_at)
+    # Max attempts reached: kept for inspection, but not run anymore.
+    assert Job.run_pending() == (0, 0)
+    assert Job.objects.get(pk=job.pk).attempts == 2
+
+
+def test_failed_job_should_not_prevent_others(async_jobs):
+    Job.enqueue('unknown')
+    Job.enqueue('delete_files', trees=['unknown'])
+    assert Job.run_pending() == (1, 1)
+    assert Job.objects.count() == 1
+
+
+def test_enqueue_should_not_dedupe_against_running_job(async_jobs):
+    job = Job.enqueue('build_bundle', key='build_bundle:0', map=0)
+    assert Job.enqueue('build_bundle', key='build_bundle:0', map=0) is None
+    Job.objects.filter(pk=job.pk).update(started_at=timezone.now())
+    assert Job.enqueue('build_bundle', key='build_bundle:0', map=0)
+    # The running one is not claimed again.
+    assert Job.run_pending() == (1, 0)
+    assert Job.objects.get().pk == job.pk
+
+
+def test_abandoned_job_should_be_claimed_again(async_jobs, settings):
+    settings.LEAFLET_STORAGE_JOBS_TIMEOUT = 60
+    job = Job.enqueue('build_bundle', key='build_bundle:0', map=0)
+    Job.objects.filter(pk=job.pk).update(
+        started_at=timezone.now() - datetime.timedelta(seconds=120))
+    assert Job.run_pending() == (1, 0)
+    assert not Job.objects.exists()
+
+
+def test_delete_datalayer_should_delete_its_files(datalayer, map, async_jobs):
+    save_version(datalayer)
+    paths = [datalayer.geojson.path, datalayer.geojson.path + '.gz']
+    previous = os.path.join(
+        os.path.dirname(datalayer.geojson.path),
+        datalayer.get_versions()[1] + '.delta')
+    Job.run_pending()
+    other = DataLayerFactory(map=map)
+    datalayer.delete()
+    assert all(os.path.exists(p) for p in paths + [previous])
+    Job.run_pending()
+    assert not any(os.path.exists(p) for p in paths + [previous])
+    assert os.path.exists(other.geojson.path)
+
+
+def test_delete_datalayer_should_delete_versions_not_indexed(datalayer):
+    root = datalayer.storage_root()
+    older = '%s/%s_1440918637.geojson' % (root, datalayer.pk)
+    datalayer.geojson.storage.save(older, ContentFile(b'{}'))
+    datalayer.geojson.storage.save(older + '.gz', ContentFile(b'{}'))
+    other = DataLayerFactory(map=datalayer.map)
+    datalayer.delete()
+    assert not datalayer.geojson.storage.exists(older)
+    assert not datalayer.geojson.storage.exists(older + '.gz')
+    assert os.path.exists(other.geojson.path)
+
+
+def test_delete_map_should_delete_its_files(datalayer, map):
+    root = datalayer.geojson.storage.path(map.datalayers_root())
+    assert os.path.exists(root)
+    map.delete()
+    assert not os.path.exists(root)
+    assert not DataLayer.objects.filter(pk=datalayer.pk).exists()
@@ -1,10 +1,14 @@
+import os
+
 import pytest
 from django.contrib.auth.models import AnonymousUser
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from leaflet_storage.models import Map
 
-from .base import MapFactory
+from .base import DataLayerFactory, MapFactory, UserFactory
 
 pytestmark = pytest.mark.django_db
 
@@ -99,6 +103,34 @@ def test_clone_should_clone_datalayers_and_features_too(map, user, datalayer):
     assert other.geojson.path != datalayer.geojson.path
 
 
+def test_clone_should_link_datalayer_files(map, datalayer):
+    clone = map.clone().datalayer_set.get()
+    assert clone.get_versions() == [os.path.basename(clone.geojson.name)]
+    assert clone.versions[0]['size'] == datalayer.geojson.size
+    assert clone.content_hash == datalayer.content_hash
+    with open(clone.geojson.path, 'rb') as f, \
+            open(datalayer.geojson.path, 'rb') as g:
+        assert f.read() == g.read()
+    for ext in ('.gz', '.seq', '.idx'):
+        assert os.path.exists(clone.geojson.path + ext)
+
+
+def count_clone_queries(map):
+    with CaptureQueriesContext(connection) as context:
+        map.clone()
+    return len(context.captured_queries)
+
+
+def test_clone_queries_should_not_depend_on_size(map, user):
+    map.editors.add(user)
+    DataLayerFactory(map=map)
+    expected = count_clone_queries(map)
+    for i in range(3):
+        map.editors.add(UserFactory(username='editor{}'.format(i)))
+        DataLayerFactory(map=map, name='layer {}'.format(i))
+    assert count_clone_queries(map) == expected
+
+
 def test_publicmanager_should_get_only_public_maps(map, user, licence):
     map.share_status = map.PUBLIC
     open_map = MapFactory(owner=user, licence=licence, share_status=Map.OPEN)
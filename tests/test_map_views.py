@@ -1,11 +1,13 @@
  # -*- coding:utf-8 -*-
 
 import json
+import re
 
 import pytest
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
 
+from leaflet_storage import views
 from leaflet_storage.models import DataLayer, Map
 
 from .base import login_required
@@ -447,3 +449,58 @@ def test_anyone_can_access_anonymous_map(cookieclient, anonymap):
     anonymap.share_status = anonymap.PRIVATE
     response = cookieclient.get(url)
     assert response.status_code == 200
+
+
+@pytest.fixture
+def reset_urls():
+    views.reset_urls_for_js()
+    yield
+    views.reset_urls_for_js()
+
+
+def test_urls_for_js_should_be_computed_once(reset_urls, monkeypatch,
+                                             settings):
+    calls = []
+
+    def get_uri_template(name):
+        calls.append(name)
+        return '/' + name
+
+    monkeypatch.setattr(views, 'get_uri_template', get_uri_template)
+    urls = views._urls_for_js()
+    assert urls['map'] == '/map'
+    assert views._urls_for_js() == urls
+    assert len(calls) == len(set(calls))
+    # Changing a setting they depend on resets them.
+    settings.LEAFLET_STORAGE_EXTRA_URLS = {'extra': '/extra/'}
+    assert views._urls_for_js()['extra'] == '/extra/'
+    assert len(calls) == 2 * len(set(calls))
+
+
+def test_urls_js_should_replace_inline_urls(reset_urls, client, map,
+                                            settings, tmpdir):
+    settings.STATIC_ROOT = str(tmpdir)
+    settings.STATIC_URL = '/static/'
+    settings.LEAFLET_STORAGE_URLS_JS = True
+    response = client.get(reverse('map', args=(map.slug, map.pk)))
+    src = re.search(r'src="/static/(storage/urls\.\w+\.js)"',
+                    response.content.decode()).group(1)
+    content = tmpdir.join(src).read()
+    assert content.startswith('L.Storage.Map.mergeOptions({urls: ')
+    assert json.loads(content[34:-4]) == views._urls_for_js()
+    assert '"urls"' not in response.context['map_settings']
+    # Other consumers of the settings still get them.
+    response = client.get(reverse('map_geojson', args=(map.pk, )))
+    assert 'urls' in json.loads(response.content.decode())['properties']
+
+
+def test_urls_js_should_be_inlined_with_hashing_storage(reset_urls, client,
+                                                        map, settings,
+                                                        tmpdir):
+    settings.STATIC_ROOT = str(tmpdir)
+    settings.STATICFILES_STORAGE = ('django.contrib.staticfiles.storage.'
+                                    'ManifestStaticFilesStorage')
+    settings.LEAFLET_STORAGE_URLS_JS = True
+    response = client.get(reverse('map_geojson', args=(map.pk, )))
+    assert 'urls' in json.loads(response.content.decode())['properties']
+    assert not tmpdir.listdir()
@@ -0,0 +1,81 @@
+import struct
+
+from leaflet_storage import mvt, spatial
+
+
+def test_tile_bounds():
+    west, south, east, north = mvt.tile_bounds(0, 0, 0)
+    assert (west, east) == (-180, 180)
+    assert round(north, 4) == round(mvt.MAX_LATITUDE, 4)
+    assert round(south, 4) == -round(mvt.MAX_LATITUDE, 4)
+
+
+def test_tiles_for_bbox():
+    assert list(mvt.tiles_for_bbox((-180, -85, 180, 85), 0)) == [(0, 0)]
+    assert list(mvt.tiles_for_bbox((1, 1, 2, 2), 1)) == [(1, 0)]
+    assert len(list(mvt.tiles_for_bbox((-180, -85, 180, 85), 2))) == 16
+
+
+def test_varint_and_zigzag():
+    assert mvt._varint(1) == b'\x01'
+    assert mvt._varint(300) == b'\xac\x02'
+    assert [mvt._zigzag(v) for v in (0, -1, 1, -2)] == [0, 1, 2, 3]
+
+
+def test_clip_line_should_split_parts():
+    line = [(-100, 10), (10, 10), (10, 5000), (20, 5000), (20, 10)]
+    parts = mvt.clip_line(line)
+    assert parts == [[(-64, 10), (10, 10), (10, mvt.EXTENT + 64)],
+                     [(20, mvt.EXTENT + 64), (20, 10)]]
+
+
+def test_polygon_rings_winding():
+    def project(p):
+        return p
+    exterior = [[0, 0], [0, 100], [100, 100], [100, 0], [0, 0]]
+    hole = [[10, 10], [20, 10], [20, 20], [10, 20], [10, 10]]
+    rings = mvt._polygon_rings([exterior, hole], project)
+    assert mvt._area(rings[0]) > 0
+    assert mvt._area(rings[1]) < 0
+
+
+def test_encode_geometry_point():
+    # MoveTo(1), zigzag(25), zigzag(17), as in the MVT spec example.
+    assert mvt.encode_geometry(mvt.POINT, [[(25, 17)]]) == [9, 50, 34]
+
+
+def test_encode_value_should_fall_back_to_double_out_of_int64():
+    assert mvt._encode_value(2 ** 63 - 1).startswith(b'\x30')  # sint
+    assert mvt._encode_value(2 ** 63) == (b'\x19' +
+                                          struct.pack('<d', 2.0 ** 63))
+    assert mvt._encode_value(-2 ** 64).startswith(b'\x19')  # double
+    assert mvt._encode_value(10 ** 400) == b'\x0a\x91\x03' + b'1' + (
+        b'0' * 400)
+
+
+def test_convert_geometries_should_split_collections():
+    def project(p):
+        return p
+    geometry = {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': [10, 10]},
+        {'type': 'LineString', 'coordinates': [[0, 0], [100, 100]]},
+        {'type': 'GeometryCollection', 'geometries': [
+            {'type': 'Point', 'coordinates': [20, 20]}]},
+    ]}
+    assert mvt.convert_geometries(geometry, project) == [
+        (mvt.POINT, [[(10, 10)], [(20, 20)]]),
+        (mvt.LINESTRING, [[(0, 0), (100, 100)]]),
+    ]
+
+
+def test_render_tile(tmpdir):
+    seq = str(tmpdir.join('layer.seq'))
+    idx = str(tmpdir.join('layer.idx'))
+    features = [{'type': 'Feature', 'properties': {'name': 'Paris'},
+                 'geometry': {'type': 'Point', 'coordinates': [2.35, 48.85]}}]
+    spatial.build_index({'type': 'FeatureCollection', 'features': features},
+                        seq, idx)
+    tile = mvt.render_tile(seq, idx, 'layer', 5, 16, 11)
+    assert tile.startswith(b'\x1a')  # Field 3 (layers), length delimited.
+    assert b'Paris' in tile
+    assert mvt.render_tile(seq, idx, 'layer', 5, 0, 0) == b''
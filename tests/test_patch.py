@@ -0,0 +1,56 @@
+import pytest
+
+from leaflet_storage.patch import PatchError, apply_operations
+
+
+def feature(id=None, x=1):
+    feature = {'type': 'Feature', 'properties': {},
+               'geometry': {'type': 'Point', 'coordinates': [x, 2]}}
+    if id is not None:
+        feature['id'] = id
+    return feature
+
+
+def collection():
+    return {'type': 'FeatureCollection', '_storage': {'name': 'test'},
+            'features': [feature(1), feature(2), feature()]}
+
+
+def test_apply_operations():
+    data = apply_operations(collection(), [
+        {'op': 'add', 'feature': feature(3, x=3)},
+        {'op': 'update', 'id': 1, 'feature': feature(x=10)},
+        {'op': 'delete', 'id': 2},
+        {'op': 'update', 'id': 3, 'feature': feature(3, x=30)},
+    ])
+    assert [f.get('id') for f in data['features']] == [1, None, 3]
+    assert data['features'][0]['geometry']['coordinates'] == [10, 2]
+    assert data['features'][2]['geometry']['coordinates'] == [30, 2]
+    assert data['_storage'] == {'name': 'test'}
+
+
+@pytest.mark.parametrize('operations', [
+    {'op': 'delete', 'id': 1},
+    [{'op': 'move', 'id': 1}],
+    [{'op': 'delete', 'id': 4}],
+    [{'op': 'delete', 'id': 1}, {'op': 'delete', 'id': 1}],
+    [{'op': 'add', 'feature': feature(1)}],
+    [{'op': 'add', 'feature': {'type': 'Feature'}}],
+    [{'op': 'update', 'id': 1, 'feature': feature(2)}],
+    [{'op': 'update', 'id': 1}],
+    [{'op': 'delete', 'id': [1]}],
+    [{'op': 'delete', 'id': {'id': 1}}],
+    [{'op': 'add', 'feature': feature([3])}],
+])
+def test_apply_operations_should_reject_invalid_operations(operations):
+    data = collection()
+    with pytest.raises(PatchError):
+        apply_operations(data, operations)
+    assert data == collection()
+
+
+def test_apply_operations_should_skip_features_with_invalid_id():
+    data = collection()
+    data['features'].append(feature([4]))
+    data = apply_operations(data, [{'op': 'delete', 'id': 1}])
+    assert [f.get('id') for f in data['features']] == [2, None, [4]]
@@ -0,0 +1,78 @@
+from leaflet_storage import simplify
+
+
+def feature(geometry):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': {}}
+
+
+def wiggly_line(count=50, amplitude=0.001):
+    return [[i / 10.0, amplitude * (i % 2)] for i in range(count)]
+
+
+def test_zoom_tolerance():
+    assert simplify.zoom_tolerance(0) == 360.0 / 256
+    assert simplify.zoom_tolerance(1, 2) == simplify.zoom_tolerance(0)
+
+
+def test_pick_zoom():
+    zooms = [4, 7, 10]
+    assert simplify.pick_zoom(zooms) is None
+    assert simplify.pick_zoom(zooms, zoom=2) == 4
+    assert simplify.pick_zoom(zooms, zoom=5) == 7
+    assert simplify.pick_zoom(zooms, zoom=10) == 10
+    assert simplify.pick_zoom(zooms, zoom=11) is None
+    assert simplify.pick_zoom(zooms, tolerance=1) == 4
+    assert simplify.pick_zoom(zooms, tolerance=0.00001) is None
+
+
+def test_douglas_peucker():
+    points = [[0, 0], [1, 0.01], [2, 0], [3, 5], [4, 0]]
+    assert simplify.douglas_peucker(points, 0.1) == [0, 2, 3, 4]
+    assert simplify.douglas_peucker(points, 10) == [0, 4]
+    assert simplify.douglas_peucker(points[:2], 10) == [0, 1]
+
+
+def test_simplify_collection_should_keep_line_ends():
+    line = wiggly_line()
+    data = {'type': 'FeatureCollection',
+            'features': [feature({'type': 'LineString',
+                                  'coordinates': line})]}
+    simplified = simplify.simplify_collection(data, 0.01)
+    coordinates = simplified['features'][0]['geometry']['coordinates']
+    assert coordinates == [line[0], line[-1]]
+    # Source is untouched.
+    assert data['features'][0]['geometry']['coordinates'] == line
+
+
+def test_simplify_collection_should_return_none_if_nothing_removed():
+    data = {'type': 'FeatureCollection',
+            'features': [feature({'type': 'Point', 'coordinates': [1, 2]})]}
+    assert simplify.simplify_collection(data, 1) is None
+
+
+def test_simplify_collection_should_preserve_shared_borders():
+    border = [[0, i / 10.0] for i in range(11)]
+    border = [[x + 0.001 * (i % 2), y] for i, (x, y) in enumerate(border)]
+    left = border + [[-1, 1], [-1, 0], border[0]]
+    right = border + [[1, 1], [1, 0], border[0]]
+    data = {'type': 'FeatureCollection', 'features': [
+        feature({'type': 'Polygon', 'coordinates': [left]}),
+        feature({'type': 'Polygon', 'coordinates': [right]}),
+    ]}
+    simplified = simplify.simplify_collection(data, 0.01)
+    rings = [f['geometry']['coordinates'][0] for f in simplified['features']]
+    assert len(rings[0]) < len(left)
+    shared = [set(map(tuple, r)) & set(map(tuple, border)) for r in rings]
+    assert shared[0] == shared[1]
+    # Corners where polygons meet are never removed.
+    assert (0, 0) in shared[0] and (0, 1) in shared[0]
+
+
+def test_simplify_collection_should_drop_collapsed_holes():
+    exterior = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+    hole = [[5, 5], [5.001, 5], [5.001, 5.001], [5, 5.001], [5, 5]]
+    data = {'type': 'FeatureCollection', 'features': [
+        feature({'type': 'Polygon', 'coordinates': [exterior, hole]}),
+    ]}
+    simplified = simplify.simplify_collection(data, 0.1)
+    assert simplified['features'][0]['geometry']['coordinates'] == [exterior]
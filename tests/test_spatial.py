@@ -0,0 +1,55 @@
+import json
+
+from leaflet_storage import spatial
+
+
+def point(x, y, name):
+    return {'type': 'Feature', 'properties': {'name': name},
+            'geometry': {'type': 'Point', 'coordinates': [x, y]}}
+
+
+def test_geometry_bbox():
+    assert spatial.geometry_bbox({'type': 'Point',
+                                  'coordinates': [1, 2]}) == (1, 2, 1, 2)
+    polygon = {'type': 'Polygon',
+               'coordinates': [[[0, 0], [4, 0], [4, 3], [0, 0]]]}
+    assert spatial.geometry_bbox(polygon) == (0, 0, 4, 3)
+    collection = {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': [-1, 5]}, polygon]}
+    assert spatial.geometry_bbox(collection) == (-1, 0, 4, 5)
+    assert spatial.geometry_bbox(None) is None
+    assert spatial.geometry_bbox({'type': 'Point', 'coordinates': []}) is None
+
+
+def test_packed_index_search():
+    index = spatial.PackedIndex(100)
+    for i in range(100):
+        index.add(i, i, i + 0.5, i + 0.5)
+    index.finish()
+    assert index.search(10, 10, 12, 12) == [10, 11, 12]
+    assert index.search(-10, -10, -1, -1) == []
+    assert len(index.search(-1, -1, 1000, 1000)) == 100
+
+
+def test_build_index_and_query(tmpdir):
+    seq = str(tmpdir.join('layer.geojson.seq'))
+    idx = str(tmpdir.join('layer.geojson.idx'))
+    features = [point(i, i, str(i)) for i in range(50)]
+    features.append({'type': 'Feature', 'properties': {}, 'geometry': None})
+    data = {'type': 'FeatureCollection', 'features': features,
+            '_storage': {'name': 'layer'}}
+    spatial.build_index(data, seq, idx)
+    members, found = spatial.query(seq, idx, (9.5, 9.5, 12, 12))
+    collection = json.loads(spatial.dump_collection(members, found).decode())
+    assert collection['type'] == 'FeatureCollection'
+    assert collection['_storage'] == {'name': 'layer'}
+    names = [f['properties']['name'] for f in collection['features']]
+    assert names == ['10', '11', '12']
+
+
+def test_query_empty_collection(tmpdir):
+    seq = str(tmpdir.join('layer.geojson.seq'))
+    idx = str(tmpdir.join('layer.geojson.idx'))
+    spatial.build_index({'type': 'FeatureCollection', 'features': []},
+                        seq, idx)
+    assert spatial.query(seq, idx, (-180, -90, 180, 90))[1] == []
@@ -0,0 +1,36 @@
+from leaflet_storage.stats import MAX_PROPERTIES, collection_stats
+
+
+def feature(geometry, **properties):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+
+def test_collection_stats():
+    stats = collection_stats({'type': 'FeatureCollection', 'features': [
+        feature({'type': 'Point', 'coordinates': [1, 2]}, name='a', count=1,
+                tags=['x'], _storage_options={'color': 'red'}),
+        feature({'type': 'LineString', 'coordinates': [[3, -4], [5, 6]]},
+                name='b', count='two', tags=None),
+        feature({'type': 'Point', 'coordinates': [0, 0]}, name=None),
+        feature(None, flag=True),
+    ]})
+    assert stats == {
+        'bbox': [0, -4, 5, 6],
+        'featureCount': 4,
+        'geometryTypes': {'Point': 2, 'LineString': 1},
+        'properties': {'name': 'string', 'count': 'mixed', 'tags': 'array',
+                       'flag': 'boolean'},
+    }
+
+
+def test_collection_stats_without_features():
+    assert collection_stats({'type': 'FeatureCollection'}) == {
+        'bbox': None, 'featureCount': 0, 'geometryTypes': {},
+        'properties': {}}
+
+
+def test_collection_stats_should_limit_properties():
+    properties = dict(('key{}'.format(i), i)
+                      for i in range(MAX_PROPERTIES + 10))
+    stats = collection_stats({'features': [feature(None, **properties)]})
+    assert len(stats['properties']) == MAX_PROPERTIES
@@ -0,0 +1,91 @@
+import gzip
+import json
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+
+from leaflet_storage.models import DataLayer
+
+from .base import DataLayerFactory
+from .storage import MemoryStorage
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(DataLayer._meta.get_field('geojson'), 'storage',
+                        storage)
+    return storage
+
+
+def read(storage, name):
+    with storage.open(name) as f:
+        return f.read()
+
+
+def test_save_should_go_through_storage(map, storage):
+    datalayer = DataLayerFactory(map=map)
+    name = datalayer.geojson.name
+    assert storage.exists(name)
+    assert gzip.decompress(read(storage, name + '.gz')) == read(storage, name)
+    assert storage.exists(name + '.topojson')
+    assert datalayer.versions[0]['size'] == storage.size(name)
+
+
+def test_view_should_serve_from_storage(client, map, storage):
+    datalayer = DataLayerFactory(map=map)
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url)
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content)
+    assert content == read(storage, datalayer.geojson.name)
+    assert response['Last-Modified']
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(b''.join(response.streaming_content)) == content
+    response = client.get(url, HTTP_RANGE='bytes=0-9')
+    assert response.status_code == 206
+    assert b''.join(response.streaming_content) == content[:10]
+
+
+def test_version_should_be_served_from_storage(client, map, storage):
+    datalayer = DataLayerFactory(map=map)
+    old = read(storage, datalayer.geojson.name)
+    datalayer.geojson = ContentFile(old.replace(b'Here', b'There'), 'x')
+    datalayer.save()
+    name = datalayer.get_versions()[1]
+    url = reverse('datalayer_version', args=(datalayer.pk, name))
+    response = client.get(url)
+    assert response.status_code == 200
+    content = getattr(response, 'content', None)
+    if content is None:
+        content = b''.join(response.streaming_content)
+    assert json.loads(content.decode()) == json.loads(old.decode())
+
+
+def test_redirect_mode_should_redirect_to_storage(client, map, storage,
+                                                  settings):
+    settings.LEAFLET_STORAGE_SERVE_REDIRECT = True
+    datalayer = DataLayerFactory(map=map)
+    url = reverse('datalayer_view', args=(datalayer.pk, ))
+    response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 302
+    assert response['Location'] == storage.url(datalayer.geojson.name)
+
+
+def test_bbox_and_tiles_should_not_be_available(client, map, storage):
+    datalayer = DataLayerFactory(map=map)
+    url = reverse('datalayer_bbox', args=(datalayer.pk, ))
+    response = client.get(url, {'bbox': '-10,-10,10,10'})
+    assert response.status_code == 501
+    url = reverse('datalayer_tile', args=(datalayer.pk, 0, 0, 0))
+    assert client.get(url).status_code == 501
+
+
+def test_delete_should_delete_from_storage(map, storage):
+    datalayer = DataLayerFactory(map=map)
+    datalayer.delete()
+    assert not storage.files
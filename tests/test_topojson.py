@@ -0,0 +1,72 @@
+from leaflet_storage import topojson
+
+
+def feature(geometry, **properties):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+
+def decode_arc(topology, index):
+    (kx, ky), (x0, y0) = (topology['transform']['scale'],
+                          topology['transform']['translate'])
+    x = y = 0
+    points = []
+    for dx, dy in topology['arcs'][~index if index < 0 else index]:
+        x += dx
+        y += dy
+        points.append([round(x * kx + x0, 6), round(y * ky + y0, 6)])
+    return points[::-1] if index < 0 else points
+
+
+def decode_path(topology, indexes):
+    points = []
+    for index in indexes:
+        arc = decode_arc(topology, index)
+        points.extend(arc[1:] if points else arc)
+    return points
+
+
+def close_to(a, b, precision):
+    return all(abs(p[0] - q[0]) <= precision and abs(p[1] - q[1]) <= precision
+               for p, q in zip(a, b)) and len(a) == len(b)
+
+
+def test_dump_topology_should_share_borders():
+    left = [[0, 0], [0, 1], [-1, 1], [-1, 0], [0, 0]]
+    right = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+    data = {'type': 'FeatureCollection', '_storage': {'name': 'test'},
+            'features': [
+                feature({'type': 'Polygon', 'coordinates': [left]}, name='L'),
+                feature({'type': 'Polygon', 'coordinates': [right]}, name='R'),
+            ]}
+    topology = topojson.dump_topology(data, 1001)
+    assert topology['type'] == 'Topology'
+    assert topology['bbox'] == [-1, 0, 1, 1]
+    collection = topology['objects'][topojson.OBJECT_NAME]
+    assert collection['_storage'] == {'name': 'test'}
+    geometries = collection['geometries']
+    assert [g['properties']['name'] for g in geometries] == ['L', 'R']
+    # Shared border, then one arc per remaining side.
+    assert len(topology['arcs']) == 3
+    rings = [decode_path(topology, g['arcs'][0]) for g in geometries]
+    shared = [set(map(tuple, r)) for r in rings]
+    assert shared[0] & shared[1] == set([(0, 0), (0, 1)])
+    for ring, source in zip(rings, (left, right)):
+        assert set(map(tuple, ring)) == set(map(tuple, source))
+        assert ring[0] == ring[-1]
+
+
+def test_dump_topology_should_quantize_and_delta_encode():
+    line = [[0.123456789, 0.987654321], [1.5, 2.25], [3, 3]]
+    data = {'type': 'FeatureCollection', 'features': [
+        feature({'type': 'LineString', 'coordinates': line}),
+        feature({'type': 'Point', 'coordinates': [1.5, 2.25]}),
+        feature(None),
+    ]}
+    topology = topojson.dump_topology(data, 10000)
+    geometries = topology['objects'][topojson.OBJECT_NAME]['geometries']
+    assert all(isinstance(v, int) for arc in topology['arcs']
+               for p in arc for v in p)
+    decoded = decode_path(topology, geometries[0]['arcs'])
+    assert close_to(decoded, line, 0.001)
+    assert isinstance(geometries[1]['coordinates'][0], int)
+    assert geometries[2]['type'] is None
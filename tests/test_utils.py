@@ -0,0 +1,35 @@
+import gzip
+
+from leaflet_storage.utils import (compress_iterator, negotiate_encodings,
+                                   parse_accept_encoding)
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, br;q=0.8, *;q=0') == {
+        'gzip': 1.0, 'br': 0.8, '*': 0.0}
+    assert parse_accept_encoding('x-gzip') == {'gzip': 1.0}
+    assert parse_accept_encoding('') == {}
+
+
+def test_negotiate_encodings_should_sort_by_qvalue():
+    encodings = ['br', 'zstd', 'gzip']
+    assert negotiate_encodings('gzip, br;q=0.5', encodings) == ['gzip', 'br']
+    assert negotiate_encodings('gzip, deflate, br', encodings) == ['br',
+                                                                   'gzip']
+
+
+def test_negotiate_encodings_should_respect_server_preference_on_tie():
+    assert negotiate_encodings('*', ['br', 'gzip']) == ['br', 'gzip']
+    assert negotiate_encodings('gzip, br', ['gzip', 'br']) == ['gzip', 'br']
+
+
+def test_negotiate_encodings_should_skip_refused_or_disabled():
+    assert negotiate_encodings('gzip;q=0, br', ['gzip']) == []
+    assert negotiate_encodings('', ['br', 'gzip']) == []
+    assert negotiate_encodings('gzip;q=0.5, identity', ['gzip']) == []
+
+
+def test_compress_iterator_should_compress_chunks():
+    chunks = [b'{"type": ', b'"FeatureCollection", ', b'"features": []}']
+    compressed = b''.join(compress_iterator(iter(chunks), 'gzip'))
+    assert gzip.decompress(compressed) == b''.join(chunks)
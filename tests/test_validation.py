@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from leaflet_storage.validation import GeoJSONError, validate
+
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+COLLECTION = {
+    'type': 'FeatureCollection',
+    '_storage': {'name': u'Donau été', 'id': 926},
+    'features': [
+        {'type': 'Feature', 'properties': {'name': 'a "quoted" \\ name'},
+         'geometry': {'type': 'Point', 'coordinates': [13.5, 48.5]}},
+        {'type': 'Feature', 'properties': None, 'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[-1, -2.5e1], [3, 0], [1, 1], [-1, -2.5e1]]]}},
+        {'type': 'Feature', 'properties': {}, 'geometry': None},
+        {'type': 'Feature', 'properties': {'nested': [{'a': [1, True]}]},
+         'geometry': {'type': 'GeometryCollection', 'geometries': [
+             {'type': 'LineString', 'coordinates': [[100, 0], [101, 1]]},
+             {'type': 'MultiPoint', 'coordinates': []}]}},
+    ]
+}
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64 * 1024])
+def test_validate_should_summarize_whatever_the_chunk_size(size):
+    text = json.dumps(COLLECTION, indent=2, ensure_ascii=False)
+    summary = validate(chunked(text, size))
+    assert summary.features == 4
+    assert summary.bbox == [-1, -25, 101, 48.5]
+
+
+def test_validate_empty_collection():
+    summary = validate([b'{"type": "FeatureCollection", "features": []}'])
+    assert summary.features == 0
+    assert summary.bbox is None
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[]',
+    '{"type": "FeatureCollection"}',
+    '{"type": "Feature", "features": []}',
+    '{"type": "FeatureCollection", "features": []',
+    '{"type": "FeatureCollection", "features": []} []',
+    '{"type": "FeatureCollection", "features": [], }',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature"}]}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    '"geometry": {"type": "Point", "coordinates": [[1, 2]]}}]}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    '"geometry": {"type": "Point", "coordinates": [1]}}]}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    '"geometry": {"type": "Circle", "coordinates": [1, 2]}}]}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    '"geometry": {"type": "LineString", "coordinates": [[1, 2], [[1, 2]]]}}]}',
+    '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+    '"geometry": null, "properties": []}]}',
+    '{"type": "FeatureCollection", "features": [], "x": 1e}',
+    '{"type": "FeatureCollection", "features": [], "x": tru}',
+    '{"type": "FeatureCollection", "features": [], "x": "\x01"}',
+    '{"type": "FeatureCollection", "features": [], "x": ' + '[' * 100 +
+    ']' * 100 + '}',
+])
+def test_validate_should_reject_invalid_geojson(text):
+    with pytest.raises(GeoJSONError):
+        validate(chunked(text, 5))
+
+
+def test_validate_should_reject_invalid_utf8():
+    with pytest.raises(GeoJSONError):
+        validate([b'{"type": "\xff"}'])